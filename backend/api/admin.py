@@ -1,3 +1,11 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import GeneratedPlan
+
+
+@admin.register(GeneratedPlan)
+class GeneratedPlanAdmin(admin.ModelAdmin):
+    list_display = ("id", "member_id", "model_name", "prompt_version", "created_at")
+    list_filter = ("model_name", "prompt_version")
+    search_fields = ("member_id", "input_hash")
+    readonly_fields = ("created_at",)
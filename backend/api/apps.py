@@ -1,6 +1,21 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        """WARMUP_ON_STARTUP=1 の場合、サーバー起動時にバックグラウンドでウォームアップを開始する"""
+        if os.getenv("WARMUP_ON_STARTUP", "0") != "1":
+            return
+        # migrate などサーバー以外の管理コマンドと、runserver の自動リロード監視プロセスでは実行しない
+        command = sys.argv[1] if len(sys.argv) > 1 and sys.argv[0].endswith("manage.py") else None
+        if command not in (None, "runserver") or (command == "runserver" and os.environ.get("RUN_MAIN") != "true"):
+            return
+
+        from core.common.warmup import start_warmup
+        start_warmup()
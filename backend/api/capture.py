@@ -0,0 +1,152 @@
+"""
+Request capture for load testing.
+
+REQUEST_CAPTURE_FILE を設定すると、/api/generate/ と /api/extract-inbody/ へのリクエストを
+匿名化してJSONL（1行1件）に追記する。manage.py loadgen はこのファイルを再生する。
+
+匿名化:
+- member_id はソルト付きハッシュに置き換える（同じ会員のリクエストは同じ値になる）
+- 自由記述（既往歴 injuries、器具 equipment、schedule_notes / specific_requests）は同じ長さの伏せ字にする
+  （プロンプトの長さは保つ。既往歴のリストは要素ごとに伏せ字にし、件数も保つ）
+- 画像は既定では保存せず、SHA-256・サイズ・縦横だけを記録する（loadgen は同じ大きさの代替画像を生成する）。
+  縦横はビューが前処理した画像の値で、キャッシュヒットなど前処理しなかったリクエストでは記録しない。
+  REQUEST_CAPTURE_IMAGES=1 の場合のみ画像そのものを保存する
+"""
+import base64
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger(__name__)
+
+CAPTURED_PATHS = ("/api/generate/", "/api/extract-inbody/")
+# loadgen が再生したリクエストは収集しない（再生結果がコーパスに混ざらないようにする）
+LOADGEN_USER_AGENT = "project-trainer-loadgen"
+# 伏せ字にする自由記述（セクション → フィールド）。既往歴は病歴にあたるため必ず伏せる
+FREE_TEXT_FIELDS = {
+    "user_profile": ("injuries",),
+    "preferences": ("equipment", "schedule_notes", "specific_requests"),
+}
+MASK_CHARACTER = "＊"
+
+# 収集中のリクエストの画像の記録。ビューが前処理した画像の縦横をここに書き込む
+_image_record: contextvars.ContextVar = contextvars.ContextVar("capture_image_record", default=None)
+
+
+def anonymize_plan_request(payload: dict, salt: str) -> dict:
+    """/api/generate/ のリクエストから個人を特定できる値を取り除く"""
+    payload = json.loads(json.dumps(payload))
+    if payload.get("member_id"):
+        payload["member_id"] = "anon-" + hashlib.sha256(f"{salt}:{payload['member_id']}".encode("utf-8")).hexdigest()[:12]
+    for section, fields in FREE_TEXT_FIELDS.items():
+        values = payload.get(section)
+        if not isinstance(values, dict):
+            continue
+        for field in fields:
+            value = values.get(field)
+            if isinstance(value, str):
+                values[field] = MASK_CHARACTER * len(value)
+            elif isinstance(value, list):
+                values[field] = [MASK_CHARACTER * len(item) if isinstance(item, str) else item for item in value]
+    return payload
+
+
+def describe_image(uploaded_file, include_data: bool) -> dict:
+    """
+    アップロード画像の記録（内容は include_data の場合のみ）。
+
+    一時ファイルに退避された大きなアップロードを丸ごとメモリに展開しないよう、チャンク単位でハッシュを計算する。
+    """
+    hasher = hashlib.sha256()
+    chunks = []
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+        if include_data:
+            chunks.append(chunk)
+    uploaded_file.seek(0)
+
+    record = {
+        "content_type": uploaded_file.content_type,
+        "size": uploaded_file.size,
+        "sha256": hasher.hexdigest(),
+    }
+    if include_data:
+        record["data_b64"] = base64.b64encode(b"".join(chunks)).decode("ascii")
+    return record
+
+
+def note_preprocessed_image(width: int, height: int) -> None:
+    """前処理した画像の縦横を、収集中のリクエストの記録に加える（収集していなければ何もしない）"""
+    record = _image_record.get()
+    if record is not None and width and height:
+        record["width"], record["height"] = width, height
+
+
+class RequestCaptureMiddleware:
+    """LLMを呼び出すエンドポイントへのリクエストを負荷試験用のコーパスとして記録する"""
+
+    def __init__(self, get_response):
+        self.path = os.getenv("REQUEST_CAPTURE_FILE")
+        if not self.path:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = float(os.getenv("REQUEST_CAPTURE_SAMPLE_RATE", "1.0"))
+        self.include_images = os.getenv("REQUEST_CAPTURE_IMAGES", "0") == "1"
+        self.salt = os.getenv("REQUEST_CAPTURE_SALT", "")
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        if (
+            request.method != "POST"
+            or request.path not in CAPTURED_PATHS
+            or request.headers.get("User-Agent") == LOADGEN_USER_AGENT
+            or random.random() >= self.sample_rate
+        ):
+            return self.get_response(request)
+
+        # ビューより先に読み込む（multipart は request.FILES を経由するため、DRF も同じ内容を参照できる）
+        try:
+            record = self._describe(request)
+        except Exception as e:
+            logger.warning("Skipped request capture: %s", e)
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        token = _image_record.set(record.get("image"))
+        try:
+            response = self.get_response(request)
+        finally:
+            _image_record.reset(token)
+        record.update(
+            status=response.status_code,
+            latency=round(time.perf_counter() - started, 3),
+        )
+        self._append(record)
+        return response
+
+    def _describe(self, request) -> dict:
+        record = {
+            "captured_at": round(time.time(), 3),
+            "endpoint": request.path,
+            "idempotency_key": bool(request.headers.get("Idempotency-Key")),
+        }
+        if request.path == "/api/generate/":
+            record["json"] = anonymize_plan_request(json.loads(request.body), self.salt)
+        else:
+            image = request.FILES.get("image")
+            if image is None:
+                raise ValueError("image is missing")
+            record["image"] = describe_image(image, self.include_images)
+        return record
+
+    def _append(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
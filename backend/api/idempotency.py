@@ -0,0 +1,131 @@
+"""
+Request coalescing for plan generation.
+
+同一入力または同一 Idempotency-Key の /api/generate/ を1回のパイプライン実行にまとめる。
+プロセス内の同時リクエストは SingleFlight で、プロセス間は PlanRequest テーブル（一意キーの
+INSERTで実行権を取得）で共有する。完了した結果は Idempotency-Key の場合のみ IDEMPOTENCY_TTL_SECONDS の間
+保持し、入力のハッシュでまとめたリクエストは実行中のものにのみ合流する（同じ入力での再生成は新しく実行する）。
+"""
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Any, Callable, Tuple
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from core.common.cache import SingleFlight, FlightTimeout
+from core.common.resilience import remaining, DeadlineExceeded
+
+from .models import PlanRequest
+
+logger = logging.getLogger(__name__)
+
+# 他プロセスの実行完了を確認する間隔（秒）
+POLL_INTERVAL_SECONDS = 0.5
+
+_flight = SingleFlight()
+
+
+class IdempotencyConflict(Exception):
+    """同じ Idempotency-Key が異なる入力で使われた"""
+
+
+def _retention() -> timedelta:
+    return timedelta(seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "300")))
+
+
+def _claim(key: str, input_hash: str) -> bool:
+    """実行権を取得する（同じキーの行が既にあれば False）。期限切れの完了済み結果は先に削除する"""
+    PlanRequest.objects.filter(expires_at__lt=timezone.now()).delete()
+    try:
+        with transaction.atomic():
+            PlanRequest.objects.create(key=key, input_hash=input_hash)
+    except IntegrityError:
+        return False
+    return True
+
+
+def _wait_for_result(key: str, input_hash: str, stale_after: float):
+    """
+    他の呼び出し元（別プロセスを含む）の実行完了を待つ。
+
+    Returns:
+        (結果, 待たずに完了済みだったか)。実行が失敗・放棄された場合は (None, False)
+    """
+    first_check = True
+    while True:
+        record = PlanRequest.objects.filter(key=key).first()
+        if record is None:
+            return None, False
+        if record.input_hash != input_hash:
+            raise IdempotencyConflict("この Idempotency-Key は異なる入力のリクエストで使用されています")
+        if record.state == PlanRequest.STATE_DONE:
+            return record.result, first_check
+
+        # 実行中のプロセスが異常終了した場合に備え、締め切りを過ぎた実行は放棄されたものとみなす
+        if (timezone.now() - record.created_at).total_seconds() > stale_after:
+            logger.warning("Abandoning stale in-flight request: %s", key)
+            PlanRequest.objects.filter(key=key, state=PlanRequest.STATE_RUNNING, created_at=record.created_at).delete()
+            return None, False
+
+        left = remaining()
+        if left is not None and left <= POLL_INTERVAL_SECONDS:
+            raise DeadlineExceeded("同じリクエストの実行が締め切りまでに完了しませんでした")
+        first_check = False
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def _run_once(key: str, input_hash: str, fn: Callable[[], Any], stale_after: float, retain: bool) -> Tuple[Any, str]:
+    while True:
+        if _claim(key, input_hash):
+            try:
+                result = fn()
+            except BaseException:
+                # 失敗した結果は保持せず、待機中・後続のリクエストが再実行できるようにする
+                PlanRequest.objects.filter(key=key).delete()
+                raise
+            # 保持しない結果も、完了を待っている他プロセスが読めるよう即時に期限切れとして残す
+            # （次に同じキーで実行権を取得するときに削除される）
+            PlanRequest.objects.filter(key=key).update(
+                state=PlanRequest.STATE_DONE,
+                result=result,
+                expires_at=timezone.now() + (_retention() if retain else timedelta(0)),
+            )
+            return result, "MISS"
+
+        result, completed = _wait_for_result(key, input_hash, stale_after)
+        if result is not None:
+            return result, "HIT" if completed else "SHARED"
+
+
+def coalesce(key: str, input_hash: str, fn: Callable[[], Any], stale_after: float, retain: bool = True) -> Tuple[Any, str]:
+    """
+    同じキーの実行を1回にまとめて fn の結果を返す。fn の結果はJSONに変換できる必要がある。
+
+    Args:
+        key: まとめる単位（Idempotency-Key または入力のハッシュ）
+        input_hash: 入力データのハッシュ（同じキーで異なる入力の場合は IdempotencyConflict）
+        fn: 実行本体
+        stale_after: 実行中の行をこの秒数で放棄されたものとみなす
+        retain: 完了した結果を IDEMPOTENCY_TTL_SECONDS の間保持するか（False の場合は実行中のみまとめる）
+
+    Returns:
+        (結果, "MISS": 実行した / "SHARED": 実行中のリクエストに合流した / "HIT": 完了済みの結果を再利用した)
+    """
+    # プロセス内の後続の呼び出しも、締め切りと stale_after を超えて先行する実行を待たない
+    left = remaining()
+    wait = stale_after if left is None else min(stale_after, left)
+    try:
+        (result, source), shared = _flight.do(
+            (key, input_hash), lambda: _run_once(key, input_hash, fn, stale_after, retain), timeout=wait
+        )
+    except FlightTimeout:
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded("同じリクエストの実行が締め切りまでに完了しませんでした")
+        # 先行する実行が stale_after を過ぎても終わらない場合は、他プロセスと同じく放棄されたものとみなして実行権を取り直す
+        logger.warning("In-process leader exceeded stale_after; claiming the request: %s", key)
+        return _run_once(key, input_hash, fn, stale_after, retain)
+    return result, "SHARED" if shared and source == "MISS" else source
@@ -0,0 +1,113 @@
+"""
+rag モード（ツール呼び出しループで知識を検索）と full_context モード（知識ベース全体をコンテキストキャッシュから参照）の比較。
+
+使い方:
+    python manage.py bench_context_mode
+    python manage.py bench_context_mode --modes full_context --repeat 3
+
+モードごとにパイプライン全体を実行し、レイテンシ・入力/キャッシュ/出力トークン・推定コストと、
+入力から機械的に確認できる品質チェック（体型判定・既往歴への対応・日数・環境・動作手順）の通過率を比較する。
+GOOGLE_API_KEY が必要。コンテキストキャッシュの保存料金は推定コストに含まない。
+"""
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from .bench_serialization import SAMPLE_REQUEST
+
+# 家トレで使えない器具・設備を含む種目名
+GYM_ONLY_KEYWORDS = ("マシン", "バーベル", "ケーブル", "スミス")
+
+BENCHMARK_INPUTS = [
+    SAMPLE_REQUEST,
+    {
+        **SAMPLE_REQUEST,
+        "user_profile": {**SAMPLE_REQUEST["user_profile"], "gender": "女性", "height_cm": 158.0, "injuries": ["腰痛"]},
+        "inbody_metrics": {**SAMPLE_REQUEST["inbody_metrics"], "weight_kg": 52.0, "skeletal_muscle_mass_kg": 19.0, "body_fat_percent": 31.0},
+        "goal": {"type": "ダイエット", "days_per_week": "3"},
+        "preferences": {"environment": "home", "training_time_minutes": "30", "equipment": "なし"},
+    },
+    {
+        **SAMPLE_REQUEST,
+        "user_profile": {**SAMPLE_REQUEST["user_profile"], "training_experience": "上級者", "injuries": []},
+        "goal": {"type": "筋肥大", "days_per_week": "5"},
+        "preferences": {"environment": "gym", "training_time_minutes": "90", "equipment": "フル設備"},
+    },
+]
+
+
+def quality_checks(input_data: dict, analysis_report: dict, training_plan: dict) -> dict:
+    """入力から機械的に確認できる品質チェックの結果"""
+    from core.analyzer.tools import body_type_from_input
+
+    exercises = [exercise for day in training_plan["weekly_schedule"] for exercise in day["exercises"]]
+    addressed = " ".join(analysis_report["risk_factors"] + training_plan["modifications"])
+    days = input_data["goal"].get("days_per_week", "")
+
+    checks = {
+        "body_type": (body_type_from_input(input_data) or "") in analysis_report["body_type"],
+        "injuries": all(injury in addressed for injury in input_data["user_profile"]["injuries"]),
+        "instructions": all(len(exercise["instructions"]) >= 2 for exercise in exercises),
+    }
+    if days.isdigit():
+        checks["days"] = len(training_plan["weekly_schedule"]) == int(days)
+    if input_data["preferences"]["environment"] == "home":
+        checks["environment"] = not any(
+            keyword in exercise["exercise_name"] for exercise in exercises for keyword in GYM_ONLY_KEYWORDS
+        )
+    return checks
+
+
+class Command(BaseCommand):
+    help = "rag モードと full_context モードのレイテンシ・トークン課金・出力品質を比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--modes", nargs="+", default=["rag", "full_context"])
+        parser.add_argument("--repeat", type=int, default=1)
+
+    def handle(self, *args, **options):
+        if not os.getenv("GOOGLE_API_KEY"):
+            self.stderr.write("スキップ: GOOGLE_API_KEY が設定されていません")
+            return
+
+        from api.schemas import TrainingRequest
+        from core.common.metrics import get_llm_metrics, summarize
+        from core.orchestrator.graph import build_orchestrator, create_initial_state
+
+        inputs = [TrainingRequest.model_validate(data).model_dump() for data in BENCHMARK_INPUTS]
+        body_types = {}
+
+        for mode in options["modes"]:
+            app = build_orchestrator(context_mode=mode)
+            get_llm_metrics().reset()
+            latencies = []
+            passed = total = 0
+
+            for _ in range(options["repeat"]):
+                for i, input_data in enumerate(inputs):
+                    start = time.perf_counter()
+                    result = app.invoke(create_initial_state(input_data))
+                    latencies.append(time.perf_counter() - start)
+
+                    checks = quality_checks(input_data, result["analysis_report"], result["training_plan"])
+                    passed += sum(checks.values())
+                    total += len(checks)
+                    body_types.setdefault(i, {})[mode] = result["analysis_report"]["body_type"]
+
+            runs = len(latencies)
+            usage = summarize()
+            self.stdout.write(
+                f"[{mode}] runs={runs} "
+                f"p50={statistics.median(latencies):.1f}s max={max(latencies):.1f}s "
+                f"LLM呼び出し/回={usage['calls'] / runs:.1f} "
+                f"入力={usage['input_tokens'] / runs:.0f}tok（うちキャッシュ {usage['cached_input_tokens'] / runs:.0f}） "
+                f"出力={usage['output_tokens'] / runs:.0f}tok "
+                f"推定コスト/回=${usage['estimated_cost_usd'] / runs:.5f} "
+                f"品質チェック={passed}/{total}"
+            )
+
+        if len(options["modes"]) > 1:
+            agreed = sum(len(set(modes.values())) == 1 for modes in body_types.values())
+            self.stdout.write(f"体型判定の一致: {agreed}/{len(body_types)}")
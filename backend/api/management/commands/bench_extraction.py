@@ -0,0 +1,110 @@
+"""
+InBody画像抽出の前処理ありなしの比較ベンチマーク。
+
+使い方:
+    python manage.py bench_extraction samples/
+    python manage.py bench_extraction samples/ --expected samples/expected.json
+    python manage.py bench_extraction samples/ --compare-modes
+    LLM_ROUTES='{"vision.direct": {"model": "gemini-2.5-flash-lite"}}' python manage.py bench_extraction samples/
+
+expected.json はファイル名 → 正解値（InBodyDataと同じキー）の辞書。
+数値は ±0.1 以内を正解とみなし、フィールド単位の正解率を集計する。
+GOOGLE_API_KEY が無い場合は送信バイト数のみを計測する。
+LLM_ROUTES を変えて実行すると、モデルの階層ごとのレイテンシ・推定コスト・正解率を比較できる。
+"""
+import json
+import mimetypes
+import os
+import statistics
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".heic"}
+NUMERIC_TOLERANCE = 0.1
+
+
+def _flatten(data: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def _accuracy(extracted: dict, expected: dict) -> tuple:
+    expected_fields = _flatten(expected)
+    extracted_fields = _flatten(extracted)
+    correct = sum(
+        1 for key, value in expected_fields.items()
+        if key in extracted_fields and abs(extracted_fields[key] - value) <= NUMERIC_TOLERANCE
+    )
+    return correct, len(expected_fields)
+
+
+class Command(BaseCommand):
+    help = "InBody画像抽出の送信バイト数・レイテンシ・正解率を前処理ありなしで比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="画像ファイル、または画像を含むディレクトリ")
+        parser.add_argument("--expected", help="ファイル名 → 正解値のJSON")
+        parser.add_argument(
+            "--compare-modes",
+            action="store_true",
+            help="前処理済み画像で auto（1回呼び出し）と agentic（2段階）の抽出モードも比較する",
+        )
+
+    def handle(self, *args, **options):
+        from core.extractor.inbody import extract_inbody_data
+        from core.extractor.preprocess import preprocess_image
+        from core.common.metrics import get_llm_metrics, summarize
+
+        path = Path(options["path"])
+        images = sorted(p for p in (path.iterdir() if path.is_dir() else [path]) if p.suffix.lower() in IMAGE_SUFFIXES)
+        expected = json.loads(Path(options["expected"]).read_text(encoding="utf-8")) if options["expected"] else {}
+        call_api = bool(os.getenv("GOOGLE_API_KEY"))
+        if not call_api:
+            self.stderr.write("GOOGLE_API_KEY が設定されていないため、送信バイト数のみを計測します")
+
+        # (ラベル, 前処理するか, 抽出モード)
+        variants = [("raw", False, "auto"), ("preprocessed", True, "auto")]
+        if options["compare_modes"]:
+            variants.append(("preprocessed/agentic", True, "agentic"))
+
+        for label, preprocess, extraction_mode in variants:
+            sent_bytes, latencies = [], []
+            correct = total = 0
+            get_llm_metrics().reset()
+
+            for image_path in images:
+                content_type = mimetypes.guess_type(image_path.name)[0] or "image/heic"
+                with open(image_path, "rb") as f:
+                    start = time.perf_counter()
+                    if not preprocess:
+                        data, mime_type = f.read(), content_type
+                    else:
+                        prepared = preprocess_image(f, content_type)
+                        data, mime_type = prepared.data, prepared.mime_type
+                    sent_bytes.append(len(data))
+
+                    if not call_api:
+                        continue
+                    result = extract_inbody_data(data, mime_type, mode=extraction_mode)
+                    latencies.append(time.perf_counter() - start)
+
+                if image_path.name in expected:
+                    ok, n = _accuracy(result, expected[image_path.name])
+                    correct += ok
+                    total += n
+
+            summary = f"[{label}] {len(images)}枚 平均送信={statistics.mean(sent_bytes) / 1024:.0f}KB" if sent_bytes else f"[{label}] 画像なし"
+            if latencies:
+                usage = summarize()
+                summary += f" 平均レイテンシ={statistics.mean(latencies):.2f}s 最大={max(latencies):.2f}s"
+                summary += f" 推定コスト=${usage['estimated_cost_usd']:.4f}（エスカレーション{usage['escalations']}回）"
+            if total:
+                summary += f" 正解率={correct}/{total} ({correct / total:.0%})"
+            self.stdout.write(summary)
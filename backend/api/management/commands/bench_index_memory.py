@@ -0,0 +1,102 @@
+"""
+ワーカー数を増やしたときの、ナレッジ索引によるプロセスごとのメモリを計測する。
+
+使い方:
+    python manage.py bench_index_memory
+    python manage.py bench_index_memory --workers 1 2 4 8 --synthetic-rows 20000
+
+各ワーカーは索引を開いて全ページを読み、全員が揃った時点で /proc/self/smaps_rollup から
+USS（そのプロセス専有）と PSS（共有ページを共有数で按分）を読み取る。
+mmap は共有ページのためワーカー数が増えてもUSSが増えず、copy（np.load で全件読み込み）は
+ワーカーごとに索引1つ分ずつ増える。Linux専用。
+"""
+import multiprocessing
+import statistics
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+MODES = ("mmap", "copy")
+
+
+def _memory_kb() -> dict:
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "pss": fields.get("Pss", 0),
+    }
+
+
+def _worker(index_dir: str, mode: str, barrier, results) -> None:
+    from core.common.mmap_index import MmapVectorIndex, EMBEDDINGS_FILE
+
+    baseline = _memory_kb()
+    if mode == "mmap":
+        embeddings = MmapVectorIndex(Path(index_dir)).embeddings
+    else:
+        embeddings = np.load(Path(index_dir) / EMBEDDINGS_FILE)
+    # 検索と同じく全行に触れてページを読み込む
+    float(embeddings @ np.ones(embeddings.shape[1], dtype=np.float32) @ np.ones(embeddings.shape[0], dtype=np.float32))
+
+    barrier.wait()
+    measured = _memory_kb()
+    results.put({key: measured[key] - baseline[key] for key in measured})
+    barrier.wait()
+
+
+class Command(BaseCommand):
+    help = "mmap索引とプロセスごとのコピーで、ワーカー数に対するメモリ使用量を比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8])
+        parser.add_argument("--index", help="計測する索引（省略時は --synthetic-rows 件の合成索引を作成）")
+        parser.add_argument("--synthetic-rows", type=int, default=20000)
+        parser.add_argument("--dimension", type=int, default=3072)
+
+    def handle(self, *args, **options):
+        from core.common.mmap_index import write_index, EMBEDDINGS_FILE
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_dir = options["index"]
+            if index_dir is None:
+                rows = options["synthetic_rows"]
+                index_dir = write_index(
+                    Path(tmp_dir),
+                    ids=[str(i) for i in range(rows)],
+                    texts=[""] * rows,
+                    metadatas=[{}] * rows,
+                    embeddings=np.random.default_rng(0).standard_normal((rows, options["dimension"]), dtype=np.float32),
+                )
+
+            size_mb = (Path(index_dir) / EMBEDDINGS_FILE).stat().st_size / 1024 / 1024
+            self.stdout.write(f"索引: {index_dir}（埋め込み {size_mb:.1f}MB）")
+
+            # 親プロセスのヒープのコピーオンライトを計測に含めないよう、独立したプロセスとして起動する
+            context = multiprocessing.get_context("spawn")
+            for mode in MODES:
+                for workers in options["workers"]:
+                    barrier = context.Barrier(workers)
+                    results = context.Queue()
+                    processes = [
+                        context.Process(target=_worker, args=(str(index_dir), mode, barrier, results))
+                        for _ in range(workers)
+                    ]
+                    for process in processes:
+                        process.start()
+                    measured = [results.get() for _ in processes]
+                    for process in processes:
+                        process.join()
+
+                    self.stdout.write(
+                        f"[{mode}] workers={workers} "
+                        f"USS/ワーカー={statistics.mean(m['uss'] for m in measured) / 1024:.1f}MB "
+                        f"PSS/ワーカー={statistics.mean(m['pss'] for m in measured) / 1024:.1f}MB "
+                        f"PSS合計={sum(m['pss'] for m in measured) / 1024:.1f}MB"
+                    )
@@ -0,0 +1,109 @@
+"""
+ナレッジ検索バックエンドのベンチマーク。
+
+使い方:
+    python manage.py bench_retrieval
+    python manage.py bench_retrieval --backends bm25 hybrid --k 2 --repeat 5
+    python manage.py bench_retrieval --backends bm25 --k 2 --scoped
+
+各クエリには「上位k件に含まれるべき見出しセクション番号」を正解として持たせ、
+バックエンドごとにレイテンシ・正解セクションの再現率・コンテキスト文字数を比較する。
+--scoped では各クエリを発行するツールのコレクションのみを検索する（ナレッジ全体の検索との比較用）。
+vector / hybrid の計測には GOOGLE_API_KEY が必要。
+"""
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+# (クエリ, 上位に含まれるべきセクション番号, そのクエリを発行するツール)
+BENCHMARK_QUERIES = [
+    ("隠れ肥満型 アドバイス 体脂肪率 判定", {"8"}, "retriever_tool"),
+    ("痩せ型 栄養戦略 増量", {"1"}, "training_retriever_tool"),
+    ("筋肉型スリム 有酸素運動", {"4"}, "training_retriever_tool"),
+    ("膝痛 リスク 対策 代替種目", {"16"}, "risk_modification_tool"),
+    ("腰痛 コア強化 安全な腹筋", {"40"}, "risk_modification_tool"),
+    ("体脂肪率 軽度肥満 基準", {"13"}, "retriever_tool"),
+    ("骨格筋量 評価 基準", {"15"}, "retriever_tool"),
+    ("左右差 ユニラテラル種目", {"22"}, "retriever_tool"),
+    ("初級者 線形プログレッション", {"19"}, "training_retriever_tool"),
+    ("ダンベルの背中種目 ワンアームロウ", {"34"}, "training_retriever_tool"),
+    ("家でできる脚トレ 自重スクワット", {"25"}, "training_retriever_tool"),
+    ("リカバリー 睡眠 サプリメント クレアチン", {"23", "24"}, "training_retriever_tool"),
+]
+
+
+def _tool_collections() -> dict:
+    from core.analyzer.tools import RETRIEVER_COLLECTIONS
+    from core.planner.tools import RISK_COLLECTIONS, TRAINING_COLLECTIONS
+
+    return {
+        "retriever_tool": RETRIEVER_COLLECTIONS,
+        "training_retriever_tool": TRAINING_COLLECTIONS,
+        "risk_modification_tool": RISK_COLLECTIONS,
+    }
+
+
+def _section_number(result_block: str) -> str:
+    """【結果n】ブロックの先頭見出し（## 12. ...）からセクション番号を取り出す"""
+    for line in result_block.splitlines():
+        if line.startswith("## "):
+            return line[3:].split(".", 1)[0].strip()
+    return ""
+
+
+class Command(BaseCommand):
+    help = "ナレッジ検索バックエンド（vector / bm25 / hybrid）のレイテンシと精度を比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backends", nargs="+", default=["vector", "bm25", "hybrid"])
+        parser.add_argument("--k", type=int, default=3)
+        parser.add_argument("--fetch-k", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--scoped", action="store_true", help="ナレッジ全体ではなく、各クエリを発行するツールのコレクションのみを検索する")
+
+    def handle(self, *args, **options):
+        from core.common.db_client import DEFAULT_COLLECTION
+        from core.common.retriever import search_knowledge
+
+        tool_collections = _tool_collections()
+        scope = "scoped" if options["scoped"] else "all"
+        for backend in options["backends"]:
+            if backend != "bm25" and not os.getenv("GOOGLE_API_KEY"):
+                # フォールバック先のBM25を計測してしまわないよう、APIキーがなければスキップ
+                self.stderr.write(f"[{backend}] スキップ: GOOGLE_API_KEY が設定されていません")
+                continue
+
+            latencies = []
+            hits = 0
+            context_chars = 0
+
+            try:
+                # 初回のインデックス構築・DB接続はウォームアップとして計測から除外
+                search_knowledge("ウォームアップ", k=options["k"], fetch_k=options["fetch_k"], backend=backend)
+            except Exception as e:
+                self.stderr.write(f"[{backend}] スキップ: {e}")
+                continue
+
+            for query, expected, tool in BENCHMARK_QUERIES:
+                collections = tool_collections[tool] if options["scoped"] else (DEFAULT_COLLECTION,)
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    text = search_knowledge(
+                        query, k=options["k"], fetch_k=options["fetch_k"], backend=backend, collections=collections
+                    )
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+                found = {_section_number(block) for block in text.split("【結果")[1:]}
+                hits += bool(expected & found)
+                context_chars += len(text)
+
+            latencies.sort()
+            self.stdout.write(
+                f"[{backend}/{scope}] k={options['k']} "
+                f"p50={statistics.median(latencies):.2f}ms "
+                f"p95={latencies[int(len(latencies) * 0.95) - 1]:.2f}ms "
+                f"hit@k={hits}/{len(BENCHMARK_QUERIES)} "
+                f"平均コンテキスト={context_chars / len(BENCHMARK_QUERIES):.0f}文字"
+            )
@@ -0,0 +1,123 @@
+"""
+/api/generate/ の入力パース・出力シリアライズのベンチマーク（DRFシリアライザ vs Pydanticスキーマ）。
+
+使い方:
+    python manage.py bench_serialization
+    python manage.py bench_serialization --days 7 --exercises 10 --repeat 500
+
+DRF: JSONParser → TrainingRequestSerializer.is_valid() / TrainingResponseSerializer.is_valid() → JSONRenderer
+Pydantic: TrainingRequest.model_validate_json() / TrainingResponse.model_validate() → model_dump_json()
+"""
+import io
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+SAMPLE_REQUEST = {
+    "user_profile": {"age": 30, "gender": "男性", "height_cm": 170.0, "training_experience": "初級者", "injuries": ["膝痛"]},
+    "inbody_metrics": {
+        "weight_kg": 70.0, "muscle_mass_kg": 30.0, "skeletal_muscle_mass_kg": 28.0, "body_fat_percent": 20.0,
+        "segmental_lean": {"right_arm": 3.0, "left_arm": 2.9, "trunk": 25.0, "right_leg": 9.0, "left_leg": 8.8},
+    },
+    "goal": {"type": "ダイエット", "days_per_week": "3"},
+    "preferences": {"environment": "gym", "training_time_minutes": "60", "equipment": "ダンベル"},
+}
+
+SAMPLE_REPORT = {
+    "body_type": "隠れ肥満型",
+    "body_fat_evaluation": "軽度肥満（体脂肪率24.5%）",
+    "skeletal_muscle_evaluation": "やや低い（体重比38%）",
+    "arm_balance": "正常（差分3%）",
+    "leg_balance": "正常（差分2%）",
+    "upper_lower_balance": "下肢がやや弱い",
+    "risk_factors": ["膝痛", "体幹の弱さ"],
+    "concerns": ["急激な減量による筋量低下"],
+}
+
+
+def sample_plan(days: int, exercises: int) -> dict:
+    return {
+        "split_method": "上下分割",
+        "split_rationale": "週4日で各部位を週2回刺激できるため",
+        "weekly_schedule": [
+            {
+                "day_label": f"Day {day + 1}",
+                "focus": "上半身" if day % 2 == 0 else "下半身",
+                "exercises": [
+                    {
+                        "target_area": "胸",
+                        "exercise_name": f"ダンベルベンチプレス {i + 1}",
+                        "sets": 3,
+                        "reps": "8-12",
+                        "interval_seconds": 90,
+                        "notes": "肩甲骨を寄せたまま下ろす",
+                        "instructions": ["ベンチに仰向けになる", "胸の横までダンベルを下ろす", "肘を伸ばして押し上げる"],
+                    }
+                    for i in range(exercises)
+                ],
+            }
+            for day in range(days)
+        ],
+        "modifications": ["膝痛のためランジをレッグプレスに変更"],
+        "priority_points": ["フォームを優先する", "週ごとに重量を2.5%ずつ増やす"],
+        "nutrition_tips": ["体重1kgあたり1.6gのタンパク質を摂る"],
+    }
+
+
+def _measure(fn, repeat: int) -> list:
+    fn()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return sorted(latencies)
+
+
+class Command(BaseCommand):
+    help = "/api/generate/ の入出力をDRFシリアライザとPydanticスキーマで処理した場合のCPU時間を比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7)
+        parser.add_argument("--exercises", type=int, default=8)
+        parser.add_argument("--repeat", type=int, default=300)
+
+    def handle(self, *args, **options):
+        from rest_framework.parsers import JSONParser
+        from rest_framework.renderers import JSONRenderer
+        from api.schemas import TrainingRequest, TrainingResponse
+        from api.serializers import TrainingRequestSerializer, TrainingResponseSerializer
+
+        body = json.dumps(SAMPLE_REQUEST, ensure_ascii=False).encode("utf-8")
+        result = {"analysis_report": SAMPLE_REPORT, "training_plan": sample_plan(options["days"], options["exercises"])}
+
+        def drf_input():
+            serializer = TrainingRequestSerializer(data=JSONParser().parse(io.BytesIO(body)))
+            serializer.is_valid(raise_exception=True)
+            return dict(serializer.validated_data)
+
+        def pydantic_input():
+            return TrainingRequest.model_validate_json(body).model_dump()
+
+        def drf_output():
+            serializer = TrainingResponseSerializer(data=result)
+            serializer.is_valid(raise_exception=True)
+            return JSONRenderer().render(serializer.data)
+
+        def pydantic_output():
+            return TrainingResponse.model_validate(result).model_dump_json().encode("utf-8")
+
+        self.stdout.write(
+            f"プラン: {options['days']}日 × {options['exercises']}種目 "
+            f"（レスポンス {len(pydantic_output()) / 1024:.1f}KB）"
+        )
+        for name, drf, fast in (("input", drf_input, pydantic_input), ("output", drf_output, pydantic_output)):
+            drf_latencies = _measure(drf, options["repeat"])
+            fast_latencies = _measure(fast, options["repeat"])
+            self.stdout.write(
+                f"[{name}] drf p50={statistics.median(drf_latencies):.3f}ms "
+                f"pydantic p50={statistics.median(fast_latencies):.3f}ms "
+                f"（{statistics.median(drf_latencies) / statistics.median(fast_latencies):.1f}倍）"
+            )
@@ -0,0 +1,45 @@
+"""
+Chroma のナレッジ（チャンク本文・ID・埋め込み行列）を読み取り専用のメモリマップ索引に書き出す。
+
+使い方:
+    python manage.py export_knowledge_index
+    python manage.py export_knowledge_index --output /app/data/knowledge_index
+
+書き出した索引は KNOWLEDGE_VECTOR_INDEX=mmap で使われ、全ワーカープロセスが同じ物理ページを共有する。
+ナレッジ全体は書き出し先の直下に、各コレクション（body_types / exercises など）はその下の
+コレクション名のディレクトリに書き出す。
+Chroma が空の場合は埋め込みを作成するため GOOGLE_API_KEY が必要。
+"""
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Chroma のナレッジをメモリマップ索引（embeddings.npy + chunks.json）に書き出す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", help="書き出し先ディレクトリ（既定は KNOWLEDGE_INDEX_DIR または data/knowledge_index）")
+
+    def handle(self, *args, **options):
+        import os
+        from core.common.db_client import (
+            get_vectorstore, mmap_index_dir, KNOWLEDGE_COLLECTIONS, KNOWLEDGE_FILE, EMBEDDING_MODEL,
+        )
+        from core.common.mmap_index import DEFAULT_INDEX_DIR, write_index, file_sha256
+
+        output = Path(options["output"] or os.getenv("KNOWLEDGE_INDEX_DIR", DEFAULT_INDEX_DIR))
+        source_sha256 = file_sha256(KNOWLEDGE_FILE)
+
+        for collection in KNOWLEDGE_COLLECTIONS:
+            data = get_vectorstore(collection).get(include=["documents", "metadatas", "embeddings"])
+            index_dir = write_index(
+                mmap_index_dir(collection, root=output),
+                ids=data["ids"],
+                texts=data["documents"],
+                metadatas=data["metadatas"],
+                embeddings=data["embeddings"],
+                source_sha256=source_sha256,
+                embedding_model=EMBEDDING_MODEL,
+            )
+            self.stdout.write(f"{collection}: {len(data['ids'])}件のチャンクを書き出しました: {index_dir}")
@@ -0,0 +1,216 @@
+"""
+Gemini API のローカル代替HTTPサーバー（負荷試験用。クォータを消費せずにノードの処理能力を測る）。
+
+使い方:
+    python manage.py fake_gemini --port 8765 --latency-ms 1500 --jitter-ms 500
+    GOOGLE_GEMINI_BASE_URL=http://127.0.0.1:8765/ GOOGLE_API_KEY=fake python manage.py runserver
+
+google-genai SDK（LangChainの ChatGoogleGenerativeAI・埋め込みを含む）は GOOGLE_GEMINI_BASE_URL の
+サーバーに接続するため、アプリ側の変更なしに差し替えられる。応答は以下のとおり:
+
+- generateContent: 構造化出力（responseJsonSchema / responseSchema）はスキーマを満たす値を生成して返す。
+  ツール付きの呼び出しは、関数の実行結果が --tool-turns 回分そろうまで最初のツールを呼び出し、以降はテキストを返す
+- batchEmbedContents / embedContent: テキストのハッシュから決まる --embedding-dim 次元のベクトル
+- cachedContents: 作成・一覧のみ（内容は保持しない）
+
+レイテンシは平均 --latency-ms ± --jitter-ms の一様分布で、--error-rate の割合で503を返す。
+トークン数はリクエスト・応答の文字数から概算する。
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+MODEL_ACTION = re.compile(r"/models/(?P<model>[^/:]+):(?P<action>\w+)$")
+
+
+def fake_instance(schema: dict, root: dict = None):
+    """JSON Schema（またはGeminiのOpenAPI形式のスキーマ）を満たす値を生成する"""
+    root = root or schema
+    if "$ref" in schema:
+        target = root
+        for part in schema["$ref"].lstrip("#/").split("/"):
+            target = target[part]
+        return fake_instance(target, root)
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            options = [option for option in schema[key] if str(option.get("type", "")).lower() != "null"]
+            return fake_instance(options[0] if options else schema[key][0], root)
+    if "enum" in schema:
+        return schema["enum"][0]
+
+    schema_type = str(schema.get("type", "object")).lower()
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        return {name: fake_instance(prop, root) for name, prop in properties.items()}
+    if schema_type == "array":
+        return [fake_instance(schema.get("items", {}), root) for _ in range(max(1, schema.get("minItems", 1)))]
+    if schema_type in ("number", "integer"):
+        low, high = schema.get("minimum"), schema.get("maximum")
+        value = (low + high) / 2 if low is not None and high is not None else low if low is not None else 50 if schema_type == "number" else 3
+        return int(value) if schema_type == "integer" else float(value)
+    if schema_type == "boolean":
+        return False
+    return schema.get("title") or "sample"
+
+
+def fake_embedding(text: str, dimension: int) -> list:
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    return [rng.uniform(-1, 1) for _ in range(dimension)]
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> tuple:
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+        return (json.loads(raw) if raw else {}), len(raw)
+
+    def do_GET(self):
+        if self.path.split("?")[0].endswith("/cachedContents"):
+            return self._send(200, {"cachedContents": []})
+        self._send(404, {"error": {"code": 404, "message": f"not found: {self.path}", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        options = self.server.options
+        body, size = self._read_json()
+        path = self.path.split("?")[0]
+
+        if path.endswith("/cachedContents"):
+            expire_time = datetime.now(timezone.utc) + timedelta(seconds=float(body.get("ttl", "3600s").rstrip("s")))
+            return self._send(200, {
+                "name": f"cachedContents/fake-{hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()[:12]}",
+                "displayName": body.get("displayName", ""),
+                "model": body.get("model", ""),
+                "expireTime": expire_time.isoformat().replace("+00:00", "Z"),
+            })
+
+        match = MODEL_ACTION.search(path)
+        if match is None:
+            return self._send(404, {"error": {"code": 404, "message": f"not found: {self.path}", "status": "NOT_FOUND"}})
+
+        action = match.group("action")
+        if action == "batchEmbedContents":
+            return self._send(200, {"embeddings": [
+                {"values": fake_embedding(json.dumps(request.get("content")), options["embedding_dim"])}
+                for request in body.get("requests", [])
+            ]})
+        if action == "embedContent":
+            return self._send(200, {"embedding": {"values": fake_embedding(json.dumps(body.get("content")), options["embedding_dim"])}})
+        if action not in ("generateContent", "countTokens"):
+            return self._send(404, {"error": {"code": 404, "message": f"unsupported action: {action}", "status": "NOT_FOUND"}})
+        if action == "countTokens":
+            return self._send(200, {"totalTokens": size // 4})
+
+        time.sleep(max(0.0, random.uniform(
+            options["latency_ms"] - options["jitter_ms"], options["latency_ms"] + options["jitter_ms"]
+        )) / 1000)
+        if random.random() < options["error_rate"]:
+            return self._send(503, {"error": {"code": 503, "message": "fake overload", "status": "UNAVAILABLE"}})
+
+        part = self._response_part(body, options["tool_turns"])
+        output_chars = len(json.dumps(part, ensure_ascii=False))
+        self._send(200, {
+            "candidates": [{"content": {"role": "model", "parts": [part]}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {
+                "promptTokenCount": size // 4,
+                "candidatesTokenCount": output_chars // 4,
+                "totalTokenCount": size // 4 + output_chars // 4,
+            },
+            "modelVersion": match.group("model"),
+        })
+
+    @staticmethod
+    def _response_part(body: dict, tool_turns: int) -> dict:
+        config = body.get("generationConfig", {})
+        schema = config.get("responseJsonSchema") or config.get("responseSchema")
+        if schema:
+            return {"text": json.dumps(fake_instance(schema), ensure_ascii=False)}
+
+        declarations = [
+            declaration
+            for tool in body.get("tools", [])
+            for declaration in tool.get("functionDeclarations", [])
+        ]
+        responses = sum(
+            1 for content in body.get("contents", []) for part in content.get("parts", []) if "functionResponse" in part
+        )
+        if declarations and responses < tool_turns:
+            declaration = declarations[0]
+            return {"functionCall": {
+                "name": declaration["name"],
+                "args": fake_instance(declaration.get("parameters") or {"type": "object"}),
+            }}
+        return {"text": "OK"}
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0, **options) -> ThreadingHTTPServer:
+    """代替サーバーを作成する（port=0 で空きポートを使う。起動は serve_forever）"""
+    server = ThreadingHTTPServer((host, port), FakeGeminiHandler)
+    server.daemon_threads = True
+    server.options = {
+        "latency_ms": 0.0,
+        "jitter_ms": 0.0,
+        "error_rate": 0.0,
+        "tool_turns": 1,
+        "embedding_dim": 3072,
+        **options,
+    }
+    return server
+
+
+def start_in_thread(**options) -> ThreadingHTTPServer:
+    """バックグラウンドスレッドで起動し、サーバーを返す（テスト・ベンチマーク用）"""
+    server = make_server(**options)
+    threading.Thread(target=server.serve_forever, name="fake-gemini", daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    help = "Gemini API のローカル代替HTTPサーバーを起動する（GOOGLE_GEMINI_BASE_URL で接続先を切り替える）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency-ms", type=float, default=1500, help="generateContent の平均レイテンシ")
+        parser.add_argument("--jitter-ms", type=float, default=500)
+        parser.add_argument("--error-rate", type=float, default=0.0, help="503を返す割合")
+        parser.add_argument("--tool-turns", type=int, default=1, help="ツール付きの呼び出しでツールを呼ぶターン数")
+        parser.add_argument("--embedding-dim", type=int, default=3072, help="ナレッジ索引の埋め込み次元に合わせる")
+
+    def handle(self, *args, **options):
+        server = make_server(
+            options["host"],
+            options["port"],
+            latency_ms=options["latency_ms"],
+            jitter_ms=options["jitter_ms"],
+            error_rate=options["error_rate"],
+            tool_turns=options["tool_turns"],
+            embedding_dim=options["embedding_dim"],
+        )
+        host, port = server.server_address[:2]
+        self.stdout.write(f"Fake Gemini listening on http://{host}:{port}/")
+        self.stdout.write(f"  GOOGLE_GEMINI_BASE_URL=http://{host}:{port}/ GOOGLE_API_KEY=fake を設定してサーバーを起動してください")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,31 @@
+"""
+期限切れのパイプラインチェックポイントを削除する。
+
+使い方:
+    python manage.py gc_checkpoints
+    python manage.py gc_checkpoints --max-age 3600
+
+リクエスト処理中にも GC_INTERVAL_SECONDS ごとに自動で実行されるが、
+cron等から定期実行するとチェックポイントDBの肥大化を確実に防げる。
+"""
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "期限切れのパイプラインチェックポイントを削除する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=float,
+            default=None,
+            help="保持期間（秒）。省略時は環境変数 PIPELINE_CHECKPOINT_TTL_SECONDS",
+        )
+
+    def handle(self, *args, **options):
+        from core.common.config import load_config
+        from core.common.checkpoint import gc_checkpoints
+
+        load_config()
+        deleted = gc_checkpoints(max_age_seconds=options["max_age"])
+        self.stdout.write(f"Deleted checkpoints for {deleted} thread(s)")
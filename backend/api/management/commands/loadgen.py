@@ -0,0 +1,269 @@
+"""
+収集したリクエスト（api/capture.py のJSONL）を稼働中のサーバーに再生する負荷生成ツール。
+
+使い方:
+    # 開ループ: 平均 2件/秒のポアソン到着を60秒間
+    python manage.py loadgen --corpus captures.jsonl --mode open --rate 2 --duration 60
+    # 閉ループ: 8ユーザーがそれぞれ応答を待ってから次のリクエストを送る
+    python manage.py loadgen --corpus captures.jsonl --mode closed --users 8 --duration 60
+
+fake_gemini と組み合わせると、クォータを消費せずにノードあたりの処理能力を見積もれる。
+スループット、レイテンシのパーセンタイル、エラーの分類（429 / 503 / 504 / タイムアウトなど）、
+キャッシュヒット率（X-Cache / X-Coalesced / X-Analysis-Cache が HIT または SHARED の割合）を報告する。
+
+開ループのレイテンシは予定した到着時刻から計測する（クライアント側の送信待ちも含め、
+サーバーが遅いときに到着が後ろ倒しになって結果が良く見える問題を避ける）。
+画像を保存していない記録は、同じ縦横・同じハッシュなら同じ内容になる代替画像で再生する。
+"""
+import base64
+import io
+import itertools
+import json
+import random
+import socket
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.capture import LOADGEN_USER_AGENT
+
+CACHE_HEADERS = ("X-Cache", "X-Coalesced", "X-Analysis-Cache")
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_corpus(path: str, endpoints=None) -> list:
+    """JSONLのコーパスを読み込む（endpoints を指定した場合はそのエンドポイントのみ）"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if not endpoints or record["endpoint"] in endpoints:
+                    records.append(record)
+    return records
+
+
+@lru_cache(maxsize=64)
+def stand_in_image(sha256: str, width: int, height: int) -> bytes:
+    """画像を保存していない記録の代替画像（同じハッシュからは同じ内容のJPEGを生成する）"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(int(sha256[:16], 16))
+    # 粗いノイズを拡大し、写真に近い圧縮サイズにする
+    noise = rng.integers(0, 256, size=(max(1, height // 8), max(1, width // 8), 3), dtype=np.uint8)
+    image = Image.fromarray(noise).resize((width, height), Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _multipart(field: str, filename: str, content_type: str, data: bytes) -> tuple:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode("utf-8") + data + f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def build_request(record: dict, unique_keys: bool = False) -> tuple:
+    """記録から (パス, ボディ, ヘッダー) を組み立てる"""
+    headers = {"User-Agent": LOADGEN_USER_AGENT}
+    if record.get("json") is not None:
+        body = json.dumps(record["json"], ensure_ascii=False).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+        if unique_keys:
+            headers["Idempotency-Key"] = uuid.uuid4().hex
+    else:
+        image = record["image"]
+        if image.get("data_b64"):
+            data, content_type = base64.b64decode(image["data_b64"]), image["content_type"]
+        else:
+            data = stand_in_image(image["sha256"], image.get("width", 1200), image.get("height", 1600))
+            content_type = "image/jpeg"
+        body, headers["Content-Type"] = _multipart("image", "inbody.jpg", content_type, data)
+    return record["endpoint"], body, headers
+
+
+def classify(status, error=None) -> str:
+    """応答の分類（ok / rate_limited / unavailable / gateway_timeout / client_error / server_error / timeout / connection）"""
+    if error is not None:
+        return "timeout" if isinstance(error, (socket.timeout, TimeoutError)) else "connection"
+    if 200 <= status < 300:
+        return "ok"
+    return {429: "rate_limited", 503: "unavailable", 504: "gateway_timeout"}.get(
+        status, "client_error" if status < 500 else "server_error"
+    )
+
+
+def send(base_url: str, record: dict, timeout: float, unique_keys: bool = False, scheduled_at: float = None) -> dict:
+    """1件送信して結果（エンドポイント・ステータス・レイテンシ・分類・キャッシュヘッダー）を返す"""
+    path, body, headers = build_request(record, unique_keys)
+    started = scheduled_at if scheduled_at is not None else time.perf_counter()
+    status, response_headers, error = None, {}, None
+    try:
+        with urlopen(Request(base_url.rstrip("/") + path, data=body, headers=headers, method="POST"), timeout=timeout) as response:
+            response.read()
+            status, response_headers = response.status, response.headers
+    except HTTPError as e:
+        e.read()
+        status, response_headers = e.code, e.headers
+    except (URLError, OSError) as e:
+        error = getattr(e, "reason", e)
+    return {
+        "endpoint": path,
+        "status": status,
+        "latency": time.perf_counter() - started,
+        "class": classify(status, error),
+        "cache": {header: response_headers.get(header) for header in CACHE_HEADERS if response_headers.get(header)},
+    }
+
+
+class _Corpus:
+    """スレッド間で共有する、コーパスを循環して返すイテレーター"""
+
+    def __init__(self, records: list):
+        self._records = itertools.cycle(records)
+        self._lock = threading.Lock()
+
+    def next(self) -> dict:
+        with self._lock:
+            return next(self._records)
+
+
+def run_open_loop(base_url: str, records: list, rate: float, duration: float, timeout: float,
+                  max_in_flight: int = 256, unique_keys: bool = False) -> list:
+    """平均 rate 件/秒のポアソン到着でリクエストを送る（応答を待たずに次を送る）"""
+    corpus = _Corpus(records)
+    futures = []
+    started = time.perf_counter()
+    next_arrival = started
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="loadgen") as executor:
+        while True:
+            next_arrival += random.expovariate(rate)
+            if next_arrival - started >= duration:
+                break
+            time.sleep(max(0.0, next_arrival - time.perf_counter()))
+            futures.append(executor.submit(send, base_url, corpus.next(), timeout, unique_keys, next_arrival))
+        return [future.result() for future in futures]
+
+
+def run_closed_loop(base_url: str, records: list, users: int, duration: float, timeout: float,
+                    think_time: float = 0.0, unique_keys: bool = False) -> list:
+    """users 人がそれぞれ応答を待ってから次のリクエストを送る"""
+    corpus = _Corpus(records)
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user():
+        while time.perf_counter() < deadline:
+            result = send(base_url, corpus.next(), timeout, unique_keys)
+            with lock:
+                results.append(result)
+            if think_time:
+                time.sleep(think_time)
+
+    threads = [threading.Thread(target=user, name=f"loadgen-user-{i}") for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _percentile(values: list, q: float):
+    return round(values[min(len(values) - 1, int(q / 100 * len(values)))], 3) if values else None
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    """エンドポイントごと（と全体）のスループット・レイテンシ・エラー分類・キャッシュヒット率"""
+    groups = {"all": results}
+    for result in results:
+        groups.setdefault(result["endpoint"], []).append(result)
+
+    report = {}
+    for name, group in groups.items():
+        ok_latencies = sorted(result["latency"] for result in group if result["class"] == "ok")
+        classes = {}
+        for result in group:
+            classes[result["class"]] = classes.get(result["class"], 0) + 1
+
+        cache = {}
+        for header in CACHE_HEADERS:
+            values = [result["cache"][header] for result in group if header in result["cache"]]
+            if values:
+                cache[header] = round(sum(value in ("HIT", "SHARED") for value in values) / len(values), 3)
+
+        report[name] = {
+            "requests": len(group),
+            "throughput_rps": round(len(group) / elapsed, 3) if elapsed else None,
+            "ok_rps": round(len(ok_latencies) / elapsed, 3) if elapsed else None,
+            "latency_mean": round(statistics.fmean(ok_latencies), 3) if ok_latencies else None,
+            **{f"latency_p{q}": _percentile(ok_latencies, q) for q in PERCENTILES},
+            "classes": classes,
+            "cache_hit_rate": cache,
+        }
+    return report
+
+
+class Command(BaseCommand):
+    help = "収集したリクエストを稼働中のサーバーに再生し、スループット・レイテンシ・エラー・キャッシュヒット率を報告する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus", required=True, help="api/capture.py で収集したJSONL")
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--mode", choices=["open", "closed"], default="closed")
+        parser.add_argument("--rate", type=float, default=1.0, help="開ループの平均到着率（件/秒）")
+        parser.add_argument("--users", type=int, default=4, help="閉ループの同時ユーザー数")
+        parser.add_argument("--think-time", type=float, default=0.0, help="閉ループで応答後に待つ秒数")
+        parser.add_argument("--duration", type=float, default=60.0, help="リクエストを送る秒数")
+        parser.add_argument("--timeout", type=float, default=180.0)
+        parser.add_argument("--max-in-flight", type=int, default=256, help="開ループの同時送信数の上限")
+        parser.add_argument("--endpoint", action="append", help="再生するエンドポイント（複数指定可）")
+        parser.add_argument("--shuffle", action="store_true")
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--unique-keys", action="store_true", help="プラン生成に毎回異なる Idempotency-Key を付け、まとめられないようにする")
+        parser.add_argument("--json", help="レポートをJSONで書き出すパス")
+
+    def handle(self, *args, **options):
+        records = load_corpus(options["corpus"], options["endpoint"])
+        if not records:
+            raise CommandError("再生するリクエストがありません")
+        if options["seed"] is not None:
+            random.seed(options["seed"])
+        if options["shuffle"]:
+            random.shuffle(records)
+
+        self.stdout.write(f"{len(records)}件のリクエストを {options['mode']} モードで{options['duration']:.0f}秒間再生します")
+        started = time.perf_counter()
+        if options["mode"] == "open":
+            results = run_open_loop(
+                options["base_url"], records, options["rate"], options["duration"], options["timeout"],
+                max_in_flight=options["max_in_flight"], unique_keys=options["unique_keys"],
+            )
+        else:
+            results = run_closed_loop(
+                options["base_url"], records, options["users"], options["duration"], options["timeout"],
+                think_time=options["think_time"], unique_keys=options["unique_keys"],
+            )
+        report = summarize(results, time.perf_counter() - started)
+
+        for name, row in report.items():
+            latencies = " ".join(f"p{q}={row[f'latency_p{q}']}" for q in PERCENTILES)
+            self.stdout.write(
+                f"{name:<22} {row['requests']:>5}件  {row['throughput_rps']:.2f} req/s (ok {row['ok_rps']:.2f})  "
+                f"{latencies}  {row['classes']}  cache={row['cache_hit_rate']}"
+            )
+        if options["json"]:
+            with open(options["json"], "w", encoding="utf-8") as f:
+                json.dump({"options": {k: v for k, v in options.items() if k in ("mode", "rate", "users", "duration")}, "report": report}, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,27 @@
+"""
+ワーカー起動時と同じウォームアップを実行し、ステップ・モジュールごとの所要時間を表示する。
+
+使い方:
+    python manage.py warmup
+    python manage.py warmup --prime
+"""
+import json
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "モジュール読み込み・索引構築・グラフのコンパイルを行い、所要時間を表示する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--prime",
+            action="store_true",
+            help="埋め込み・LLMに小さなリクエストを送って接続を確立する（GOOGLE_API_KEY が必要）",
+        )
+
+    def handle(self, *args, **options):
+        from core.common.warmup import warmup
+
+        result = warmup(prime=options["prime"] or None)
+        self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,99 @@
+"""
+Request correlation and profiling.
+
+X-Request-Id（無い場合は新規に採番）をリクエスト処理中のログに付け、応答ヘッダーでも返す。
+LangGraphのノード・ツール・LLM呼び出しは contextvars を引き継ぐスレッドで実行されるため、
+1件のリクエストのログを request_id で横断して追える。
+
+PROFILE_SAMPLE_RATE / PROFILE_SLOW_THRESHOLD_SECONDS を設定すると、リクエストの一部または
+遅いリクエストのスタックをサンプリングし、フレームグラフ用のファイルとして保存する。
+"""
+import logging
+import os
+import random
+import re
+import time
+import uuid
+
+from django.core.exceptions import MiddlewareNotUsed
+
+from core.common.log import bind_request_id, get_request_id
+from core.common.profiling import get_profile_store, profile_block
+
+logger = logging.getLogger("api.access")
+
+# プロファイルしないパス（ヘルスチェックと、プロファイル一覧そのもの）
+PROFILE_EXCLUDED_PREFIXES = ("/api/health/", "/api/ready/", "/api/admin/profiles/")
+
+# クライアントが指定したIDはログに出力するため、長さと文字種を制限する
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+
+class RequestIdMiddleware:
+    """リクエストIDをログのコンテキストに設定し、アクセスログを1件出力する"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.headers.get("X-Request-Id", "")
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+
+        started = time.perf_counter()
+        with bind_request_id(request_id):
+            response = self.get_response(request)
+            logger.info(
+                "%s %s %s", request.method, request.path, response.status_code,
+                extra={
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                },
+            )
+        response["X-Request-Id"] = request_id
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    リクエストをサンプリングプロファイラーで計測し、条件を満たしたものを保存する。
+
+    PROFILE_SAMPLE_RATE の割合のリクエストは常に保存する。PROFILE_SLOW_THRESHOLD_SECONDS を
+    設定した場合は全リクエストを計測し、処理時間がその秒数以上のものも保存する
+    （サンプリングは別スレッドが行うため、保存しないリクエストへの影響は小さい）。
+    """
+
+    def __init__(self, get_response):
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        threshold = os.getenv("PROFILE_SLOW_THRESHOLD_SECONDS")
+        self.slow_threshold = float(threshold) if threshold else None
+        if self.sample_rate <= 0 and self.slow_threshold is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path.startswith(PROFILE_EXCLUDED_PREFIXES):
+            return self.get_response(request)
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_threshold is None:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        with profile_block() as profile:
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        slow = self.slow_threshold is not None and duration >= self.slow_threshold
+        if sampled or slow:
+            profile_id = get_profile_store().save(profile, {
+                "request_id": get_request_id(),
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": round(duration * 1000, 1),
+                "reason": "slow" if slow else "sampled",
+            })
+            response["X-Profile-Id"] = profile_id
+        return response
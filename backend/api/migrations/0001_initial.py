@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneratedPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member_id', models.CharField(blank=True, default='', help_text='会員ID（任意）', max_length=64)),
+                ('input_hash', models.CharField(help_text='正規化した入力データのSHA-256', max_length=64)),
+                ('input_data', models.JSONField(help_text='バリデーション済みの入力データ')),
+                ('analysis_report', models.JSONField(help_text='分析レポート')),
+                ('training_plan', models.JSONField(help_text='トレーニングプラン')),
+                ('model_name', models.CharField(help_text='生成に使用したモデル', max_length=100)),
+                ('prompt_version', models.CharField(help_text='生成に使用したプロンプトのバージョン', max_length=32)),
+                ('timings', models.JSONField(default=dict, help_text='ノードごとの処理時間（秒）')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['input_hash'], name='plan_input_hash_idx'), models.Index(fields=['member_id', '-created_at'], name='plan_member_created_idx'), models.Index(fields=['-created_at'], name='plan_created_idx')],
+            },
+        ),
+    ]
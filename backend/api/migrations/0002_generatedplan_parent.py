@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generatedplan',
+            name='parent',
+            field=models.ForeignKey(blank=True, help_text='部分再生成の元になった履歴', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revisions', to='api.generatedplan'),
+        ),
+    ]
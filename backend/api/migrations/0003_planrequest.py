@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-19 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_generatedplan_parent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanRequest',
+            fields=[
+                ('key', models.CharField(help_text='Idempotency-Key または入力のハッシュ', max_length=160, primary_key=True, serialize=False)),
+                ('input_hash', models.CharField(help_text='正規化した入力データのSHA-256（同じキーで異なる入力の検出用）', max_length=64)),
+                ('state', models.CharField(choices=[('running', '実行中'), ('done', '完了')], default='running', max_length=16)),
+                ('result', models.JSONField(blank=True, help_text='完了したリクエストのレスポンス', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(blank=True, help_text='完了した結果を再利用できる期限', null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='plan_request_expires_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,63 @@
 from django.db import models
 
-# Create your models here.
+
+class GeneratedPlan(models.Model):
+    """生成した分析レポート・トレーニングプランの履歴（再表示時にLLMで再生成しないために保存）"""
+    member_id = models.CharField(max_length=64, blank=True, default="", help_text="会員ID（任意）")
+    input_hash = models.CharField(max_length=64, help_text="正規化した入力データのSHA-256")
+    input_data = models.JSONField(help_text="バリデーション済みの入力データ")
+    analysis_report = models.JSONField(help_text="分析レポート")
+    training_plan = models.JSONField(help_text="トレーニングプラン")
+    model_name = models.CharField(max_length=100, help_text="生成に使用したモデル")
+    prompt_version = models.CharField(max_length=32, help_text="生成に使用したプロンプトのバージョン")
+    timings = models.JSONField(default=dict, help_text="ノードごとの処理時間（秒）")
+    parent = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="revisions",
+        help_text="部分再生成の元になった履歴",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["input_hash"], name="plan_input_hash_idx"),
+            models.Index(fields=["member_id", "-created_at"], name="plan_member_created_idx"),
+            models.Index(fields=["-created_at"], name="plan_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"GeneratedPlan #{self.pk} ({self.member_id or 'anonymous'}, {self.created_at:%Y-%m-%d %H:%M})"
+
+
+class PlanRequest(models.Model):
+    """
+    /api/generate/ の実行中・完了済みのリクエスト。
+
+    同一入力または同一 Idempotency-Key のリクエストを、プロセスをまたいで1回のパイプライン実行にまとめる。
+    完了後は expires_at まで結果を保持し、遅れて届いた再試行にも同じ結果を返す。
+    """
+    STATE_RUNNING = "running"
+    STATE_DONE = "done"
+
+    key = models.CharField(max_length=160, primary_key=True, help_text="Idempotency-Key または入力のハッシュ")
+    input_hash = models.CharField(max_length=64, help_text="正規化した入力データのSHA-256（同じキーで異なる入力の検出用）")
+    state = models.CharField(
+        max_length=16,
+        choices=[(STATE_RUNNING, "実行中"), (STATE_DONE, "完了")],
+        default=STATE_RUNNING,
+    )
+    result = models.JSONField(null=True, blank=True, help_text="完了したリクエストのレスポンス")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True, help_text="完了した結果を再利用できる期限")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["expires_at"], name="plan_request_expires_idx"),
+        ]
+
+    def __str__(self):
+        return f"PlanRequest {self.key} ({self.state})"
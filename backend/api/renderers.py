@@ -0,0 +1,23 @@
+"""
+Renderers for the Project Trainer API.
+"""
+from pydantic import BaseModel
+from rest_framework.renderers import JSONRenderer
+
+
+class RawJSON(str):
+    """シリアライズ済みのJSON文字列（再エンコードせずにそのまま返す）"""
+
+
+class PydanticJSONRenderer(JSONRenderer):
+    """
+    Pydanticモデルは model_dump_json（pydantic-core）で直接JSONバイト列に変換し、
+    RawJSON はそのまま返す。エラー応答などの辞書は通常の JSONRenderer で描画する。
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, RawJSON):
+            return data.encode("utf-8")
+        if isinstance(data, BaseModel):
+            return data.model_dump_json().encode("utf-8")
+        return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,107 @@
+"""
+Pydantic schemas for the Project Trainer API.
+
+/api/generate/ の入力と出力は、LLMの構造化出力と同じPydanticモデルで1回だけ検証し、
+そのままJSONバイト列にシリアライズする（DRFシリアライザでの再検証・フィールドごとの描画を行わない）。
+"""
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from core.common.schemas import AnalysisResult, TrainingPlan
+
+
+# =============================================
+# Input Schemas (ユーザー入力用)
+# =============================================
+
+class SegmentalLean(BaseModel):
+    """部位別骨格筋量"""
+    right_arm: float = Field(description="右腕の骨格筋量 (kg)")
+    left_arm: float = Field(description="左腕の骨格筋量 (kg)")
+    trunk: float = Field(description="体幹の骨格筋量 (kg)")
+    right_leg: float = Field(description="右脚の骨格筋量 (kg)")
+    left_leg: float = Field(description="左脚の骨格筋量 (kg)")
+
+
+class UserProfile(BaseModel):
+    """ユーザープロフィール"""
+    age: int = Field(ge=10, le=100, description="年齢")
+    gender: Literal['男性', '女性'] = Field(description="性別")
+    height_cm: float = Field(ge=100, le=250, description="身長 (cm)")
+    training_experience: Literal['初級者', '中級者', '上級者'] = Field(description="トレーニング経験レベル")
+    injuries: List[str] = Field(default=[], description="既往歴・怪我のリスト")
+
+
+class InBodyMetrics(BaseModel):
+    """InBody測定データ"""
+    weight_kg: float = Field(ge=30, le=200, description="体重 (kg)")
+    muscle_mass_kg: float = Field(ge=10, le=100, description="筋肉量 (kg)")
+    skeletal_muscle_mass_kg: float = Field(ge=5, le=60, description="骨格筋量 (kg)")
+    body_fat_percent: float = Field(ge=3, le=60, description="体脂肪率 (%)")
+    segmental_lean: SegmentalLean = Field(description="部位別骨格筋量")
+
+
+class Goal(BaseModel):
+    """トレーニング目標"""
+    type: str = Field(min_length=1, description="目標タイプ（例: ダイエット、筋肥大）")
+    days_per_week: str = Field(default="", description="週のトレーニング日数")
+
+
+class Preferences(BaseModel):
+    """ユーザーの好み・制約"""
+    environment: Literal['home', 'gym'] = Field(default='home', description="トレーニング環境")
+    training_time_minutes: Literal['5', '10', '15', '30', '45', '60', '90', '120'] = Field(
+        default='60', description="一日のトレーニング時間（分）"
+    )
+    equipment: str = Field(default="", description="利用可能な器具")
+    schedule_notes: str = Field(default="", description="スケジュールに関する注記")
+    specific_requests: str = Field(default="", description="その他の要望")
+
+    @field_validator("training_time_minutes", mode="before")
+    @classmethod
+    def _minutes_as_str(cls, value):
+        # 数値で送られた場合も選択肢（文字列）として扱う
+        return str(value) if isinstance(value, int) else value
+
+
+class TrainingRequest(BaseModel):
+    """トレーニングメニュー生成リクエスト（統合入力）"""
+    user_profile: UserProfile
+    inbody_metrics: InBodyMetrics
+    goal: Goal
+    preferences: Preferences = Field(default_factory=Preferences)
+    member_id: str = Field(default="", max_length=64, description="会員ID（履歴の検索に使用）")
+    analysis_report: Optional[AnalysisResult] = Field(
+        default=None, description="既存の分析レポート（指定時はAnalyzerを実行せずプランのみ再生成）"
+    )
+    reuse_analysis: bool = Field(
+        default=True, description="同じプロフィール・InBody・目標の分析レポートがキャッシュにあれば再利用するか"
+    )
+
+    @field_validator("preferences", mode="before")
+    @classmethod
+    def _default_preferences(cls, value):
+        return {} if value is None else value
+
+
+# =============================================
+# Output Schemas (レスポンス用)
+# =============================================
+
+class TrainingResponse(BaseModel):
+    """トレーニングメニュー生成レスポンス"""
+    analysis_report: AnalysisResult
+    training_plan: TrainingPlan
+
+
+def error_details(error: ValidationError) -> dict:
+    """Pydanticの検証エラーをDRFと同じ形式（フィールドのパスごとのメッセージのリスト）に変換する"""
+    details = {}
+    for item in error.errors(include_url=False):
+        node = details
+        path = [str(part) for part in item["loc"]] or ["non_field_errors"]
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node.setdefault(path[-1], []).append(item["msg"])
+    return details
@@ -4,10 +4,14 @@ Handles validation and serialization of input/output data.
 """
 from rest_framework import serializers
 
+from .models import GeneratedPlan
+
 
 # =============================================
 # Input Serializers (ユーザー入力用)
 # =============================================
+# /api/generate/ の入出力は api/schemas.py のPydanticモデルで検証する。
+# TrainingRequestSerializer / TrainingResponseSerializer は bench_serialization の比較対象として残している。
 
 class SegmentalLeanSerializer(serializers.Serializer):
     """部位別骨格筋量"""
@@ -99,6 +103,27 @@ class TrainingRequestSerializer(serializers.Serializer):
     inbody_metrics = InBodyMetricsSerializer()
     goal = GoalSerializer()
     preferences = PreferencesSerializer(required=False)
+    member_id = serializers.CharField(
+        required=False,
+        default="",
+        allow_blank=True,
+        max_length=64,
+        help_text="会員ID（履歴の検索に使用）"
+    )
+    analysis_report = serializers.JSONField(
+        required=False,
+        help_text="既存の分析レポート（指定時はAnalyzerを実行せずプランのみ再生成）"
+    )
+    reuse_analysis = serializers.BooleanField(
+        required=False,
+        default=True,
+        help_text="同じプロフィール・InBody・目標の分析レポートがキャッシュにあれば再利用するか"
+    )
+
+    def validate_analysis_report(self, value):
+        serializer = AnalysisReportSerializer(data=value)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
 
     def validate(self, data):
         """追加のバリデーション"""
@@ -181,3 +206,40 @@ class TrainingResponseSerializer(serializers.Serializer):
     """トレーニングメニュー生成レスポンス"""
     analysis_report = AnalysisReportSerializer(help_text="分析レポート")
     training_plan = TrainingPlanSerializer(help_text="トレーニングプラン")
+
+
+
+# =============================================
+# History Serializers (生成履歴用)
+# =============================================
+
+class PlanRegenerateRequestSerializer(serializers.Serializer):
+    """保存済みプランの部分再生成リクエスト"""
+    day_index = serializers.IntegerField(min_value=0, help_text="変更する日のインデックス（0始まり）")
+    exercise_index = serializers.IntegerField(
+        required=False,
+        allow_null=True,
+        default=None,
+        min_value=0,
+        help_text="変更する種目のインデックス（省略時は1日分を再生成）"
+    )
+    change_request = serializers.CharField(max_length=500, help_text="変更要望")
+
+
+class GeneratedPlanSummarySerializer(serializers.ModelSerializer):
+    """生成履歴の一覧表示用（大きなJSON列を含まない）"""
+
+    class Meta:
+        model = GeneratedPlan
+        fields = ["id", "member_id", "input_hash", "model_name", "prompt_version", "timings", "parent", "created_at"]
+
+
+class GeneratedPlanDetailSerializer(serializers.ModelSerializer):
+    """生成履歴の詳細（入力・分析レポート・トレーニングプランを含む）"""
+
+    class Meta:
+        model = GeneratedPlan
+        fields = [
+            "id", "member_id", "input_hash", "input_data", "analysis_report", "training_plan",
+            "model_name", "prompt_version", "timings", "parent", "created_at",
+        ]
@@ -22,11 +22,33 @@ python manage.py test api.tests.HealthCheckTests --verbosity=2
 # 特定のテストメソッドのみ実行
 python manage.py test api.tests.HealthCheckTests.test_health_check_returns_200 --verbosity=2
 """
-from django.test import TestCase
-from rest_framework.test import APITestCase, APIClient
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase
+from rest_framework.test import APITestCase, APITransactionTestCase, APIClient
 from rest_framework import status
 from unittest.mock import patch, MagicMock
+import copy
 import json
+import os
+import tempfile
+
+
+_checkpoint_dir = tempfile.TemporaryDirectory()
+_module_patches = [
+    # パイプラインのチェックポイントはソースツリーではなく一時ディレクトリに保存する
+    patch.dict(os.environ, {"PIPELINE_CHECKPOINT_DB": os.path.join(_checkpoint_dir.name, "checkpoints.sqlite3")}),
+    patch('core.common.checkpoint._checkpointer', None),
+]
+
+
+def setUpModule():
+    for patcher in _module_patches:
+        patcher.start()
+
+
+def tearDownModule():
+    for patcher in reversed(_module_patches):
+        patcher.stop()
+    _checkpoint_dir.cleanup()
 
 
 class HealthCheckTests(APITestCase):
@@ -152,79 +174,97 @@ class GenerateTrainingPlanValidationTests(APITestCase):
         self.assertNotEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+def valid_plan_input() -> dict:
+    """/api/generate/ に送る有効な入力データ（呼び出しごとに新しい辞書を返す）"""
+    return {
+        "user_profile": {
+            "age": 30,
+            "gender": "男性",
+            "height_cm": 170.0,
+            "training_experience": "初級者",
+            "injuries": []
+        },
+        "inbody_metrics": {
+            "weight_kg": 70.0,
+            "muscle_mass_kg": 30.0,
+            "skeletal_muscle_mass_kg": 28.0,
+            "body_fat_percent": 20.0,
+            "segmental_lean": {
+                "right_arm": 3.0,
+                "left_arm": 2.9,
+                "trunk": 25.0,
+                "right_leg": 9.0,
+                "left_leg": 8.8
+            }
+        },
+        "goal": {
+            "type": "ダイエット",
+            "days_per_week": "3"
+        },
+        "preferences": {
+            "environment": "home",
+            "training_time_minutes": "30",
+            "equipment": "ダンベル"
+        }
+    }
+
+
+def mock_plan_response() -> dict:
+    """パイプラインが返す分析レポートとトレーニングプラン（呼び出しごとに新しい辞書を返す）"""
+    return {
+        "analysis_report": {
+            "body_type": "適正",
+            "body_fat_evaluation": "標準（20%）",
+            "skeletal_muscle_evaluation": "標準",
+            "arm_balance": "正常（差分3%）",
+            "leg_balance": "正常（差分2%）",
+            "upper_lower_balance": "正常",
+            "risk_factors": [],
+            "concerns": []
+        },
+        "training_plan": {
+            "split_method": "全身法",
+            "split_rationale": "初級者に最適な分割法",
+            "weekly_schedule": [
+                {
+                    "day_label": "Day 1",
+                    "focus": "全身トレーニング",
+                    "exercises": [
+                        {
+                            "target_area": "脚",
+                            "exercise_name": "スクワット",
+                            "sets": 3,
+                            "reps": "10-15",
+                            "interval_seconds": 60,
+                            "notes": "",
+                            "instructions": ["足を肩幅に開く", "膝を曲げてしゃがむ", "立ち上がる"]
+                        }
+                    ]
+                }
+            ],
+            "modifications": [],
+            "priority_points": ["正しいフォームを意識"],
+            "nutrition_tips": ["タンパク質を十分に摂取"]
+        }
+    }
+
+
+def png_bytes(width: int = 40, color: str = "white") -> bytes:
+    """アップロード用の小さなPNG画像（サイズ・色ごとに異なるバイト列になる）"""
+    import io
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, 30), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
 class GenerateTrainingPlanMockTests(APITestCase):
     """トレーニングプラン生成エンドポイントのモックテスト"""
     
     def setUp(self):
         """テスト用の有効な入力データを準備"""
-        self.valid_input = {
-            "user_profile": {
-                "age": 30,
-                "gender": "男性",
-                "height_cm": 170.0,
-                "training_experience": "初級者",
-                "injuries": []
-            },
-            "inbody_metrics": {
-                "weight_kg": 70.0,
-                "muscle_mass_kg": 30.0,
-                "skeletal_muscle_mass_kg": 28.0,
-                "body_fat_percent": 20.0,
-                "segmental_lean": {
-                    "right_arm": 3.0,
-                    "left_arm": 2.9,
-                    "trunk": 25.0,
-                    "right_leg": 9.0,
-                    "left_leg": 8.8
-                }
-            },
-            "goal": {
-                "type": "ダイエット",
-                "days_per_week": "3"
-            },
-            "preferences": {
-                "environment": "home",
-                "training_time_minutes": "30",
-                "equipment": "ダンベル"
-            }
-        }
-        
-        self.mock_response = {
-            "analysis_report": {
-                "body_type": "適正",
-                "body_fat_evaluation": "標準（20%）",
-                "skeletal_muscle_evaluation": "標準",
-                "arm_balance": "正常（差分3%）",
-                "leg_balance": "正常（差分2%）",
-                "upper_lower_balance": "正常",
-                "risk_factors": [],
-                "concerns": []
-            },
-            "training_plan": {
-                "split_method": "全身法",
-                "split_rationale": "初級者に最適な分割法",
-                "weekly_schedule": [
-                    {
-                        "day_label": "Day 1",
-                        "focus": "全身トレーニング",
-                        "exercises": [
-                            {
-                                "target_area": "脚",
-                                "exercise_name": "スクワット",
-                                "sets": 3,
-                                "reps": "10-15",
-                                "interval_seconds": 60,
-                                "notes": "",
-                                "instructions": ["足を肩幅に開く", "膝を曲げてしゃがむ", "立ち上がる"]
-                            }
-                        ]
-                    }
-                ],
-                "modifications": [],
-                "priority_points": ["正しいフォームを意識"],
-                "nutrition_tips": ["タンパク質を十分に摂取"]
-            }
-        }
+        self.valid_input = valid_plan_input()
+        self.mock_response = mock_plan_response()
     
     @patch('api.views.GenerateTrainingPlanView._generate_plan')
     def test_successful_generation_returns_200(self, mock_generate):
@@ -234,8 +274,8 @@ class GenerateTrainingPlanMockTests(APITestCase):
         response = self.client.post('/api/generate/', self.valid_input, format='json')
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('analysis_report', response.data)
-        self.assertIn('training_plan', response.data)
+        self.assertIn('analysis_report', response.json())
+        self.assertIn('training_plan', response.json())
     
     @patch('api.views.GenerateTrainingPlanView._generate_plan')
     def test_response_contains_expected_fields(self, mock_generate):
@@ -245,13 +285,13 @@ class GenerateTrainingPlanMockTests(APITestCase):
         response = self.client.post('/api/generate/', self.valid_input, format='json')
         
         # Analysis report fields
-        analysis = response.data['analysis_report']
+        analysis = response.json()['analysis_report']
         self.assertIn('body_type', analysis)
         self.assertIn('body_fat_evaluation', analysis)
         self.assertIn('risk_factors', analysis)
         
         # Training plan fields
-        plan = response.data['training_plan']
+        plan = response.json()['training_plan']
         self.assertIn('split_method', plan)
         self.assertIn('weekly_schedule', plan)
         self.assertIn('nutrition_tips', plan)
@@ -265,3 +305,2084 @@ class ExtractInBodyValidationTests(APITestCase):
         response = self.client.post('/api/extract-inbody/')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('error', response.data)
+
+
+class LexicalRetrieverTests(TestCase):
+    """BM25検索バックエンドのテスト（埋め込みAPIを呼ばないこと）"""
+
+    def test_analyzer_splits_japanese_into_bigrams(self):
+        """日本語は文字bigram、英数字は単語としてトークン化されること"""
+        from core.common.lexical import analyze
+        self.assertEqual(analyze("膝痛 BMI"), ["bmi", "膝痛"])
+        self.assertEqual(analyze("隠れ肥満"), ["隠れ", "れ肥", "肥満"])
+
+    def test_bm25_finds_exact_body_type_section(self):
+        """体型名を含むクエリで該当セクションが上位に来ること"""
+        from core.common.lexical import get_bm25_index
+        results = get_bm25_index().search("隠れ肥満 アドバイス", k=3)
+        self.assertIn("隠れ肥満", results[0][0].page_content)
+
+    @patch('core.common.db_client.get_embeddings', side_effect=AssertionError("embedding API must not be called"))
+    def test_bm25_backend_does_not_call_embeddings(self, mock_embeddings):
+        """backend="bm25" では埋め込みAPIを呼ばずに結果を返すこと"""
+        from core.common.retriever import search_knowledge
+        result = search_knowledge("体脂肪率 判定", k=2, backend="bm25")
+        self.assertIn("【結果1】", result)
+        mock_embeddings.assert_not_called()
+
+    @patch('core.common.retriever._vector_search', side_effect=RuntimeError("embedding API unavailable"))
+    def test_vector_backend_falls_back_to_bm25(self, mock_vector_search):
+        """ベクトル検索が失敗した場合はBM25検索にフォールバックすること"""
+        from core.common.retriever import search_knowledge
+        result = search_knowledge("膝痛 代替種目", k=2, backend="vector")
+        self.assertIn("【結果1】", result)
+
+
+class HybridRetrieverTests(TestCase):
+    """BM25 + ベクトル検索のRRF統合のテスト"""
+
+    def test_reciprocal_rank_fusion_prefers_documents_ranked_by_both(self):
+        """両方のランキングに現れる文書が上位に統合されること"""
+        from langchain_core.documents import Document
+        from core.common.retriever import reciprocal_rank_fusion
+        a, b, c = Document(page_content="a"), Document(page_content="b"), Document(page_content="c")
+        fused = reciprocal_rank_fusion([[a, b], [c, b]])
+        self.assertEqual(fused[0].page_content, "b")
+
+    @patch('core.common.retriever._similarity_search')
+    def test_hybrid_backend_diversifies_sections(self, mock_similarity_search):
+        """hybrid検索の結果が見出しセクション単位で重複しないこと"""
+        from core.common.lexical import get_bm25_index
+        from core.common.retriever import _hybrid_search, _section_key
+        mock_similarity_search.return_value = get_bm25_index().documents[:10]
+        results = _hybrid_search("隠れ肥満 アドバイス", k=3, fetch_k=10, timeout=1)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(len({_section_key(doc) for doc in results}), 3)
+
+
+class KnowledgeCollectionTests(TestCase):
+    """大分類ごとのナレッジコレクションのテスト（埋め込みAPIは呼ばない）"""
+
+    def test_collections_partition_knowledge_by_category(self):
+        """各コレクションは対応する大分類のチャンクのみを含み、全体の索引とは別に作られること"""
+        from core.common.db_client import KNOWLEDGE_COLLECTIONS, load_knowledge_chunks
+        from core.common.lexical import get_bm25_index
+
+        exercises = load_knowledge_chunks("exercises")
+        self.assertEqual({chunk.metadata["category"] for chunk in exercises}, {"VI"})
+        self.assertEqual({chunk.metadata["category"] for chunk in load_knowledge_chunks("progression")}, {"IV", "V"})
+        self.assertLess(len(exercises), len(load_knowledge_chunks()))
+        self.assertEqual(len(get_bm25_index(("exercises",)).documents), len(exercises))
+        self.assertIsNot(get_bm25_index(("exercises",)), get_bm25_index())
+        with self.assertRaises(ValueError):
+            load_knowledge_chunks("unknown")
+        self.assertIn("exercises", KNOWLEDGE_COLLECTIONS)
+
+    def test_tool_searches_only_its_collections(self):
+        """リスク対策ツールはリスクと種目ライブラリのみを検索すること"""
+        from core.common.retriever import search_knowledge
+        from core.planner.tools import RISK_COLLECTIONS
+        result = search_knowledge("膝痛 体脂肪率 判定", k=3, backend="bm25", collections=RISK_COLLECTIONS)
+        self.assertIn("【結果1】", result)
+        self.assertNotIn("体脂肪率判定", result)
+        with self.assertRaises(ValueError):
+            search_knowledge("膝痛", backend="bm25", collections=("unknown",))
+
+    def test_vector_search_merges_collections_by_similarity(self):
+        """複数のコレクションの候補を類似度で選び直し、クエリの埋め込みは1回だけ計算すること"""
+        import tempfile
+        from pathlib import Path
+        import numpy as np
+        from core.common import db_client
+        from core.common.mmap_index import MmapVectorIndex, write_index
+        from core.common.retriever import _vector_search
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        embedding_function = MagicMock()
+        embedding_function.embed_query.return_value = [1, 0.2, 0]
+        indexes = {}
+        for name, texts, vectors in (
+            ("risks", ["関節リスク", "代謝リスク"], [[0, 1, 0], [0, 0, 1]]),
+            ("exercises", ["レッグプレス", "プランク"], [[1, 0, 0], [0.5, 0.5, 0]]),
+        ):
+            index_dir = write_index(Path(tmp_dir.name) / name, ids=texts, texts=texts,
+                                    metadatas=[{}, {}], embeddings=np.array(vectors))
+            indexes[name] = MmapVectorIndex(index_dir, embedding_function=embedding_function)
+
+        with patch.dict(db_client._mmap_indexes, indexes), patch.dict(os.environ, {"KNOWLEDGE_VECTOR_INDEX": "mmap"}):
+            results = _vector_search("膝痛", k=2, fetch_k=4, lambda_mult=1.0, collections=("risks", "exercises"))
+
+        self.assertEqual([doc.page_content for doc in results], ["レッグプレス", "プランク"])
+        embedding_function.embed_query.assert_called_once()
+
+    def test_chroma_candidates_use_public_api(self):
+        """Chroma の候補は公開APIで取得し、各文書に対応する埋め込みを類似度順に返すこと"""
+        import uuid
+        import chromadb
+        import numpy as np
+        from langchain_chroma import Chroma
+        from core.common.retriever import _candidates
+
+        embedding_function = MagicMock()
+        embedding_function.embed_documents.return_value = [[0, 1, 0], [1, 0, 0], [0.6, 0.8, 0]]
+        index = Chroma(collection_name=f"test-{uuid.uuid4().hex}", embedding_function=embedding_function,
+                       client=chromadb.EphemeralClient())
+        index.add_texts(["代謝リスク", "関節リスク", "レッグプレス"], ids=["a", "b", "c"])
+
+        with patch.object(index, "similarity_search_by_vector_with_relevance_scores",
+                          wraps=index.similarity_search_by_vector_with_relevance_scores) as search, \
+                patch.object(index, "get", wraps=index.get) as get:
+            docs, embeddings = _candidates(index, [1, 0, 0], fetch_k=10)
+
+        search.assert_called_once_with([1, 0, 0], k=10)
+        get.assert_called_once()
+
+        self.assertEqual([doc.id for doc in docs], ["b", "c", "a"])
+        np.testing.assert_allclose(embeddings, [[1, 0, 0], [0.6, 0.8, 0], [0, 1, 0]], atol=1e-6)
+
+
+class SectionIndexTests(TestCase):
+    """見出しから構築したセクション索引のテスト"""
+
+    def test_lookup_by_number_and_title(self):
+        """番号・体型名のどちらでも同じセクションを取得できること"""
+        from core.common.sections import get_section_index
+        index = get_section_index()
+        self.assertEqual(index.get("8"), index.get("隠れ肥満"))
+        self.assertTrue(index.get("8").content.startswith("## 8. 隠れ肥満"))
+        self.assertEqual(len(index.sections), 50)
+
+    def test_body_fat_section_follows_thresholds(self):
+        """体脂肪率と性別から判定セクション（11-14）が決まること"""
+        from core.common.sections import body_fat_section_number
+        self.assertEqual(body_fat_section_number(9.5, "男性"), "11")
+        self.assertEqual(body_fat_section_number(20.0, "男性"), "13")
+        self.assertEqual(body_fat_section_number(36.0, "女性"), "14")
+
+    def test_risk_sections_follow_body_type_and_injuries(self):
+        """体型の対象リストと既往歴からリスク・代替種目セクションが決まること"""
+        from core.common.sections import risk_section_numbers
+        self.assertEqual(risk_section_numbers("隠れ肥満", []), ["17"])
+        self.assertEqual(risk_section_numbers("アスリート", ["膝痛"], include_substitutions=False), ["18", "16"])
+        self.assertIn("29", risk_section_numbers(None, ["膝痛"]))
+
+    def test_hardcoded_section_numbers_match_their_topics(self):
+        """定数で指定したセクション番号が、知識ベースの意図した見出し・本文のセクションを指していること"""
+        import re
+        from core.common.exercises import EXERCISE_CATEGORY
+        from core.common.sections import BODY_FAT_THRESHOLDS, INJURY_SECTIONS, PROGRESSION_SECTIONS, get_section_index
+        index = get_section_index()
+
+        for level, number in PROGRESSION_SECTIONS.items():
+            with self.subTest(level=level):
+                self.assertEqual(index.by_number[number].category, "進行モデル (Progression Models)")
+                self.assertIn(f"**対象:** {level}", index.by_number[number].content)
+
+        for gender, (normal, overweight, obese) in BODY_FAT_THRESHOLDS.items():
+            criteria = {"11": f"{gender} {normal}%未満", "12": f"{gender} {normal}-{overweight}%",
+                        "13": f"{gender} {overweight}-{obese}%", "14": f"{gender} {obese}%以上"}
+            for number, criterion in criteria.items():
+                with self.subTest(gender=gender, number=number):
+                    self.assertTrue(index.by_number[number].title.startswith("体脂肪率判定"))
+                    self.assertIn(criterion, index.by_number[number].content)
+
+        low_load = re.compile(r"Safety|負担が(少な|極めて低)|衝撃が少な|安全|負荷が軽|改善")
+        for keyword, (risk, *substitutions) in INJURY_SECTIONS.items():
+            with self.subTest(keyword=keyword):
+                self.assertIn("関節", index.by_number[risk].title)
+                for number in substitutions:
+                    self.assertTrue(index.by_number[number].category.startswith(EXERCISE_CATEGORY))
+                    self.assertRegex(index.by_number[number].content, low_load)
+
+    def test_home_training_excludes_gym_only_substitutions(self):
+        """自宅トレーニングではジム専用の代替種目（レッグプレス）を参照知識に含めないこと"""
+        from core.common.sections import risk_section_numbers
+        from core.planner.graph import build_reference_knowledge
+        self.assertEqual(risk_section_numbers(None, ["膝痛"], home=True), ["16", "43", "41"])
+        self.assertEqual(risk_section_numbers(None, ["足首"], home=True), ["16", "41"])
+
+        data = valid_plan_input()
+        data["user_profile"]["injuries"] = ["膝痛"]
+        data["preferences"]["environment"] = "home"
+        self.assertNotIn("## 29. レッグプレス", build_reference_knowledge(data))
+        data["preferences"]["environment"] = "gym"
+        self.assertIn("## 29. レッグプレス", build_reference_knowledge(data))
+
+
+class ExerciseLibraryTests(TestCase):
+    """種目ライブラリの属性索引と、プランナー向けの種目候補のテスト"""
+
+    def test_tags_are_parsed_into_attributes(self):
+        """Tags 行から部位・器具・環境・片側の属性が取り出されること"""
+        from core.common.exercises import get_exercise_library
+        library = get_exercise_library()
+        self.assertEqual(len(library.exercises), 26)
+        rdl = library.by_number["28"]
+        self.assertEqual(rdl.body_parts, frozenset({"Back", "Legs"}))
+        self.assertEqual(rdl.equipment, "dumbbell")
+        self.assertTrue(library.by_number["29"].gym_only)
+        self.assertTrue(library.by_number["27"].unilateral)
+
+    def test_contraindications_agree_with_knowledge_base(self):
+        """禁忌種目は種目ライブラリにあり、本文でその部位に安全・推奨とされた種目・代替種目を含まないこと"""
+        import re
+        from core.common.exercises import CONTRAINDICATIONS, get_exercise_library
+        from core.common.sections import INJURY_SECTIONS, get_section_index
+        library = get_exercise_library()
+        index = get_section_index()
+        for keyword, numbers in CONTRAINDICATIONS.items():
+            recommended = re.compile(f"{keyword}(への(負担|衝撃)が(少な|低|極めて低)|を痛めずに|痛持ちでも安全|痛予防)")
+            for number in numbers:
+                with self.subTest(keyword=keyword, number=number):
+                    self.assertIn(number, library.by_number)
+                    self.assertNotRegex(index.by_number[number].content, recommended)
+                    self.assertNotIn(number, INJURY_SECTIONS[keyword])
+
+    def test_candidates_follow_environment_equipment_and_injuries(self):
+        """自宅では器具の記述に合う種目のみ、既往歴の禁忌種目を除いて返されること"""
+        from core.common.exercises import get_exercise_library
+        library = get_exercise_library()
+
+        candidates = library.candidates_for({"environment": "home", "equipment": ""}, ["膝痛"])
+        legs = [exercise.number for exercise in candidates["Legs"]]
+        self.assertEqual(legs, ["41", "42", "43"])
+        self.assertTrue(all(exercise.equipment == "none" for part in candidates.values() for exercise in part))
+
+        gym = library.candidates_for({"environment": "gym"}, [])
+        self.assertIn("29", [exercise.number for exercise in gym["Legs"]])
+        self.assertEqual(gym, library.candidates_for({"environment": "gym"}, []))
+
+    def test_planner_message_includes_candidates(self):
+        """プランナーのメッセージに申告された既往歴で絞り込んだ種目候補が含まれること"""
+        from core.planner.graph import create_planner_message
+        message = create_planner_message(
+            {"user_profile": {"injuries": ["腰痛"]}, "preferences": {"environment": "home", "equipment": "ダンベル"}},
+            {"risk_factors": []},
+        )
+        self.assertIn("## 種目候補", message)
+        self.assertIn("ゴブレットスクワット [26]", message)
+        self.assertNotIn("ルーマニアンデッドリフト [28]", message)
+        self.assertNotIn("レッグプレス [29]", message)
+
+    def test_candidates_ignore_analyzer_risk_factors(self):
+        """分析レポートのリスク要因の記述では種目候補が変わらないこと"""
+        from core.planner.graph import create_planner_message
+        input_data = {"user_profile": {"injuries": []}, "preferences": {"environment": "home", "equipment": "ダンベル"}}
+        message = create_planner_message(input_data, {"risk_factors": ["腰・膝への負担"]})
+        self.assertIn("ルーマニアンデッドリフト [28]", message)
+        self.assertIn("自重スクワット [25]", message)
+
+    @patch('core.planner.graph.invoke_structured')
+    def test_final_plan_prompt_includes_candidates_in_both_modes(self, mock_invoke):
+        """種目を選ぶ構造化出力のプロンプトにも、full_context モードを含めて種目候補が含まれること"""
+        from core.common.context_cache import full_context_prefix
+        from core.planner.graph import _generate_training_plan
+        mock_invoke.return_value = MagicMock(model_dump=lambda: {})
+        state = {
+            "input_data": {"user_profile": {"injuries": ["膝痛"]}, "preferences": {"environment": "home"}},
+            "analysis_report": {},
+            "messages": [],
+        }
+        for prefix in (None, full_context_prefix("planner", "system")):
+            _generate_training_plan(state, prefix)
+            prompt = mock_invoke.call_args.args[2]
+            self.assertIn("ヒップリフト [41]", prompt)
+            self.assertNotIn("自重スクワット [25]", prompt)
+
+    @patch('core.analyzer.graph.invoke_structured')
+    @patch('core.planner.graph.invoke_structured')
+    def test_full_context_without_knowledge_does_not_cite_attachment(self, mock_planner, mock_analyzer):
+        """FULL_CONTEXT_KNOWLEDGE=0 では添付していない知識ベースの参照を指示せず、確定したセクションを渡すこと"""
+        from core.analyzer.graph import _generate_final_response
+        from core.common.context_cache import full_context_prefix
+        from core.planner.graph import _generate_training_plan
+        mock_planner.return_value = mock_analyzer.return_value = MagicMock(model_dump=lambda: {})
+        input_data = valid_plan_input()
+        input_data["user_profile"]["injuries"] = ["膝痛"]
+        state = {"input_data": input_data, "analysis_report": {}, "messages": []}
+
+        with patch.dict(os.environ, {"FULL_CONTEXT_KNOWLEDGE": "0"}):
+            prefix = full_context_prefix("planner", "system")
+        _generate_training_plan(state, prefix)
+        _generate_final_response(state, prefix)
+
+        self.assertEqual(prefix.documents, ())
+        self.assertNotIn("添付", prefix.system_instruction)
+        for mock_invoke in (mock_planner, mock_analyzer):
+            prompt = mock_invoke.call_args.args[2]
+            self.assertNotIn("添付の専門知識ベース", prompt)
+            self.assertIn("関節・整形外科的リスク", prompt)
+
+
+class ExtractInBodyCacheTests(APITestCase):
+    """InBody画像抽出のキャッシュ・同時実行集約のテスト"""
+
+    def setUp(self):
+        from api.views import _extraction_cache
+        _extraction_cache.clear()
+        self.extracted = {"weight_kg": 70.0, "confidence": "high"}
+
+    def _upload(self, content=None):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        image = SimpleUploadedFile("inbody.png", content or png_bytes(), content_type="image/png")
+        return self.client.post('/api/extract-inbody/', {"image": image}, format='multipart')
+
+    @patch('api.views.ExtractInBodyDataView._extract_data_from_image')
+    def test_same_image_is_served_from_cache(self, mock_extract):
+        """同一画像の2回目のアップロードはGeminiを呼ばずキャッシュから返すこと"""
+        mock_extract.return_value = self.extracted
+
+        first = self._upload()
+        second = self._upload()
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.data, self.extracted)
+        mock_extract.assert_called_once()
+
+    @patch('api.views.ExtractInBodyDataView._extract_data_from_image')
+    def test_different_images_are_extracted_separately(self, mock_extract):
+        """内容が異なる画像はそれぞれ抽出されること"""
+        mock_extract.return_value = self.extracted
+
+        self._upload(png_bytes(color="white"))
+        self._upload(png_bytes(color="gray"))
+
+        self.assertEqual(mock_extract.call_count, 2)
+
+    def test_concurrent_calls_share_one_execution(self):
+        """同じキーの同時実行は1回の実行にまとめられること"""
+        import threading
+        from core.common.cache import TTLCache, SingleFlight, cached_call
+
+        cache, flight = TTLCache(), SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_extract():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return self.extracted
+
+        statuses = []
+        leader = threading.Thread(target=lambda: statuses.append(cached_call(cache, flight, "k", slow_extract)[1]))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: statuses.append(cached_call(cache, flight, "k", slow_extract)[1]))
+        follower.start()
+        # 後続スレッドが進行中の実行を待ち始めるまで少し待ってから解放する
+        follower.join(0.2)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(statuses), ["MISS", "SHARED"])
+
+
+class ImagePreprocessTests(TestCase):
+    """Vision抽出前の画像前処理のテスト"""
+
+    def _jpeg(self, size, orientation=None):
+        import io
+        from PIL import Image
+        image = Image.new("RGB", size, "white")
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=95, exif=exif)
+        buffer.seek(0)
+        return buffer
+
+    def test_large_photo_is_downscaled(self):
+        """長辺がmax_edgeを超える写真は縮小され、送信バイト数が減ること"""
+        from core.extractor.preprocess import preprocess_image
+        source = self._jpeg((4000, 3000))
+        prepared = preprocess_image(source, "image/jpeg", max_edge=1024)
+        self.assertEqual(max(prepared.width, prepared.height), 1024)
+        self.assertLess(len(prepared.data), prepared.original_bytes)
+
+    def test_exif_orientation_is_applied(self):
+        """EXIFの回転情報が画素に反映されること"""
+        from core.extractor.preprocess import preprocess_image
+        prepared = preprocess_image(self._jpeg((300, 200), orientation=6), "image/jpeg")
+        self.assertEqual((prepared.width, prepared.height), (200, 300))
+        self.assertEqual(prepared.mime_type, "image/jpeg")
+
+    @patch('core.extractor.preprocess._register_heif_opener', return_value=False)
+    def test_heic_without_decoder_is_passed_through(self, mock_register):
+        """pillow-heifが無い環境のHEICは元のバイト列のまま返すこと"""
+        import io
+        from core.extractor.preprocess import preprocess_image
+        prepared = preprocess_image(io.BytesIO(b"heic-bytes"), "image/heic")
+        self.assertEqual(prepared.data, b"heic-bytes")
+        self.assertEqual(prepared.mime_type, "image/heic")
+
+    def test_undecodable_upload_is_rejected(self):
+        """壊れた画像・画素数が上限を超える画像は InvalidImageError になること"""
+        import io
+        from PIL import Image
+        from core.extractor.preprocess import preprocess_image, InvalidImageError
+        truncated = self._jpeg((400, 300)).getvalue()[:200]
+        for data in (b"not-an-image", truncated):
+            with self.assertRaises(InvalidImageError):
+                preprocess_image(io.BytesIO(data), "image/jpeg")
+        with patch.object(Image, "MAX_IMAGE_PIXELS", 100), self.assertRaises(InvalidImageError):
+            preprocess_image(self._jpeg((400, 300)), "image/jpeg")
+
+    @patch('core.extractor.inbody.extract_inbody_data')
+    def test_corrupt_upload_returns_400(self, mock_extract):
+        """デコードできない画像はVision APIを呼ばずに 400 を返すこと"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        upload = SimpleUploadedFile("broken.jpg", b"not-an-image", content_type="image/jpeg")
+        response = self.client.post('/api/extract-inbody/', {"image": upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        mock_extract.assert_not_called()
+
+
+class InBodyExtractionModeTests(TestCase):
+    """1回呼び出しの構造化抽出と2段階抽出へのフォールバックのテスト"""
+
+    def _complete(self, confidence="high"):
+        from core.extractor.inbody import InBodyData, SegmentalLean
+        return InBodyData(
+            weight_kg=70.0, muscle_mass_kg=30.0, skeletal_muscle_mass_kg=28.0, body_fat_percent=20.0,
+            segmental_lean=SegmentalLean(right_arm=3.0, left_arm=2.9, trunk=25.0, right_leg=9.0, left_leg=8.8),
+            confidence=confidence,
+        )
+
+    @patch('core.extractor.inbody.extract_agentic')
+    @patch('core.extractor.inbody.extract_direct')
+    def test_confident_single_call_skips_agentic_path(self, mock_direct, mock_agentic):
+        """1回呼び出しで全項目が高信頼で得られた場合は2段階抽出を行わないこと"""
+        from core.extractor.inbody import extract_inbody_data
+        mock_direct.return_value = self._complete()
+        result = extract_inbody_data(b"image", "image/jpeg", mode="auto")
+        self.assertEqual(result["weight_kg"], 70.0)
+        mock_agentic.assert_not_called()
+
+    @patch('core.extractor.inbody.extract_agentic')
+    @patch('core.extractor.inbody.extract_direct')
+    def test_missing_fields_fall_back_to_agentic_path(self, mock_direct, mock_agentic):
+        """項目が欠けている・信頼度が低い場合は2段階抽出にフォールバックすること"""
+        from core.extractor.inbody import extract_inbody_data
+        incomplete = self._complete()
+        incomplete.segmental_lean.trunk = None
+        mock_direct.return_value = incomplete
+        mock_agentic.return_value = self._complete(confidence="medium")
+
+        result = extract_inbody_data(b"image", "image/jpeg", mode="auto")
+
+        mock_agentic.assert_called_once()
+        self.assertEqual(result["confidence"], "medium")
+
+    def test_genai_client_outlives_the_call(self):
+        """GenAIクライアントは呼び出しが終わるまで破棄されないこと（破棄時に接続が閉じられるため）"""
+        import gc
+        import weakref
+        from core.extractor.inbody import _generate_content
+
+        class Models:
+            def __init__(self, client):
+                self.client = weakref.ref(client)
+
+            def generate_content(self, **kwargs):
+                gc.collect()
+                if self.client() is None:
+                    raise RuntimeError("client has been closed")
+                return "response"
+
+        class Client:
+            def __init__(self):
+                self.models = Models(self)
+
+        with patch('core.extractor.inbody.get_genai_client', side_effect=lambda timeout=None: Client()):
+            self.assertEqual(_generate_content("vision.direct", ["image"], None), "response")
+
+
+class BulkExtractInBodyTests(APITransactionTestCase):
+    """InBody一括抽出エンドポイントのテスト（プラン生成はワーカースレッドからDBを使うためトランザクションを分ける）"""
+
+    def setUp(self):
+        from api.views import _extraction_cache
+        _extraction_cache.clear()
+
+    def _read_lines(self, response):
+        body = b"".join(response.streaming_content).decode("utf-8")
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_missing_files_returns_400(self):
+        """images / pdf のどちらもない場合は 400 エラーを返すこと"""
+        response = self.client.post('/api/extract-inbody/bulk/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('api.views.ExtractInBodyDataView._extract_data_from_image')
+    def test_images_and_pdf_pages_are_streamed_per_item(self, mock_extract):
+        """複数画像とPDFの各ページがそれぞれ1行ずつ返り、最後に集計行が返ること"""
+        import io
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        mock_extract.return_value = {"weight_kg": 70.0, "confidence": "high"}
+        pages = [Image.new("RGB", (200, 300), "white"), Image.new("RGB", (200, 300), "gray")]
+        pdf_buffer = io.BytesIO()
+        pages[0].save(pdf_buffer, format="PDF", save_all=True, append_images=pages[1:])
+
+        response = self.client.post('/api/extract-inbody/bulk/', {
+            "images": [
+                SimpleUploadedFile("a.png", png_bytes(color="white"), content_type="image/png"),
+                SimpleUploadedFile("b.png", png_bytes(color="gray"), content_type="image/png"),
+            ],
+            "pdf": SimpleUploadedFile("day.pdf", pdf_buffer.getvalue(), content_type="application/pdf"),
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = self._read_lines(response)
+        items, summary = lines[:-1], lines[-1]["summary"]
+        self.assertEqual(sorted(item["source"] for item in items), ["a.png", "b.png", "day.pdf#page=1", "day.pdf#page=2"])
+        self.assertTrue(all(item["status"] == "ok" for item in items))
+        self.assertEqual(summary, {"total": 4, "succeeded": 4, "failed": 0})
+
+    @patch('api.views.GenerateTrainingPlanView._save_history', return_value=7)
+    @patch('api.views.GenerateTrainingPlanView._generate_with_cached_analysis')
+    @patch('api.views.ExtractInBodyDataView._extract_data_from_image')
+    def test_malformed_plan_is_not_saved(self, mock_extract, mock_generate, mock_save):
+        """一括処理でも生成結果をスキーマで検証し、期待形式でないプランは履歴に保存しないこと"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        mock_extract.return_value = {**valid_plan_input()["inbody_metrics"], "confidence": "high"}
+        malformed = mock_plan_response()
+        del malformed["training_plan"]["weekly_schedule"]
+        mock_generate.return_value = (malformed, "MISS")
+        profile = {key: value for key, value in valid_plan_input().items() if key != "inbody_metrics"}
+
+        response = self.client.post('/api/extract-inbody/bulk/', {
+            "images": [SimpleUploadedFile("a.png", png_bytes(), content_type="image/png")],
+            "generate_plan": "true",
+            "profile": json.dumps(profile, ensure_ascii=False),
+        }, format='multipart')
+
+        item = self._read_lines(response)[0]
+        self.assertEqual(item["status"], "ok")
+        self.assertEqual(item["plan"]["status"], "error")
+        self.assertIn("weekly_schedule", item["plan"]["error"])
+        mock_save.assert_not_called()
+
+    @patch('api.views.GenerateTrainingPlanView._save_history', return_value=7)
+    @patch('api.views.GenerateTrainingPlanView._generate_with_cached_analysis')
+    @patch('api.views.ExtractInBodyDataView._extract_data_from_image')
+    def test_generate_plan_chains_and_reports_plan_failure_separately(self, mock_extract, mock_generate, mock_save):
+        """generate_plan=true では抽出結果からプランを生成し、プラン生成の失敗は抽出の status ではなく plan に返すこと"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        def extract(data, content_type):
+            return {**valid_plan_input()["inbody_metrics"], "weight_kg": 80.0 if data == png_bytes(color="gray") else 70.0, "confidence": "high"}
+
+        def generate(input_data, **kwargs):
+            if input_data["inbody_metrics"]["weight_kg"] == 80.0:
+                raise RuntimeError("planner failed")
+            return mock_plan_response(), "MISS"
+
+        mock_extract.side_effect = extract
+        mock_generate.side_effect = generate
+        profile = {key: value for key, value in valid_plan_input().items() if key != "inbody_metrics"}
+
+        response = self.client.post('/api/extract-inbody/bulk/', {
+            "images": [
+                SimpleUploadedFile("a.png", png_bytes(color="white"), content_type="image/png"),
+                SimpleUploadedFile("b.png", png_bytes(color="gray"), content_type="image/png"),
+            ],
+            "generate_plan": "true",
+            "profile": json.dumps(profile, ensure_ascii=False),
+        }, format='multipart')
+
+        lines = self._read_lines(response)
+        items = {item["source"]: item for item in lines[:-1]}
+        self.assertEqual(items["a.png"]["plan"]["status"], "ok")
+        self.assertEqual(items["a.png"]["plan"]["plan_id"], 7)
+        self.assertEqual(items["b.png"]["status"], "ok")
+        self.assertEqual(items["b.png"]["plan"], {"status": "error", "error": "planner failed"})
+        self.assertEqual(lines[-1]["summary"], {"total": 2, "succeeded": 2, "failed": 0})
+
+    @patch('api.views.ExtractInBodyDataView._extract_data_from_image', return_value={"weight_kg": 70.0})
+    def test_pdf_pages_stream_before_the_whole_document_is_rendered(self, mock_extract):
+        """PDFのページは読み込み件数の上限までしか先に描画せず、最初の結果は全ページの描画前に返ること"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from core.common.ratelimit import RateLimiter
+        rendered = []
+
+        def split_pdf_pages(pdf):
+            for page_number in range(1, 31):
+                rendered.append(page_number)
+                yield page_number, png_bytes(width=page_number)
+
+        with patch('core.extractor.pdf.split_pdf_pages', split_pdf_pages), \
+                patch('api.views.INBODY_BULK_WINDOW', 2), \
+                patch('api.views._bulk_rate_limiter', RateLimiter(rate=1000, burst=100)):
+            response = self.client.post('/api/extract-inbody/bulk/', {
+                "pdf": SimpleUploadedFile("day.pdf", b"%PDF", content_type="application/pdf"),
+            }, format='multipart')
+            stream = iter(response.streaming_content)
+            first = json.loads(next(stream))
+            rendered_before_first = len(rendered)
+            rest = [json.loads(line) for line in stream]
+
+        self.assertEqual(first["status"], "ok")
+        self.assertLessEqual(rendered_before_first, 3)
+        self.assertEqual(rest[-1]["summary"]["total"], 30)
+
+    def test_too_many_images_returns_400(self):
+        """画像数が上限を超える場合は 400 エラーを返すこと"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        with patch('api.views.INBODY_BULK_MAX_ITEMS', 1):
+            response = self.client.post('/api/extract-inbody/bulk/', {
+                "images": [
+                    SimpleUploadedFile("a.png", png_bytes(color="white"), content_type="image/png"),
+                    SimpleUploadedFile("b.png", png_bytes(color="gray"), content_type="image/png"),
+                ],
+            }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rate_limiter_spaces_out_calls_beyond_burst(self):
+        """バースト分を使い切ると、補充レートに応じて待機すること"""
+        from core.common.ratelimit import RateLimiter
+        limiter = RateLimiter(rate=20, burst=2)
+        waits = [limiter.acquire() for _ in range(3)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertGreater(waits[2], 0.0)
+
+
+class PlanHistoryTests(APITestCase):
+    """生成履歴の保存・一覧・詳細（条件付きGET）のテスト"""
+
+    def setUp(self):
+        self.valid_input = {**valid_plan_input(), "member_id": "M-001"}
+        self.mock_response = mock_plan_response()
+        self.mock_response["training_plan"]["weekly_schedule"][0]["exercises"][0]["notes"] = "膝をつま先より前に出さない"
+
+    def _generate(self, payload, **headers):
+        with patch('api.views.GenerateTrainingPlanView._generate_plan') as mock_generate:
+            mock_generate.return_value = {**copy.deepcopy(self.mock_response), "timings": {"analyzer": 1.2, "planner": 3.4}}
+            return self.client.post('/api/generate/', payload, format='json', **headers)
+
+    def test_generation_is_persisted(self):
+        """生成結果が履歴として保存され、X-Plan-Id ヘッダーで返ること"""
+        from api.models import GeneratedPlan
+        response = self._generate(self.valid_input)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        plan = GeneratedPlan.objects.get(pk=int(response["X-Plan-Id"]))
+        self.assertEqual(plan.member_id, "M-001")
+        self.assertEqual(plan.timings, {"analyzer": 1.2, "planner": 3.4})
+        self.assertEqual(plan.training_plan["split_method"], "全身法")
+        self.assertNotIn("timings", response.json())
+
+    def test_input_hash_ignores_member_id(self):
+        """会員IDが異なっても同じ入力なら同じハッシュになること"""
+        from api.models import GeneratedPlan
+        self._generate(self.valid_input)
+        self._generate({**self.valid_input, "member_id": "M-002"})
+
+        hashes = set(GeneratedPlan.objects.values_list("input_hash", flat=True))
+        self.assertEqual(len(hashes), 1)
+
+    def _login(self, username, is_staff=False):
+        from django.contrib.auth.models import User
+        self.client.force_authenticate(User.objects.create_user(username, is_staff=is_staff))
+
+    def test_list_filters_by_member_and_paginates(self):
+        """管理者の一覧は会員IDで絞り込まれ、新しい順にページングされること"""
+        for _ in range(3):
+            self._generate(self.valid_input)
+        self._generate({**self.valid_input, "member_id": "M-002"})
+        self._login("admin", is_staff=True)
+
+        response = self.client.get('/api/plans/', {"member_id": "M-001", "page_size": 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 3)
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertNotIn("training_plan", response.data["results"][0])
+        self.assertEqual(self.client.get('/api/plans/').data["count"], 4)
+
+    def test_history_is_scoped_to_the_logged_in_member(self):
+        """未ログインでは参照できず、会員は自分の履歴のみ一覧・取得できること"""
+        own_id = self._generate(self.valid_input)["X-Plan-Id"]
+        other_id = self._generate({**self.valid_input, "member_id": "M-002"})["X-Plan-Id"]
+
+        self.assertEqual(self.client.get('/api/plans/').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(f'/api/plans/{own_id}/').status_code, status.HTTP_403_FORBIDDEN)
+
+        self._login("M-001")
+        response = self.client.get('/api/plans/')
+        self.assertEqual([plan["id"] for plan in response.data["results"]], [int(own_id)])
+        self.assertEqual(self.client.get('/api/plans/', {"member_id": "M-002"}).data["count"], 0)
+        self.assertEqual(self.client.get(f'/api/plans/{own_id}/').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(f'/api/plans/{other_id}/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_detail_supports_conditional_get(self):
+        """詳細はETagを返し、If-None-Match が一致すれば 304 を返すこと"""
+        plan_id = self._generate(self.valid_input)["X-Plan-Id"]
+        self._login("M-001")
+
+        response = self.client.get(f'/api/plans/{plan_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["training_plan"]["split_method"], "全身法")
+
+        cached = self.client.get(f'/api/plans/{plan_id}/', HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_missing_plan_returns_404(self):
+        """存在しない履歴IDは 404 を返すこと"""
+        self._login("M-001")
+        response = self.client.get('/api/plans/999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PartialPipelineTests(APITestCase):
+    """preferencesのみ変更した再生成で分析レポートを再利用するテスト"""
+
+    def setUp(self):
+        from api.views import _analysis_cache
+        _analysis_cache.clear()
+        self.valid_input = valid_plan_input()
+        self.mock_response = mock_plan_response()
+        self.mock_response["training_plan"]["weekly_schedule"][0]["exercises"][0]["notes"] = "膝をつま先より前に出さない"
+
+    def _generate(self, payload):
+        with patch('api.views.GenerateTrainingPlanView._generate_plan') as mock_generate:
+            mock_generate.return_value = copy.deepcopy(self.mock_response)
+            response = self.client.post('/api/generate/', payload, format='json')
+        return response, mock_generate.call_args.args
+
+    def test_preferences_change_reuses_cached_analysis(self):
+        """preferencesのみ変更した場合はキャッシュした分析レポートでPlannerのみ実行すること"""
+        first, first_args = self._generate(self.valid_input)
+        gym_input = {**self.valid_input, "preferences": {**self.valid_input["preferences"], "environment": "gym"}}
+        second, second_args = self._generate(gym_input)
+
+        self.assertEqual(first["X-Analysis-Cache"], "MISS")
+        self.assertIsNone(first_args[1])
+        self.assertEqual(second["X-Analysis-Cache"], "HIT")
+        self.assertEqual(second_args[1]["body_type"], "適正")
+        self.assertNotIn("reuse_analysis", second_args[0])
+
+    def test_goal_change_reruns_analyzer(self):
+        """分析に使う入力（目標）が変わった場合はAnalyzerから実行すること"""
+        self._generate(self.valid_input)
+        response, args = self._generate({**self.valid_input, "goal": {"type": "筋肥大", "days_per_week": "3"}})
+
+        self.assertEqual(response["X-Analysis-Cache"], "MISS")
+        self.assertIsNone(args[1])
+
+    def test_supplied_analysis_report_skips_analyzer(self):
+        """リクエストで分析レポートを指定した場合はそれを使うこと"""
+        payload = {**self.valid_input, "analysis_report": self.mock_response["analysis_report"]}
+        response, args = self._generate(payload)
+
+        self.assertEqual(response["X-Analysis-Cache"], "SUPPLIED")
+        self.assertEqual(args[1]["body_type"], "適正")
+
+    def test_reuse_analysis_false_bypasses_cache(self):
+        """reuse_analysis=false の場合はキャッシュがあってもAnalyzerから実行すること"""
+        self._generate(self.valid_input)
+        response, args = self._generate({**self.valid_input, "reuse_analysis": False})
+
+        self.assertEqual(response["X-Analysis-Cache"], "MISS")
+        self.assertIsNone(args[1])
+
+    def test_orchestrator_without_analyzer_starts_at_adapter(self):
+        """skip_analyzer=True のオーケストレーターにはanalyzerノードが含まれないこと"""
+        from core.orchestrator.graph import build_orchestrator, create_initial_state
+        graph = build_orchestrator(skip_analyzer=True).get_graph()
+        self.assertNotIn("analyzer", graph.nodes)
+
+        state = create_initial_state(self.valid_input, self.mock_response["analysis_report"])
+        self.assertEqual(state["messages"], [])
+        self.assertEqual(state["analysis_report"]["body_type"], "適正")
+
+
+class PlanRegenerateTests(APITestCase):
+    """保存済みプランの1日分・1種目のみの部分再生成テスト"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from api.models import GeneratedPlan
+        self.input_data = valid_plan_input()
+        self.training_plan = mock_plan_response()["training_plan"]
+        self.training_plan["weekly_schedule"].append({
+            "day_label": "Day 2",
+            "focus": "上半身",
+            "exercises": [copy.deepcopy(self.training_plan["weekly_schedule"][0]["exercises"][0])],
+        })
+        self.base = GeneratedPlan.objects.create(
+            member_id="M-001",
+            input_hash="hash",
+            input_data=self.input_data,
+            analysis_report=mock_plan_response()["analysis_report"],
+            training_plan=self.training_plan,
+            model_name="test-model",
+            prompt_version="v1",
+        )
+        self.client.force_authenticate(User.objects.create_user("M-001"))
+
+    def test_other_members_plan_cannot_be_regenerated(self):
+        """他の会員の履歴は再生成できないこと"""
+        from django.contrib.auth.models import User
+        self.client.force_authenticate(User.objects.create_user("M-002"))
+        response = self.client.post(
+            f'/api/plans/{self.base.pk}/regenerate/',
+            {"day_index": 0, "change_request": "軽めにして"},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch('core.planner.edit.invoke_structured')
+    def test_regenerate_exercise_splices_only_target(self, mock_invoke):
+        """指定した種目のみが置き換わり、新しい履歴として保存されること"""
+        from core.common.state import Exercise
+        mock_invoke.return_value = Exercise(
+            target_area="脚", exercise_name="ヒップリフト", sets=3, reps="12", instructions=["仰向けになる"],
+        )
+
+        response = self.client.post(
+            f'/api/plans/{self.base.pk}/regenerate/',
+            {"day_index": 0, "exercise_index": 0, "change_request": "膝に優しい種目にして"},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(mock_invoke.call_args.args[:2], ("planner.edit", Exercise))
+        schedule = response.data["training_plan"]["weekly_schedule"]
+        self.assertEqual(schedule[0]["exercises"][0]["exercise_name"], "ヒップリフト")
+        self.assertEqual(schedule[1], self.training_plan["weekly_schedule"][1])
+        self.assertEqual(response.data["parent"], self.base.pk)
+        self.base.refresh_from_db()
+        self.assertEqual(self.base.training_plan["weekly_schedule"][0]["exercises"][0]["exercise_name"], "スクワット")
+
+    @patch('core.planner.edit.invoke_structured')
+    def test_regenerate_day_uses_day_plan_schema(self, mock_invoke):
+        """exercise_index を省略した場合は1日分をDayPlanとして再生成すること"""
+        from core.common.state import DayPlan
+        mock_invoke.return_value = DayPlan(day_label="Day 2", focus="背中", exercises=[])
+
+        response = self.client.post(
+            f'/api/plans/{self.base.pk}/regenerate/',
+            {"day_index": 1, "change_request": "背中の日にして"},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(mock_invoke.call_args.args[:2], ("planner.edit", DayPlan))
+        self.assertEqual(response.data["training_plan"]["weekly_schedule"][1]["focus"], "背中")
+
+    @patch('core.planner.edit.invoke_structured')
+    def test_out_of_range_index_returns_400(self, mock_invoke):
+        """範囲外のインデックスはLLMを呼ばずに 400 を返すこと"""
+        response = self.client.post(
+            f'/api/plans/{self.base.pk}/regenerate/',
+            {"day_index": 5, "change_request": "変更"},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        mock_invoke.assert_not_called()
+
+    @patch('core.planner.edit.invoke_structured')
+    def test_invalid_model_output_returns_500(self, mock_invoke):
+        """構造化出力の検証エラー（ValueError のサブクラス）はクライアントエラーではなく 500 を返すこと"""
+        from pydantic import ValidationError
+        from core.common.state import Exercise
+        try:
+            Exercise.model_validate({})
+        except ValidationError as e:
+            mock_invoke.side_effect = e
+
+        response = self.client.post(
+            f'/api/plans/{self.base.pk}/regenerate/',
+            {"day_index": 0, "exercise_index": 0, "change_request": "変更"},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def test_exercise_prompt_contains_only_target_day(self):
+        """種目の編集プロンプトには他の日のメニュー詳細を含めないこと"""
+        from core.planner.edit import build_edit_prompt
+        self.training_plan["weekly_schedule"][1]["exercises"][0]["exercise_name"] = "腕立て伏せ"
+        prompt = build_edit_prompt(
+            self.input_data, self.base.analysis_report, self.training_plan, 0, 0, "膝に優しい種目にして",
+        )
+
+        self.assertIn("スクワット", prompt)
+        self.assertNotIn("腕立て伏せ", prompt)
+        self.assertIn("膝に優しい種目にして", prompt)
+
+
+class PipelineCheckpointTests(TestCase):
+    """パイプラインのチェックポイントと失敗ノードからの再開のテスト"""
+
+    def setUp(self):
+        from core.common.checkpoint import create_checkpointer
+        self.checkpointer = create_checkpointer(":memory:")
+        patcher = patch('core.common.checkpoint._checkpointer', self.checkpointer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.input_data = valid_plan_input()
+        self.mock_response = mock_plan_response()
+        self.calls = {"analyzer": 0, "planner": 0}
+        self.planner_failures = 1
+
+    def _analyzer(self, state):
+        self.calls["analyzer"] += 1
+        return {"analysis_report": self.mock_response["analysis_report"]}
+
+    def _planner(self, state):
+        self.calls["planner"] += 1
+        if self.planner_failures:
+            self.planner_failures -= 1
+            raise TimeoutError("planner timed out")
+        return {"training_plan": self.mock_response["training_plan"]}
+
+    def _patched(self, max_retries):
+        from contextlib import ExitStack
+        stack = ExitStack()
+        stack.enter_context(patch('core.orchestrator.graph.build_analyzer_graph', return_value=self._analyzer))
+        stack.enter_context(patch('core.orchestrator.graph.build_planner_graph', return_value=self._planner))
+        stack.enter_context(patch.dict(os.environ, {"PIPELINE_MAX_RETRIES": str(max_retries)}))
+        return stack
+
+    def _run(self, resume_key, max_retries):
+        from api.views import GenerateTrainingPlanView
+        with self._patched(max_retries):
+            return GenerateTrainingPlanView()._generate_plan(self.input_data, resume_key=resume_key)
+
+    def test_automatic_retry_resumes_from_failed_node(self):
+        """プランナーが失敗した場合、Analyzerを再実行せずにプランナーから再開すること"""
+        result = self._run("req-auto", max_retries=1)
+
+        self.assertEqual(result["training_plan"]["split_method"], "全身法")
+        self.assertEqual(result["analysis_report"]["body_type"], "適正")
+        self.assertEqual(self.calls, {"analyzer": 1, "planner": 2})
+
+    def test_retry_with_same_key_resumes(self):
+        """同じ Idempotency-Key で再試行した場合、最後に完了したノードの次から再開すること"""
+        with self.assertRaises(TimeoutError):
+            self._run("key-manual", max_retries=0)
+
+        result = self._run("key-manual", max_retries=0)
+
+        self.assertEqual(result["training_plan"]["split_method"], "全身法")
+        self.assertEqual(self.calls, {"analyzer": 1, "planner": 2})
+
+    def test_resubmitted_input_resumes_without_headers(self):
+        """ヘッダーなしで同じ入力を再送信した場合も失敗したノードから再開し、完了後の再送信は新しく生成すること"""
+        with self._patched(max_retries=0):
+            failed = self.client.post('/api/generate/', self.input_data, content_type='application/json')
+            resumed = self.client.post('/api/generate/', self.input_data, content_type='application/json')
+            self.assertEqual(self.calls, {"analyzer": 1, "planner": 2})
+            with patch('api.views._analysis_cache.get', return_value=None):
+                self.client.post('/api/generate/', self.input_data, content_type='application/json')
+
+        self.assertEqual(failed.status_code, 500)
+        self.assertEqual(resumed.status_code, 200)
+        self.assertEqual(self.calls, {"analyzer": 2, "planner": 3})
+
+    def test_reused_key_with_different_input_starts_fresh(self):
+        """同じ Idempotency-Key でも入力が異なる場合は、完了済みのチェックポイントを返さずに新しく実行すること"""
+        self.planner_failures = 0
+        self._run("req-reused", max_retries=0)
+
+        self.input_data = {**self.input_data, "goal": {"type": "筋肥大", "days_per_week": "4"}}
+        self._run("req-reused", max_retries=0)
+
+        self.assertEqual(self.calls, {"analyzer": 2, "planner": 2})
+
+    def test_gc_deletes_expired_threads(self):
+        """保持期間を過ぎたスレッドのチェックポイントが削除されること"""
+        from core.common.checkpoint import gc_checkpoints
+        self.planner_failures = 0
+        self._run("req-gc", max_retries=0)
+        with self.checkpointer.cursor() as cur:
+            cur.execute("SELECT thread_id FROM checkpoint_threads WHERE thread_id LIKE 'key-%'")
+            (thread_id,), = cur.fetchall()
+        config = {"configurable": {"thread_id": thread_id}}
+        self.assertIsNotNone(self.checkpointer.get_tuple(config))
+
+        self.assertEqual(gc_checkpoints(self.checkpointer, max_age_seconds=3600), 0)
+        self.assertEqual(gc_checkpoints(self.checkpointer, max_age_seconds=-1), 1)
+        self.assertIsNone(self.checkpointer.get_tuple(config))
+
+
+class LLMRoutingTests(APITestCase):
+    """処理段階ごとのモデルルーティングと構造化出力失敗時のエスカレーションのテスト"""
+
+    def setUp(self):
+        from core.common.metrics import get_llm_metrics
+        get_llm_metrics().reset()
+
+    def _structured_outputs(self, mock_get_llm_for, *outputs):
+        from langchain_core.messages import AIMessage
+        raw = AIMessage(content="", usage_metadata={"input_tokens": 1000, "output_tokens": 200, "total_tokens": 1200})
+        structured = mock_get_llm_for.return_value.with_structured_output.return_value
+        structured.invoke.side_effect = [{"raw": raw, **output} for output in outputs]
+
+    def test_route_overrides_from_env(self):
+        """LLM_ROUTES で指定した段階のみモデルが差し替わること"""
+        from core.common.llm import get_route, DEFAULT_MODEL
+        with patch.dict(os.environ, {"LLM_ROUTES": json.dumps({"analyzer.loop": {"model": "gemini-2.5-flash-lite"}})}):
+            self.assertEqual(get_route("analyzer.loop")["model"], "gemini-2.5-flash-lite")
+            self.assertEqual(get_route("planner.final")["model"], DEFAULT_MODEL)
+            self.assertEqual(get_route("planner.final")["temperature"], 0.3)
+
+    @patch('core.common.llm.get_llm_for')
+    def test_escalates_only_on_validation_failure(self, mock_get_llm_for):
+        """構造化出力の検証に失敗した場合のみ上位モデルで再試行すること"""
+        from core.common.llm import invoke_structured, ESCALATION_MODEL, DEFAULT_MODEL
+        from core.common.metrics import get_llm_metrics
+        from core.common.state import DayPlan
+        plan = DayPlan(day_label="Day 1", focus="全身", exercises=[])
+        self._structured_outputs(
+            mock_get_llm_for,
+            {"parsed": None, "parsing_error": ValueError("invalid")},
+            {"parsed": plan, "parsing_error": None},
+        )
+
+        result = invoke_structured("planner.edit", DayPlan, "prompt")
+
+        self.assertEqual(result, plan)
+        models = [call.kwargs["model"] for call in mock_get_llm_for.call_args_list]
+        self.assertEqual(models, [DEFAULT_MODEL, ESCALATION_MODEL])
+        rows = {row["model"]: row for row in get_llm_metrics().snapshot()}
+        self.assertEqual(rows[DEFAULT_MODEL]["failures"], 1)
+        self.assertEqual(rows[ESCALATION_MODEL]["escalations"], 1)
+        self.assertEqual(rows[ESCALATION_MODEL]["input_tokens"], 1000)
+
+    @patch('core.common.llm.get_llm_for')
+    def test_no_escalation_when_output_is_valid(self, mock_get_llm_for):
+        """最初のモデルの出力が有効なら上位モデルを呼ばないこと"""
+        from core.common.llm import invoke_structured
+        from core.common.state import DayPlan
+        plan = DayPlan(day_label="Day 1", focus="全身", exercises=[])
+        self._structured_outputs(mock_get_llm_for, {"parsed": plan, "parsing_error": None})
+
+        invoke_structured("planner.edit", DayPlan, "prompt")
+
+        self.assertEqual(mock_get_llm_for.call_count, 1)
+
+    def test_metrics_endpoint_reports_cost(self):
+        """メトリクスエンドポイントが段階別の集計と推定コストを返すこと"""
+        from core.common.metrics import get_llm_metrics
+        get_llm_metrics().record("planner.final", "gemini-3-flash-preview", 2.0, 1_000_000, 100_000)
+
+        response = self.client.get('/api/metrics/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("vision.direct", response.data["routes"])
+        self.assertEqual(response.data["stages"][0]["estimated_cost_usd"], 0.8)
+        self.assertEqual(response.data["total"]["calls"], 1)
+
+
+class ResilienceTests(APITestCase):
+    """LLM呼び出しの締め切り・ヘッジ・サーキットブレーカーのテスト"""
+
+    def test_deadline_caps_call_timeout(self):
+        """リクエストの締め切りが呼び出し単位のタイムアウトより短い場合はそちらを使うこと"""
+        from core.common.resilience import deadline, call_timeout
+        with deadline(5):
+            self.assertLessEqual(call_timeout(60), 5)
+            with deadline(30):
+                self.assertLessEqual(call_timeout(60), 5)
+
+    def test_stuck_call_raises_deadline_exceeded(self):
+        """締め切りまでに応答が無い呼び出しは DeadlineExceeded で打ち切られること"""
+        import threading
+        from core.common.resilience import deadline, guarded_call, DeadlineExceeded
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        with deadline(0.2), self.assertRaises(DeadlineExceeded):
+            guarded_call("test-stuck-model", lambda timeout: release.wait(5))
+
+    def test_hedged_call_returns_first_response(self):
+        """ヘッジ遅延を過ぎたら2件目を送り、先に完了した結果を使うこと"""
+        import threading
+        from core.common.resilience import guarded_call
+        calls = []
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def call(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        self.assertEqual(guarded_call("test-hedge-model", call, timeout=5, hedge_after=0.05), "fast")
+        self.assertEqual(len(calls), 2)
+
+    def test_circuit_opens_and_recovers(self):
+        """エラー率が閾値を超えると open になり、クールダウン後の試行成功で closed に戻ること"""
+        from core.common.resilience import CircuitBreaker, CircuitOpenError
+        breaker = CircuitBreaker("test", failure_ratio=0.5, min_calls=4, cooldown=0.05)
+        for ok in (True, False, False, False):
+            breaker.record(ok)
+
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        import time
+        time.sleep(0.06)
+        breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record(True)
+        self.assertEqual(breaker.state, "closed")
+
+    def test_expired_deadline_does_not_hold_half_open_probe(self):
+        """締め切り切れの呼び出しが half-open の試行枠を占有せず、ブレーカーの失敗にも数えられないこと"""
+        import time
+        from core.common.resilience import deadline, guarded_call, get_circuit_breaker, CircuitBreaker, DeadlineExceeded
+        breaker = CircuitBreaker("test-expired-model", min_calls=1, cooldown=0.05)
+        breaker.record(False)
+        with patch.dict("core.common.resilience._breakers", {"test-expired-model": breaker}):
+            time.sleep(0.06)
+            with deadline(0), self.assertRaises(DeadlineExceeded):
+                guarded_call("test-expired-model", lambda timeout: "ok")
+            self.assertEqual(guarded_call("test-expired-model", lambda timeout: "ok"), "ok")
+            self.assertEqual(get_circuit_breaker("test-expired-model").state, "closed")
+
+            with deadline(0.1), self.assertRaises(DeadlineExceeded):
+                guarded_call("test-expired-model", lambda timeout: time.sleep(0.3))
+            self.assertEqual(breaker.state, "closed")
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_open_circuit_returns_503_with_retry_after(self, mock_generate):
+        """サーキットオープン時は 503 と Retry-After を返すこと"""
+        from core.common.resilience import CircuitOpenError
+        mock_generate.side_effect = CircuitOpenError("gemini-3-flash-preview", 12.3)
+        response = self.client.post('/api/generate/', valid_plan_input(), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "13")
+
+
+class WarmupTests(APITestCase):
+    """ワーカー起動時のウォームアップとレディネスチェックのテスト"""
+
+    # api.urls の読み込み（Django起動時のインポート）にかける時間の上限（秒）
+    STARTUP_IMPORT_BUDGET_SECONDS = 3.0
+
+    def setUp(self):
+        from core.common import warmup
+        patcher = patch.dict(warmup._status, {"state": "pending", "steps": {}, "imports": {}, "errors": {}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch.dict(os.environ, {"GOOGLE_API_KEY": ""})
+    def test_warmup_runs_all_steps_without_api_key(self):
+        """APIキーが無くても索引構築・グラフのコンパイルまで完了し、ベクトルストアはスキップされること"""
+        from core.common.warmup import warmup, PRELOAD_MODULES
+        result = warmup(prime=False)
+
+        self.assertEqual(result["state"], "ready")
+        self.assertEqual(result["errors"], {})
+        self.assertEqual(result["steps"]["vectorstore"], "skipped")
+        for step in ("imports", "knowledge_index", "orchestrator", "total"):
+            self.assertIn(step, result["steps"])
+        self.assertEqual(set(result["imports"]), set(PRELOAD_MODULES))
+
+    @patch('core.common.warmup.start_warmup')
+    @patch('core.common.warmup._compile_orchestrators', side_effect=RuntimeError("compile failed"))
+    def test_failed_step_keeps_worker_not_ready(self, mock_compile, mock_start):
+        """ステップが失敗した場合は failed となり、/api/ready/ は 503 を返して再試行を始めること"""
+        from core.common.warmup import warmup
+        result = warmup(prime=False)
+        self.assertEqual(result["state"], "failed")
+        self.assertEqual(result["errors"], {"orchestrator": "compile failed"})
+
+        response = self.client.get('/api/ready/')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json()["status"], "warmup_failed")
+        mock_start.assert_called_once()
+
+    def test_orchestrator_is_compiled_once(self):
+        """同じ構成のオーケストレーターは再コンパイルせずに再利用されること"""
+        from core.orchestrator.graph import get_orchestrator
+        self.assertIs(get_orchestrator(skip_analyzer=True), get_orchestrator(skip_analyzer=True))
+        self.assertIsNot(get_orchestrator(skip_analyzer=True), get_orchestrator(skip_analyzer=False))
+
+    @patch('core.common.warmup.warmup')
+    def test_ready_returns_503_until_warmup_completes(self, mock_warmup):
+        """ウォームアップ完了前は 503、完了後は 200 を返し、/api/health/ は常に 200 であること"""
+        from core.common import warmup
+
+        response = self.client.get('/api/ready/')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json()["status"], "warming_up")
+        self.assertEqual(self.client.get('/api/health/').status_code, status.HTTP_200_OK)
+
+        warmup._status["state"] = "ready"
+        response = self.client.get('/api/ready/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["status"], "ready")
+
+    def test_startup_imports_within_budget(self):
+        """Django起動時のインポートが予算内に収まり、重いモジュールを読み込まないこと"""
+        import subprocess
+        import sys
+        from pathlib import Path
+        script = (
+            "import os, sys, time; started = time.perf_counter();"
+            "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings');"
+            "import django; django.setup(); import api.urls;"
+            "heavy = [m for m in ('langgraph', 'langchain_google_genai', 'chromadb') if m in sys.modules];"
+            "print(time.perf_counter() - started, ','.join(heavy))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=Path(__file__).resolve().parent.parent,
+            env={**os.environ, "WARMUP_ON_STARTUP": "0"},
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+
+        self.assertLess(float(output[0]), self.STARTUP_IMPORT_BUDGET_SECONDS)
+        self.assertEqual(output[1:], [])
+
+
+class MmapIndexTests(TestCase):
+    """読み取り専用のメモリマップ索引のテスト（埋め込みAPIは呼ばない）"""
+
+    def setUp(self):
+        import tempfile
+        from pathlib import Path
+        import numpy as np
+        from core.common.mmap_index import write_index
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.index_dir = write_index(
+            Path(tmp_dir.name),
+            ids=["a", "b", "c"],
+            texts=["膝痛の代替種目", "体脂肪率の判定", "睡眠とリカバリー"],
+            metadatas=[{"Header 2": "16"}, {"Header 2": "13"}, {"Header 2": "23"}],
+            embeddings=np.array([[1, 0, 0], [0, 2, 0], [0, 0, 3]]),
+        )
+
+    def _index(self, query_vector):
+        from core.common.mmap_index import MmapVectorIndex
+        embedding_function = MagicMock()
+        embedding_function.embed_query.return_value = query_vector
+        return MmapVectorIndex(self.index_dir, embedding_function=embedding_function)
+
+    def test_embeddings_are_memory_mapped_read_only(self):
+        """埋め込み行列はメモリマップとして開かれ、書き込みできないこと"""
+        import numpy as np
+        index = self._index([1, 0, 0])
+        self.assertIsInstance(index.embeddings, np.memmap)
+        self.assertFalse(index.embeddings.flags.writeable)
+        self.assertTrue(np.allclose(np.linalg.norm(index.embeddings, axis=1), 1))
+
+    def test_similarity_and_mmr_search(self):
+        """類似度検索・MMR検索が最も近いチャンクを先頭にメタデータ付きで返すこと"""
+        index = self._index([0.1, 1, 0])
+        results = index.similarity_search("体脂肪率", k=2)
+        self.assertEqual([doc.id for doc in results], ["b", "a"])
+        self.assertEqual(results[0].metadata, {"Header 2": "13"})
+        self.assertEqual(index.max_marginal_relevance_search("体脂肪率", k=1, fetch_k=3)[0].id, "b")
+
+    def test_vector_search_uses_mmap_index(self):
+        """KNOWLEDGE_VECTOR_INDEX=mmap ではChromaを開かずにメモリマップ索引を検索すること"""
+        from core.common import db_client
+        from core.common.retriever import _vector_search
+        with patch.dict(db_client._mmap_indexes, {db_client.DEFAULT_COLLECTION: self._index([0, 0, 1])}), \
+                patch.object(db_client, 'get_vectorstore', side_effect=AssertionError("Chroma must not be opened")), \
+                patch.dict(os.environ, {"KNOWLEDGE_VECTOR_INDEX": "mmap"}):
+            results = _vector_search("睡眠", k=1, fetch_k=3, lambda_mult=0.5)
+        self.assertEqual(results[0].page_content, "睡眠とリカバリー")
+
+
+class PydanticSchemaTests(APITestCase):
+    """/api/generate/ のPydanticスキーマによる入力検証・出力シリアライズのテスト"""
+
+    def setUp(self):
+        self.valid_input = valid_plan_input()
+        self.mock_response = mock_plan_response()
+
+    def test_validation_errors_are_nested_by_field(self):
+        """検証エラーがDRFと同じくフィールドのパスごとにまとめられること"""
+        data = copy.deepcopy(self.valid_input)
+        data['user_profile']['age'] = 5
+        del data['goal']
+        response = self.client.post('/api/generate/', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        details = response.json()["details"]
+        self.assertIn("age", details["user_profile"])
+        self.assertIsInstance(details["goal"], list)
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_response_is_rendered_from_pydantic_model(self, mock_generate):
+        """出力がスキーマの既定値を補ったJSON（日本語はエスケープしない）で返り、履歴にも同じ内容が保存されること"""
+        from api.models import GeneratedPlan
+        plan = copy.deepcopy(self.mock_response)
+        del plan["training_plan"]["weekly_schedule"][0]["exercises"][0]["interval_seconds"]
+        mock_generate.return_value = plan
+        data = copy.deepcopy(self.valid_input)
+        data['preferences']['training_time_minutes'] = 30
+
+        response = self.client.post('/api/generate/', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIn("全身法".encode("utf-8"), response.content)
+        exercise = response.json()["training_plan"]["weekly_schedule"][0]["exercises"][0]
+        self.assertEqual(exercise["interval_seconds"], 60)
+        self.assertEqual(mock_generate.call_args.args[0]["preferences"]["training_time_minutes"], "30")
+        saved = GeneratedPlan.objects.get(pk=int(response["X-Plan-Id"]))
+        self.assertEqual(saved.training_plan["weekly_schedule"][0]["exercises"][0]["interval_seconds"], 60)
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_malformed_core_output_returns_500(self, mock_generate):
+        """コアの出力がスキーマに合わない場合は 500 を返すこと"""
+        plan = copy.deepcopy(self.mock_response)
+        del plan["training_plan"]["split_method"]
+        mock_generate.return_value = plan
+
+        response = self.client.post('/api/generate/', self.valid_input, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertIn("split_method", response.json()["details"]["training_plan"])
+
+
+class RequestCoalescingTests(TransactionTestCase):
+    """/api/generate/ の重複リクエストのまとめ（同一入力・Idempotency-Key）のテスト"""
+
+    def setUp(self):
+        self.valid_input = valid_plan_input()
+        self.mock_response = mock_plan_response()
+        self.client = APIClient()
+
+    def _post(self, payload, **headers):
+        return self.client.post('/api/generate/', payload, format='json', **headers)
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_concurrent_duplicates_share_one_run(self, mock_generate):
+        """同時に届いた同一入力のリクエストは1回の実行を共有すること"""
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from django.db import connection
+        release = threading.Event()
+
+        def slow_generate(*args, **kwargs):
+            release.wait(5)
+            return copy.deepcopy(self.mock_response)
+
+        def post():
+            try:
+                return APIClient().post('/api/generate/', self.valid_input, format='json')
+            finally:
+                connection.close()
+
+        mock_generate.side_effect = slow_generate
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(post) for _ in range(3)]
+            threading.Timer(0.3, release.set).start()
+            responses = [future.result() for future in futures]
+
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertEqual(sorted(response["X-Coalesced"] for response in responses), ["MISS", "SHARED", "SHARED"])
+        self.assertEqual(len({response["X-Plan-Id"] for response in responses}), 1)
+
+    def _hung_leader(self, key, release):
+        """release されるまで完了しない先行実行をスレッドで開始する"""
+        import threading
+        from django.db import connection
+        from api.idempotency import coalesce
+        started = threading.Event()
+
+        def hang():
+            started.set()
+            release.wait(5)
+            return {"by": "leader"}
+
+        def run():
+            try:
+                coalesce(key, "hash", hang, stale_after=60)
+            finally:
+                connection.close()
+
+        leader = threading.Thread(target=run)
+        leader.start()
+        self.assertTrue(started.wait(5))
+        self.addCleanup(leader.join, 5)
+        self.addCleanup(release.set)
+
+    def test_follower_wait_is_bounded_by_deadline(self):
+        """プロセス内の後続の呼び出しは、先行する実行が終わらなくても締め切りで DeadlineExceeded になること"""
+        import threading
+        import time
+        from api.idempotency import coalesce
+        from core.common.resilience import deadline, DeadlineExceeded
+        self._hung_leader("input:hung", threading.Event())
+
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded), deadline(0.3):
+            coalesce("input:hung", "hash", lambda: {"by": "follower"}, stale_after=60)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_follower_claims_after_stale_leader(self):
+        """先行する実行が stale_after を過ぎても終わらない場合、後続の呼び出しが実行権を取り直して実行すること"""
+        import threading
+        from api.idempotency import coalesce
+        self._hung_leader("input:stale", threading.Event())
+
+        result, source = coalesce("input:stale", "hash", lambda: {"by": "follower"}, stale_after=0.3)
+
+        self.assertEqual((result, source), ({"by": "follower"}, "MISS"))
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_late_retry_reuses_completed_result(self, mock_generate):
+        """完了後に届いた再試行は保持している結果を返し、パイプラインを再実行しないこと"""
+        mock_generate.return_value = copy.deepcopy(self.mock_response)
+        first = self._post(self.valid_input, HTTP_IDEMPOTENCY_KEY="retry-1")
+        retry = self._post(self.valid_input, HTTP_IDEMPOTENCY_KEY="retry-1")
+
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertEqual(retry["X-Coalesced"], "HIT")
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["X-Plan-Id"], first["X-Plan-Id"])
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_sequential_same_input_without_key_runs_again(self, mock_generate):
+        """Idempotency-Key の無い同一入力は、完了後に届いた場合は新しく生成すること"""
+        mock_generate.side_effect = lambda *args, **kwargs: mock_plan_response()
+        first = self._post(self.valid_input)
+        second = self._post(self.valid_input)
+
+        self.assertEqual(mock_generate.call_count, 2)
+        self.assertEqual(second["X-Coalesced"], "MISS")
+        self.assertNotEqual(second["X-Plan-Id"], first["X-Plan-Id"])
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_waits_for_run_in_another_process(self, mock_generate):
+        """別プロセスが実行中のリクエストは、その完了を待って結果を共有すること"""
+        import threading
+        from datetime import timedelta
+        from django.db import connection
+        from django.utils import timezone
+        from api.models import PlanRequest
+        from core.common.hashing import canonical_hash
+        from api.schemas import TrainingRequest
+        input_hash = canonical_hash(TrainingRequest.model_validate(self.valid_input).model_dump())
+        PlanRequest.objects.create(key=f"input:{input_hash}", input_hash=input_hash)
+
+        def finish_elsewhere():
+            PlanRequest.objects.filter(key=f"input:{input_hash}").update(
+                state=PlanRequest.STATE_DONE,
+                result={"body": json.dumps(self.mock_response), "plan_id": 42, "analysis_cache": "MISS"},
+                expires_at=timezone.now() + timedelta(minutes=5),
+            )
+            connection.close()
+
+        threading.Timer(0.2, finish_elsewhere).start()
+        response = self._post(self.valid_input)
+
+        mock_generate.assert_not_called()
+        self.assertEqual(response["X-Coalesced"], "SHARED")
+        self.assertEqual(response["X-Plan-Id"], "42")
+        self.assertEqual(response.json()["training_plan"]["split_method"], "全身法")
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_failed_run_is_not_retained(self, mock_generate):
+        """失敗した実行は保持せず、再試行で再実行されること"""
+        mock_generate.side_effect = [RuntimeError("upstream error"), copy.deepcopy(self.mock_response)]
+        self.assertEqual(self._post(self.valid_input).status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        response = self._post(self.valid_input)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Coalesced"], "MISS")
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_idempotency_key_reused_with_different_input_returns_422(self, mock_generate):
+        """同じ Idempotency-Key を異なる入力で使うと 422 を返すこと"""
+        mock_generate.return_value = copy.deepcopy(self.mock_response)
+        self._post(self.valid_input, HTTP_IDEMPOTENCY_KEY="conflict-1")
+        other = {**self.valid_input, "member_id": "M-999"}
+
+        response = self._post(other, HTTP_IDEMPOTENCY_KEY="conflict-1")
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
+class ContextCacheTests(APITestCase):
+    """full_context モード（静的プレフィックスのコンテキストキャッシュ）のテスト"""
+
+    def setUp(self):
+        from core.common.metrics import get_llm_metrics
+        get_llm_metrics().reset()
+        self.addCleanup(get_llm_metrics().reset)
+
+    def _prefix(self):
+        from core.common.context_cache import StaticPrefix
+        return StaticPrefix(name="test", system_instruction="あなたは専門家です。", documents=("# 知識ベース",))
+
+    def _structured_output(self, mock_get_llm_for, usage_metadata):
+        from langchain_core.messages import AIMessage
+        from core.common.state import DayPlan
+        structured = mock_get_llm_for.return_value.with_structured_output.return_value
+        structured.invoke.return_value = {
+            "raw": AIMessage(content="", usage_metadata=usage_metadata),
+            "parsed": DayPlan(day_label="Day 1", focus="全身", exercises=[]),
+            "parsing_error": None,
+        }
+        return structured
+
+    @patch('core.common.llm.get_llm_for')
+    def test_local_cache_sends_prefix_as_messages(self, mock_get_llm_for):
+        """ローカル代替ではハンドルを再利用しつつ、プレフィックスをメッセージとして送ること"""
+        from core.common.context_cache import LocalContextCache
+        from core.common.llm import invoke_structured
+        from core.common.state import DayPlan
+        cache = LocalContextCache()
+        structured = self._structured_output(mock_get_llm_for, {"input_tokens": 10, "output_tokens": 5, "total_tokens": 15})
+
+        with patch('core.common.context_cache.get_context_cache', return_value=cache):
+            invoke_structured("planner.edit", DayPlan, "質問", prefix=self._prefix())
+            invoke_structured("planner.edit", DayPlan, "質問", prefix=self._prefix())
+
+        self.assertEqual(cache.created, 1)
+        messages = structured.invoke.call_args.args[0]
+        self.assertEqual([message.content for message in messages], ["あなたは専門家です。", "# 知識ベース", "質問"])
+        self.assertNotIn("cached_content", mock_get_llm_for.call_args.kwargs)
+
+    @patch('core.common.llm.get_llm_for')
+    def test_gemini_cache_references_prefix_by_handle(self, mock_get_llm_for):
+        """Geminiではプレフィックスを1回だけ登録し、以降はハンドルで参照してキャッシュ分を安く見積もること"""
+        import time
+        from core.common.context_cache import GeminiContextCache
+        from core.common.llm import invoke_structured, DEFAULT_MODEL
+        from core.common.metrics import get_llm_metrics
+        from core.common.state import DayPlan
+        cache = GeminiContextCache()
+        structured = self._structured_output(mock_get_llm_for, {
+            "input_tokens": 1_000_000, "output_tokens": 0, "total_tokens": 1_000_000,
+            "input_token_details": {"cache_read": 1_000_000},
+        })
+
+        with patch.object(cache, '_find_or_create', return_value=("cachedContents/abc", time.monotonic() + 3600)) as mock_create, \
+                patch('core.common.context_cache.get_context_cache', return_value=cache):
+            invoke_structured("planner.edit", DayPlan, "質問", prefix=self._prefix())
+            invoke_structured("planner.edit", DayPlan, "質問", prefix=self._prefix())
+
+        self.assertEqual(mock_create.call_count, 1)
+        self.assertEqual(mock_get_llm_for.call_args.kwargs["cached_content"], "cachedContents/abc")
+        self.assertEqual([message.content for message in structured.invoke.call_args.args[0]], ["質問"])
+        row = get_llm_metrics().snapshot()[0]
+        self.assertEqual(row["model"], DEFAULT_MODEL)
+        self.assertEqual(row["cached_input_tokens"], 2_000_000)
+        self.assertAlmostEqual(row["estimated_cost_usd"], 0.1)
+
+    @patch('core.common.context_cache.GeminiContextCache._find_or_create', side_effect=RuntimeError("too few tokens"))
+    def test_gemini_cache_falls_back_to_inline_prefix(self, mock_create):
+        """登録に失敗した場合はプレフィックスをメッセージとして送り、再登録を繰り返さないこと"""
+        from core.common.context_cache import GeminiContextCache
+        cache = GeminiContextCache()
+
+        llm_kwargs, messages = cache.bind("gemini-test", self._prefix(), "質問")
+        cache.bind("gemini-test", self._prefix(), "質問")
+
+        self.assertEqual(llm_kwargs, {})
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(mock_create.call_count, 1)
+
+    @patch('core.common.context_cache.GeminiContextCache._find_or_create', side_effect=RuntimeError("unavailable"))
+    def test_gemini_cache_retries_after_retry_seconds(self, mock_create):
+        """登録の失敗はTTLではなく retry_seconds の間だけ記録し、その後は再登録を試みること"""
+        import time
+        from core.common.context_cache import GeminiContextCache
+        cache = GeminiContextCache(ttl_seconds=3600, retry_seconds=60)
+
+        cache.handle("gemini-test", self._prefix())
+        with patch('core.common.context_cache.time.monotonic', return_value=time.monotonic() + 61):
+            cache.handle("gemini-test", self._prefix())
+
+        self.assertEqual(mock_create.call_count, 2)
+
+    def test_gemini_cache_registration_does_not_block_other_callers(self):
+        """登録中は同じプレフィックスの他の呼び出しが待たずにインラインで送り、登録は1回だけ行うこと"""
+        import threading
+        import time
+        from core.common.context_cache import GeminiContextCache
+        cache = GeminiContextCache()
+        started, release = threading.Event(), threading.Event()
+
+        def slow_create(*args):
+            started.set()
+            release.wait(5)
+            return "cachedContents/abc", time.monotonic() + 3600
+
+        with patch.object(cache, '_find_or_create', side_effect=slow_create) as mock_create:
+            worker = threading.Thread(target=cache.handle, args=("gemini-test", self._prefix()))
+            worker.start()
+            self.assertTrue(started.wait(5))
+            self.assertIsNone(cache.handle("gemini-test", self._prefix()))
+            release.set()
+            worker.join(5)
+            self.assertEqual(cache.handle("gemini-test", self._prefix()), "cachedContents/abc")
+
+        self.assertEqual(mock_create.call_count, 1)
+
+    @patch('core.common.graph_builder.invoke_llm', side_effect=AssertionError("tool loop must be skipped"))
+    @patch('core.planner.graph.invoke_structured')
+    @patch('core.analyzer.graph.invoke_structured')
+    def test_full_context_pipeline_skips_tool_loop(self, mock_analyzer, mock_planner, mock_invoke_llm):
+        """full_context モードではツール呼び出しループを実行せず、知識ベース全体を含むプレフィックスで最終生成すること"""
+        from core.common.schemas import AnalysisResult, TrainingPlan
+        from core.orchestrator.graph import build_orchestrator, create_initial_state
+        mock_response = mock_plan_response()
+        mock_analyzer.return_value = AnalysisResult(**mock_response["analysis_report"])
+        mock_planner.return_value = TrainingPlan(**mock_response["training_plan"])
+
+        app = build_orchestrator(context_mode="full_context")
+        result = app.invoke(create_initial_state(valid_plan_input()))
+
+        self.assertEqual(result["training_plan"]["split_method"], "全身法")
+        prefix = mock_analyzer.call_args.kwargs["prefix"]
+        self.assertIn("ツールは使用できません", prefix.system_instruction)
+        self.assertGreater(len(prefix.documents[0]), 10_000)
+        self.assertIn("体重比骨格筋量", mock_analyzer.call_args.args[2])
+        self.assertEqual(mock_planner.call_args.kwargs["prefix"].name, "planner")
+
+
+class AdmissionControlTests(APITestCase):
+    """LLMを呼び出すエンドポイントのアドミッション制御（同時実行数・待ち行列）のテスト"""
+
+    def test_waiting_request_is_admitted_in_order(self):
+        """枠が空くまで待ったリクエストは、解放された枠を引き継いで実行されること"""
+        import threading
+        import time
+        from core.common.admission import AdmissionController
+        controller = AdmissionController("test", max_concurrent=1, max_queue=1, max_wait=2)
+        controller.acquire()
+        waited = []
+        waiter = threading.Thread(target=lambda: waited.append(controller.acquire()))
+        waiter.start()
+        while not controller.stats()["queued"]:
+            time.sleep(0.01)
+
+        controller.release(0.5)
+        waiter.join(2)
+
+        self.assertEqual(len(waited), 1)
+        self.assertEqual(controller.stats()["in_flight"], 1)
+        self.assertEqual(controller.stats()["admitted"], 2)
+
+    def test_full_queue_and_timeout_are_rejected(self):
+        """待ち行列が満杯ならすぐに、待ち時間の上限を過ぎたらその時点で断ること"""
+        import time
+        from core.common.admission import AdmissionController, AdmissionRejected
+        controller = AdmissionController("test", max_concurrent=1, max_queue=0, max_wait=0.05)
+        controller.acquire()
+        with self.assertRaises(AdmissionRejected):
+            controller.acquire()
+        self.assertTrue(controller.saturated)
+
+        controller.max_queue = 1
+        started = time.monotonic()
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        self.assertEqual(controller.stats()["rejected"], 2)
+        self.assertEqual(controller.stats()["queued"], 0)
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_busy_generate_returns_429_with_retry_after(self, mock_generate):
+        """実行枠が埋まっている場合、/api/generate/ は 429 と Retry-After を返し、状態がヘルスチェックに出ること"""
+        from core.common import warmup
+        from core.common.admission import AdmissionController
+        controller = AdmissionController("plan", max_concurrent=1, max_queue=0, max_wait=0.05)
+        controller.acquire()
+
+        with patch.dict('core.common.admission._controllers', {"plan": controller}), \
+                patch.dict(warmup._status, {"state": "ready"}):
+            response = self.client.post('/api/generate/', valid_plan_input(), format='json')
+            health = self.client.get('/api/health/')
+            ready = self.client.get('/api/ready/')
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", response)
+        mock_generate.assert_not_called()
+        self.assertEqual(health.data["admission"]["plan"]["rejected"], 1)
+        self.assertEqual(ready.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(ready.data["saturated"], ["plan"])
+
+
+class LoopBudgetTests(APITestCase):
+    """ツール呼び出しループの予算（反復回数・ツール呼び出し数・入力トークン数）のテスト"""
+
+    def setUp(self):
+        from core.common.metrics import get_loop_budget_metrics
+        get_loop_budget_metrics().reset()
+        self.addCleanup(get_loop_budget_metrics().reset)
+
+    def _run(self, budget, responses):
+        from langchain_core.messages import HumanMessage
+        from langchain_core.tools import tool
+        from core.common.graph_builder import build_tool_agent_graph
+
+        @tool
+        def lookup(query: str) -> str:
+            """テスト用の検索ツール"""
+            return f"result:{query}"
+
+        final_node = MagicMock(return_value={"analysis_report": {"done": True}})
+        with patch('core.common.graph_builder.invoke_llm', side_effect=responses) as mock_invoke_llm:
+            app = build_tool_agent_graph([lookup], "system", final_node, stage="analyzer", budget=budget)
+            app.invoke({"messages": [HumanMessage(content="analyze")], "input_data": {}})
+        return final_node, mock_invoke_llm
+
+    @staticmethod
+    def _tool_turn(count=1, input_tokens=100):
+        from langchain_core.messages import AIMessage
+        return AIMessage(
+            content="",
+            tool_calls=[{"name": "lookup", "args": {"query": str(i)}, "id": f"call-{i}"} for i in range(count)],
+            usage_metadata={"input_tokens": input_tokens, "output_tokens": 10, "total_tokens": input_tokens + 10},
+        )
+
+    def test_chatty_model_is_cut_off_by_iteration_budget(self):
+        """ツール呼び出しを続けるモデルでも、反復回数の上限で最終生成に進むこと"""
+        from core.common.graph_builder import LoopBudget
+        from core.common.metrics import get_loop_budget_metrics
+        final_node, mock_invoke_llm = self._run(
+            LoopBudget(max_iterations=2, max_tool_calls=10, max_prompt_tokens=10_000),
+            [self._tool_turn() for _ in range(5)],
+        )
+
+        self.assertEqual(mock_invoke_llm.call_count, 2)
+        final_node.assert_called_once()
+        row = get_loop_budget_metrics().snapshot()[0]
+        self.assertEqual((row["stage"], row["runs"], row["exhausted_by"]), ("analyzer", 1, {"iterations": 1}))
+
+    def test_tool_call_and_token_budgets(self):
+        """上限を超えるツール呼び出しは実行せず、入力トークン数の上限でもループを打ち切ること"""
+        from core.common.graph_builder import LoopBudget
+        from core.common.metrics import get_loop_budget_metrics
+        final_node, _ = self._run(
+            LoopBudget(max_iterations=5, max_tool_calls=2, max_prompt_tokens=10_000),
+            [self._tool_turn(count=3)],
+        )
+        tool_messages = [m for m in final_node.call_args.args[0]["messages"] if m.type == "tool"]
+        self.assertEqual(tool_messages, [])
+
+        _, mock_invoke_llm = self._run(
+            LoopBudget(max_iterations=5, max_tool_calls=10, max_prompt_tokens=1_000),
+            [self._tool_turn(input_tokens=600) for _ in range(5)],
+        )
+        self.assertEqual(mock_invoke_llm.call_count, 2)
+
+        row = get_loop_budget_metrics().snapshot()[0]
+        self.assertEqual(row["exhausted_by"], {"tool_calls": 1, "prompt_tokens": 1})
+        self.assertEqual(row["exhausted_ratio"], 1.0)
+
+    @patch.dict(os.environ, {"AGENT_LOOP_BUDGETS": '{"planner": {"max_tool_calls": 1}}'})
+    def test_budget_overrides_from_env(self):
+        """AGENT_LOOP_BUDGETS で段階ごとに上限を上書きできること"""
+        from core.common.graph_builder import LoopBudget, get_loop_budget
+        budget = get_loop_budget("planner", LoopBudget(max_iterations=3, max_tool_calls=4))
+        self.assertEqual((budget.max_iterations, budget.max_tool_calls), (3, 1))
+        self.assertEqual(get_loop_budget("analyzer", LoopBudget(max_tool_calls=4)).max_tool_calls, 4)
+
+
+class RequestCaptureTests(APITestCase):
+    """負荷試験用のリクエスト収集ミドルウェアのテスト"""
+
+    def setUp(self):
+        import tempfile
+        from api.views import _extraction_cache
+        _extraction_cache.clear()
+        self.capture_file = os.path.join(tempfile.mkdtemp(), "captures.jsonl")
+        patcher = patch.dict(os.environ, {"REQUEST_CAPTURE_FILE": self.capture_file, "REQUEST_CAPTURE_SALT": "s"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.valid_input = valid_plan_input()
+        self.mock_response = mock_plan_response()
+
+    def _captured(self):
+        with open(self.capture_file, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_plan_request_is_captured_anonymized(self, mock_generate):
+        """プラン生成のリクエストを、会員IDと自由記述（既往歴・器具を含む）を匿名化して記録すること"""
+        mock_generate.return_value = copy.deepcopy(self.mock_response)
+        payload = {
+            **self.valid_input,
+            "member_id": "M-001",
+            "user_profile": {**self.valid_input["user_profile"], "injuries": ["右膝半月板損傷"]},
+            "preferences": {**self.valid_input["preferences"], "specific_requests": "山田です"},
+        }
+
+        response = self.client.post('/api/generate/', payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        [record] = self._captured()
+        self.assertEqual(record["endpoint"], "/api/generate/")
+        self.assertEqual(record["status"], 200)
+        self.assertTrue(record["json"]["member_id"].startswith("anon-"))
+        self.assertEqual(record["json"]["preferences"]["specific_requests"], "＊＊＊＊")
+        self.assertEqual(record["json"]["preferences"]["equipment"], "＊＊＊＊")
+        self.assertEqual(record["json"]["user_profile"]["injuries"], ["＊＊＊＊＊＊＊"])
+        self.assertEqual(record["json"]["inbody_metrics"], self.valid_input["inbody_metrics"])
+
+    @patch('api.views.ExtractInBodyDataView._extract_data_from_image', return_value={"weight_kg": 70.0})
+    def test_image_is_recorded_without_content_and_loadgen_is_skipped(self, mock_extract):
+        """画像は内容を保存せずハッシュと縦横のみを記録し、loadgen の再生リクエストは記録しないこと"""
+        import hashlib
+        import io
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from api.capture import LOADGEN_USER_AGENT
+        buffer = io.BytesIO()
+        Image.new("RGB", (40, 60), "white").save(buffer, format="PNG")
+
+        def upload(**headers):
+            image = SimpleUploadedFile("inbody.png", buffer.getvalue(), content_type="image/png")
+            return self.client.post('/api/extract-inbody/', {"image": image}, format='multipart', **headers)
+
+        self.assertEqual(upload().status_code, status.HTTP_200_OK)
+        self.assertEqual(upload(HTTP_USER_AGENT=LOADGEN_USER_AGENT).status_code, status.HTTP_200_OK)
+
+        [record] = self._captured()
+        self.assertEqual((record["image"]["width"], record["image"]["height"]), (40, 60))
+        self.assertEqual(record["image"]["sha256"], hashlib.sha256(buffer.getvalue()).hexdigest())
+        self.assertEqual(record["image"]["size"], len(buffer.getvalue()))
+        self.assertNotIn("data_b64", record["image"])
+        mock_extract.assert_called_once()
+
+    def test_image_is_hashed_in_chunks_and_sized_from_preprocessing(self):
+        """画像はチャンク単位でハッシュし（read() で全体を読まない）、縦横は前処理後の画像から取ること"""
+        import base64
+        import hashlib
+        from api.capture import _image_record, describe_image, note_preprocessed_image
+        data = png_bytes(width=40)
+        image = MagicMock(content_type="image/png", size=len(data))
+        image.chunks.return_value = iter([data[:10], data[10:]])
+        image.read.side_effect = AssertionError("read() loads the whole upload")
+
+        record = describe_image(image, include_data=True)
+
+        self.assertEqual(record["sha256"], hashlib.sha256(data).hexdigest())
+        self.assertEqual(base64.b64decode(record["data_b64"]), data)
+        self.assertNotIn("width", record)
+
+        token = _image_record.set(record)
+        try:
+            note_preprocessed_image(1200, 1600)
+        finally:
+            _image_record.reset(token)
+        self.assertEqual((record["width"], record["height"]), (1200, 1600))
+
+
+class FakeGeminiTests(TestCase):
+    """Gemini API のローカル代替サーバーのテスト"""
+
+    def setUp(self):
+        from api.management.commands.fake_gemini import start_in_thread
+        server = start_in_thread(embedding_dim=8)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        patcher = patch.dict(os.environ, {
+            "GOOGLE_GEMINI_BASE_URL": f"http://127.0.0.1:{server.server_port}/",
+            "GOOGLE_API_KEY": "fake",
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_structured_output_tools_and_embeddings(self):
+        """構造化出力はスキーマを満たし、ツール付きの呼び出しは1ターン目にツールを呼び、埋め込みは指定次元で返すこと"""
+        from langchain_core.messages import HumanMessage
+        from core.analyzer.tools import retriever_tool
+        from core.common.llm import invoke_llm, invoke_structured, get_embeddings
+        from core.common.schemas import TrainingPlan
+
+        plan = invoke_structured("planner.final", TrainingPlan, "プランを作成してください")
+        self.assertGreaterEqual(len(plan.weekly_schedule), 1)
+
+        response = invoke_llm("analyzer.loop", [HumanMessage(content="分析してください")], tools=[retriever_tool])
+        self.assertEqual(response.tool_calls[0]["name"], retriever_tool.name)
+        self.assertGreater(response.usage_metadata["input_tokens"], 0)
+
+        self.assertEqual(len(get_embeddings().embed_query("体脂肪率")), 8)
+
+
+class LoadGeneratorTests(LiveServerTestCase):
+    """収集したリクエストを再生する負荷生成ツールのテスト"""
+
+    def setUp(self):
+        from api.views import _extraction_cache
+        _extraction_cache.clear()
+        self.records = [
+            {"endpoint": "/api/generate/", "json": valid_plan_input()},
+            {"endpoint": "/api/extract-inbody/", "image": {"content_type": "image/png", "sha256": "ab" * 32, "width": 64, "height": 48}},
+        ]
+        self.mock_response = mock_plan_response()
+
+    @patch('api.views.ExtractInBodyDataView._extract_data_from_image', return_value={"weight_kg": 70.0})
+    @patch('api.views.GenerateTrainingPlanView._generate_plan')
+    def test_closed_loop_replay_reports_latency_and_cache_hits(self, mock_generate, mock_extract):
+        """閉ループで再生し、エンドポイントごとのレイテンシ・分類・キャッシュヒット率を集計すること"""
+        from api.management.commands.loadgen import run_closed_loop, summarize
+        mock_generate.side_effect = lambda *args, **kwargs: copy.deepcopy(self.mock_response)
+
+        results = run_closed_loop(self.live_server_url, self.records, users=1, duration=0.5, timeout=10)
+        report = summarize(results, elapsed=0.5)
+
+        self.assertGreaterEqual(report["all"]["requests"], 4)
+        self.assertEqual(report["all"]["classes"], {"ok": report["all"]["requests"]})
+        self.assertIsNotNone(report["/api/generate/"]["latency_p95"])
+        # 同じ入力の2回目以降は分析レポートのキャッシュを、同じ代替画像は抽出結果のキャッシュを使う
+        # （完了したプランは Idempotency-Key が無いため再利用せず、毎回生成する）
+        self.assertGreater(report["/api/generate/"]["cache_hit_rate"]["X-Analysis-Cache"], 0)
+        self.assertEqual(report["/api/generate/"]["cache_hit_rate"]["X-Coalesced"], 0)
+        self.assertGreater(report["/api/extract-inbody/"]["cache_hit_rate"]["X-Cache"], 0)
+        self.assertEqual(mock_generate.call_count, report["/api/generate/"]["requests"])
+        mock_extract.assert_called_once()
+
+    def test_error_classes(self):
+        """429・503・504・接続エラーを分類すること"""
+        from api.management.commands.loadgen import classify
+        self.assertEqual(
+            [classify(200), classify(429), classify(503), classify(504), classify(400), classify(500), classify(None, ConnectionRefusedError())],
+            ["ok", "rate_limited", "unavailable", "gateway_timeout", "client_error", "server_error", "connection"],
+        )
+
+
+class StructuredLoggingTests(APITestCase):
+    """構造化ログとリクエストIDの引き継ぎのテスト"""
+
+    def _record(self, **extra):
+        import logging
+        record = logging.LogRecord("core.test", logging.INFO, __file__, 1, "hello %s", ("world",), None)
+        for key, value in extra.items():
+            setattr(record, key, value)
+        return record
+
+    def test_json_formatter_includes_request_id_and_extra(self):
+        """JSONの1行にリクエストIDと extra のフィールドが含まれること"""
+        from core.common.log import JsonFormatter, RequestContextFilter, bind_request_id
+        record = self._record(node="analyzer")
+        with bind_request_id("req-1"):
+            self.assertTrue(RequestContextFilter(verbose_sample_rate=1).filter(record))
+
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["msg"], "hello world")
+        self.assertEqual(entry["request_id"], "req-1")
+        self.assertEqual(entry["node"], "analyzer")
+        self.assertNotIn("args", entry)
+
+    def test_queued_record_keeps_exception_separate(self):
+        """キューに入れたレコードは exc_info を保ち、トレースバックが msg ではなく exc に出力されること"""
+        import sys
+        from core.common.log import JsonFormatter, StructuredQueueHandler
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = self._record(exc_info=sys.exc_info())
+
+        prepared = StructuredQueueHandler(None).prepare(record)
+        entry = json.loads(JsonFormatter().format(prepared))
+        self.assertEqual(entry["msg"], "hello world")
+        self.assertIn("ValueError: boom", entry["exc"])
+
+    def test_verbose_events_are_sampled(self):
+        """詳細イベントは LOG_VERBOSE_SAMPLE_RATE に従って間引かれ、通常のイベントは常に出力されること"""
+        from core.common.log import RequestContextFilter
+        self.assertFalse(RequestContextFilter(verbose_sample_rate=0).filter(self._record(verbose=True)))
+        self.assertTrue(RequestContextFilter(verbose_sample_rate=1).filter(self._record(verbose=True)))
+        self.assertTrue(RequestContextFilter(verbose_sample_rate=0).filter(self._record()))
+
+    def test_response_echoes_request_id(self):
+        """指定した X-Request-Id を返し、無い・不正な場合は採番すること"""
+        response = self.client.get('/api/health/', HTTP_X_REQUEST_ID="abc-123")
+        self.assertEqual(response["X-Request-Id"], "abc-123")
+
+        response = self.client.get('/api/health/', HTTP_X_REQUEST_ID="bad id\n")
+        self.assertRegex(response["X-Request-Id"], r"^[0-9a-f]{32}$")
+
+    def test_request_id_reaches_llm_call_thread(self):
+        """LLM呼び出しのスレッドでもリクエストIDが参照できること"""
+        from core.common.log import bind_request_id, get_request_id
+        from core.common.resilience import guarded_call
+        with bind_request_id("req-2"):
+            self.assertEqual(guarded_call("test-log-model", lambda timeout: get_request_id()), "req-2")
+
+
+class ProfilingTests(APITestCase):
+    """サンプリングプロファイラーと遅いリクエストのプロファイル一覧のテスト"""
+
+    def setUp(self):
+        import tempfile
+        from core.common import profiling
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = patch.object(profiling, "_store", profiling.ProfileStore(self.directory, max_profiles=2))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_profile_includes_llm_call_thread(self):
+        """プロファイル中のリクエストから呼び出したLLM呼び出しのスレッドも記録されること"""
+        import time
+        from core.common.profiling import profile_block
+        from core.common.resilience import guarded_call
+
+        def slow_model_call(timeout):
+            time.sleep(0.2)
+
+        with profile_block() as profile:
+            guarded_call("test-profile-model", slow_model_call)
+
+        self.assertGreater(profile.samples, 0)
+        folded = profile.folded()
+        self.assertIn("llm-call;", folded)
+        self.assertIn("slow_model_call (", folded)
+        self.assertRegex(folded.splitlines()[0], r"^\S.* \d+$")
+
+    def test_store_keeps_recent_profiles_only(self):
+        """保存件数の上限を超えた古いプロファイルは削除され、不正なIDは参照できないこと"""
+        from core.common.profiling import Profile, get_profile_store
+        store = get_profile_store()
+        ids = [store.save(Profile(0.01), {"request_id": f"req-{i}", "path": "/api/"}) for i in range(3)]
+
+        self.assertEqual([entry["id"] for entry in store.recent()], ids[:0:-1])
+        self.assertIsNone(store.folded_path(ids[0]))
+        self.assertIsNone(store.folded_path("../../settings"))
+
+    @patch.dict(os.environ, {"PROFILE_SLOW_THRESHOLD_SECONDS": "0"})
+    def test_slow_request_is_listed_for_admins(self):
+        """閾値を超えたリクエストのプロファイルが保存され、管理者のみ一覧・取得できること"""
+        from django.contrib.auth.models import User
+
+        response = self.client.get('/api/')
+        profile_id = response["X-Profile-Id"]
+
+        self.assertEqual(self.client.get('/api/admin/profiles/').status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        response = self.client.get('/api/admin/profiles/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entry = response.data["profiles"][0]
+        self.assertEqual((entry["id"], entry["path"], entry["reason"]), (profile_id, "/api/", "slow"))
+
+        response = self.client.get(f'/api/admin/profiles/{profile_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -2,11 +2,32 @@
 URL configuration for the API app.
 """
 from django.urls import path
-from .views import GenerateTrainingPlanView, ExtractInBodyDataView, health_check, api_info
+from .views import (
+    GenerateTrainingPlanView,
+    ExtractInBodyDataView,
+    BulkExtractInBodyDataView,
+    PlanHistoryListView,
+    PlanHistoryDetailView,
+    PlanRegenerateView,
+    health_check,
+    readiness_check,
+    llm_metrics,
+    profile_list,
+    profile_detail,
+    api_info,
+)
 
 urlpatterns = [
     path('', api_info, name='api-info'),
     path('health/', health_check, name='health-check'),
+    path('ready/', readiness_check, name='readiness-check'),
+    path('metrics/', llm_metrics, name='llm-metrics'),
+    path('admin/profiles/', profile_list, name='profile-list'),
+    path('admin/profiles/<str:profile_id>/', profile_detail, name='profile-detail'),
     path('generate/', GenerateTrainingPlanView.as_view(), name='generate-training-plan'),
     path('extract-inbody/', ExtractInBodyDataView.as_view(), name='extract-inbody'),
+    path('extract-inbody/bulk/', BulkExtractInBodyDataView.as_view(), name='extract-inbody-bulk'),
+    path('plans/', PlanHistoryListView.as_view(), name='plan-history-list'),
+    path('plans/<int:pk>/', PlanHistoryDetailView.as_view(), name='plan-history-detail'),
+    path('plans/<int:pk>/regenerate/', PlanRegenerateView.as_view(), name='plan-regenerate'),
 ]
@@ -4,6 +4,13 @@ Handles HTTP requests and responses for training menu generation.
 """
 import sys
 import os
+import io
+import json
+import hashlib
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 
 # Add core module to Python path
@@ -14,9 +21,24 @@ if str(BACKEND_DIR) not in sys.path:
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.generics import ListAPIView
+from rest_framework.pagination import PageNumberPagination
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
-from .serializers import TrainingRequestSerializer, TrainingResponseSerializer
+from .models import GeneratedPlan
+from .idempotency import coalesce, IdempotencyConflict
+from .renderers import PydanticJSONRenderer, RawJSON
+from .schemas import TrainingRequest, TrainingResponse, ValidationError, error_details
+from .serializers import (
+    GeneratedPlanSummarySerializer,
+    GeneratedPlanDetailSerializer,
+    PlanRegenerateRequestSerializer,
+)
 
 
 def initialize_environment():
@@ -38,6 +60,71 @@ def initialize_environment():
 # Initialize environment on module load
 initialize_environment()
 
+from core.common.cache import TTLCache, SingleFlight, cached_call
+from core.common.hashing import canonical_hash
+from core.common.ratelimit import RateLimiter
+from core.common.resilience import deadline, DeadlineExceeded, CircuitOpenError
+from core.common.admission import get_admission_controller, get_admission_status, AdmissionRejected
+from core.common.log import bind_request_id, get_request_id
+
+logger = logging.getLogger(__name__)
+
+# InBody画像抽出結果のキャッシュ（画像バイト列のSHA-256をキーとする）
+_extraction_cache = TTLCache(
+    maxsize=int(os.getenv("INBODY_CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.getenv("INBODY_CACHE_TTL_SECONDS", "3600")),
+)
+_extraction_flight = SingleFlight()
+
+# 分析レポートのキャッシュ（user_profile / inbody_metrics / goal のハッシュをキーとする）
+_analysis_cache = TTLCache(
+    maxsize=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "86400")),
+)
+
+# バルク抽出: Vision API呼び出しのプロセス全体でのレート制限と並列数
+_bulk_rate_limiter = RateLimiter(
+    rate=float(os.getenv("INBODY_BULK_RATE_PER_SECOND", "2")),
+    burst=int(os.getenv("INBODY_BULK_BURST", "4")),
+)
+_bulk_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("INBODY_BULK_CONCURRENCY", "4")),
+    thread_name_prefix="inbody-bulk",
+)
+# 抽出結果からのプラン生成は抽出と別のプールで行い、抽出の並列数を占有しないようにする
+_bulk_plan_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("INBODY_BULK_PLAN_CONCURRENCY", "2")),
+    thread_name_prefix="inbody-bulk-plan",
+)
+# 1リクエストで処理する画像・PDFページの上限と、同時に読み込んでおく件数（PDFは描画済みページ数）
+INBODY_BULK_MAX_ITEMS = int(os.getenv("INBODY_BULK_MAX_ITEMS", "50"))
+INBODY_BULK_WINDOW = 2 * int(os.getenv("INBODY_BULK_CONCURRENCY", "4"))
+
+ALLOWED_IMAGE_TYPES = ['image/jpeg', 'image/png', 'image/webp', 'image/heic']
+
+# リクエスト全体の締め切り（秒）。nginxのproxy_read_timeout（180s）より前に打ち切ってワーカーを解放する
+PLAN_REQUEST_DEADLINE = float(os.getenv("PLAN_REQUEST_DEADLINE_SECONDS", "170"))
+INBODY_REQUEST_DEADLINE = float(os.getenv("INBODY_REQUEST_DEADLINE_SECONDS", "120"))
+# 実行中のリクエストがこの秒数を過ぎても完了しなければ、実行したプロセスが異常終了したものとみなす
+PLAN_REQUEST_STALE_AFTER = PLAN_REQUEST_DEADLINE + 30
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+
+def upstream_error_response(e: Exception) -> Response:
+    """
+    締め切り超過は 504、サーキットブレーカーによる遮断は 503、
+    アドミッション制御による拒否は 429（いずれもRetry-After付き）のレスポンスに変換する
+    """
+    if isinstance(e, AdmissionRejected):
+        response = Response({"error": str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response["Retry-After"] = str(math.ceil(e.retry_after))
+        return response
+    if isinstance(e, CircuitOpenError):
+        response = Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response["Retry-After"] = str(math.ceil(e.retry_after))
+        return response
+    return Response({"error": str(e)}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
 
 class GenerateTrainingPlanView(APIView):
     """
@@ -47,81 +134,212 @@ class GenerateTrainingPlanView(APIView):
     
     InBodyデータとユーザー情報を受け取り、
     分析レポートとトレーニングプランを生成して返す。
+    
+    入力・出力とも api/schemas.py のPydanticモデルで1回だけ検証し、
+    出力は PydanticJSONRenderer で直接JSONにシリアライズする。
+    
+    同一入力または同一 Idempotency-Key ヘッダーのリクエストは1回の実行にまとめ、
+    完了した結果はしばらく保持して再試行にも同じ結果を返す（X-Coalesced: MISS / SHARED / HIT）。
+    
+    パイプラインの同時実行数は plan プールのアドミッション制御で制限し、
+    待ち時間の上限までに開始できないリクエストは 429（Retry-After付き）で断る。
     """
+    renderer_classes = [PydanticJSONRenderer]
     
     def post(self, request):
-        # 入力データのバリデーション
-        serializer = TrainingRequestSerializer(data=request.data)
-        if not serializer.is_valid():
-            print(f"[API] Validation errors: {serializer.errors}")
+        # 入力データのバリデーション（JSONボディはパース済みの辞書を経由せず直接検証する）
+        try:
+            if request.content_type.startswith("application/json"):
+                training_request = TrainingRequest.model_validate_json(request.body)
+            else:
+                training_request = TrainingRequest.model_validate(request.data)
+        except ValidationError as e:
+            details = error_details(e)
+            logger.info("Validation errors", extra={"details": details})
             return Response(
-                {"error": "Invalid input data", "details": serializer.errors},
+                {"error": "Invalid input data", "details": details},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        input_data = serializer.validated_data
+        input_data = training_request.model_dump()
+        idempotency_key = request.headers.get("Idempotency-Key", "").strip()
+        if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return Response(
+                {"error": f"Idempotency-Key は{IDEMPOTENCY_KEY_MAX_LENGTH}文字以内で指定してください"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        input_hash = canonical_hash(input_data)
+        coalesce_key = f"key:{idempotency_key}" if idempotency_key else f"input:{input_hash}"
         
         try:
-            # AIコアを呼び出してプランを生成
-            result = self._generate_plan(input_data)
-            
-            # レスポンスのシリアライズ
-            response_serializer = TrainingResponseSerializer(data=result)
-            if response_serializer.is_valid():
-                return Response(response_serializer.data, status=status.HTTP_200_OK)
-            else:
-                # 内部エラー（コアからの出力が期待形式でない）
-                return Response(
-                    {"error": "Internal processing error", "details": response_serializer.errors},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            # AIコアを呼び出してプランを生成（グラフ内の全LLM呼び出しに締め切りを適用）
+            with deadline(PLAN_REQUEST_DEADLINE):
+                outcome, coalesced = coalesce(
+                    coalesce_key,
+                    input_hash,
+                    lambda: self._generate_response(input_data, idempotency_key or None),
+                    stale_after=PLAN_REQUEST_STALE_AFTER,
+                    # 完了した結果の再利用は Idempotency-Key を指定した再試行のみ（同じ入力での再生成は新しく実行する）
+                    retain=bool(idempotency_key),
                 )
-                
+        except ValidationError as e:
+            # 内部エラー（コアからの出力が期待形式でない）
+            return Response(
+                {"error": "Internal processing error", "details": error_details(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        except IdempotencyConflict as e:
+            return Response({"error": str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except (DeadlineExceeded, CircuitOpenError, AdmissionRejected) as e:
+            logger.warning("Upstream unavailable: %s", e, extra={"error_class": type(e).__name__})
+            return upstream_error_response(e)
         except Exception as e:
             import traceback
             return Response(
                 {"error": str(e), "traceback": traceback.format_exc()},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        
+        logger.info("Coalesced: %s", coalesced, extra={"coalesced": coalesced})
+        response = Response(RawJSON(outcome["body"]), status=status.HTTP_200_OK)
+        response["X-Coalesced"] = coalesced
+        response["X-Analysis-Cache"] = outcome["analysis_cache"]
+        if outcome["plan_id"] is not None:
+            response["X-Plan-Id"] = str(outcome["plan_id"])
+        return response
     
-    def _generate_plan(self, input_data: dict) -> dict:
+    def _generate_response(self, input_data: dict, resume_key: str = None) -> dict:
+        """
+        プランを生成して履歴に保存し、まとめた他のリクエストとも共有するレスポンスを返す。
+        
+        Returns:
+            {"body": レスポンスのJSON, "plan_id": 履歴ID, "analysis_cache": 分析レポートの取得元}
+        """
+        # まとめられた後続のリクエストは実行枠を使わない
+        with get_admission_controller("plan").slot():
+            result, analysis_cache = self._generate_with_cached_analysis(input_data, resume_key=resume_key)
+        timings = result.pop("timings", {})
+        
+        # レスポンスの検証（期待形式でない出力は保持・保存しない）。履歴にも既定値を補った内容を保存する
+        response = TrainingResponse.model_validate(result)
+        body = response.model_dump_json()
+        plan_id = self._save_history(input_data, response.model_dump(mode="json"), timings)
+        return {"body": body, "plan_id": plan_id, "analysis_cache": analysis_cache}
+    
+    def _generate_with_cached_analysis(self, input_data: dict, resume_key: str = None):
+        """
+        分析レポートを再利用できる場合はPlannerのみを実行してプランを生成する。
+        
+        リクエストで analysis_report が指定されていればそれを使い、
+        そうでなければ分析に使う入力フィールドのハッシュでキャッシュを引く。
+        input_data から analysis_report / reuse_analysis を取り除く。
+        
+        Returns:
+            (_generate_plan の結果, 分析レポートの取得元 "SUPPLIED" / "HIT" / "MISS")
+        """
+        from core.orchestrator.graph import analysis_input_hash
+        
+        supplied_report = input_data.pop("analysis_report", None)
+        reuse_analysis = input_data.pop("reuse_analysis", True)
+        cache_key = analysis_input_hash(input_data)
+        
+        # キャッシュは1回だけ引く（2回引くと、間で期限切れになった場合に HIT で None を返してしまう）
+        cached_report = None if supplied_report or not reuse_analysis else _analysis_cache.get(cache_key)
+        if supplied_report:
+            analysis_report, source = supplied_report, "SUPPLIED"
+        elif cached_report:
+            analysis_report, source = cached_report, "HIT"
+        else:
+            analysis_report, source = None, "MISS"
+        
+        logger.info("Analysis report: %s", source, extra={"analysis_cache": source})
+        result = self._generate_plan(input_data, analysis_report, resume_key=resume_key)
+        if source == "MISS":
+            _analysis_cache.set(cache_key, result["analysis_report"])
+        return result, source
+    
+    def _generate_plan(self, input_data: dict, analysis_report: dict = None, resume_key: str = None) -> dict:
         """
         AIコアを呼び出してトレーニングプランを生成
         
+        パイプラインは入力のハッシュ（Idempotency-Key の指定時はキーと入力のハッシュ）をスレッドIDとして
+        SQLiteにチェックポイントされる。ノードが失敗した場合は PIPELINE_MAX_RETRIES 回まで失敗したノードから
+        自動で再開し、同じ入力の再送信（画面からの再実行を含む）も最後に完了したノードの次から再開する。
+        キーを指定しない場合、完了済みのスレッドは再利用せず新しく生成する。
+        
         Args:
             input_data: バリデーション済みの入力データ
+            analysis_report: 既存の分析レポート（指定時はAnalyzerを実行しない）
+            resume_key: Idempotency-Key（省略時は入力のみでスレッドを決める）
             
         Returns:
             分析レポートとトレーニングプランを含む辞書
         """
-        import uuid
-        from langchain_core.messages import HumanMessage
-        
         # backend/core からインポート（src -> core にリネーム済み）
-        from core.orchestrator.graph import build_orchestrator, create_initial_state
-        
-        print("[API] Building orchestrator...")
-        app = build_orchestrator()
-        initial_state = create_initial_state(input_data)
-        config = {"configurable": {"thread_id": str(uuid.uuid4())}}
-        
-        print("[API] Running pipeline...")
-        final_state = None
-        analysis_report = {}
-        training_plan = {}
-        
-        for event in app.stream(initial_state, config=config, stream_mode="updates"):
-            for node_name, node_output in event.items():
-                print(f"[API] Node: {node_name}")
-                
-                if "analysis_report" in node_output and node_output["analysis_report"]:
-                    analysis_report = node_output["analysis_report"]
-                
-                if "training_plan" in node_output and node_output["training_plan"]:
-                    training_plan = node_output["training_plan"]
-            
-            final_state = event
+        from core.orchestrator.graph import get_orchestrator, create_initial_state
+        from core.common.checkpoint import get_checkpointer, touch_thread, delete_thread, maybe_gc_checkpoints
+        from core.common.context_cache import get_context_mode
+        
+        skip_analyzer = bool(analysis_report)
+        context_mode = get_context_mode()
+        checkpointer = get_checkpointer()
+        maybe_gc_checkpoints(checkpointer)
+        
+        app = get_orchestrator(skip_analyzer=skip_analyzer, checkpointer=checkpointer, context_mode=context_mode)
+        # グラフ構成と入力ごとにスレッドを分け、異なる構成・入力のチェックポイントから再開しないようにする
+        # （Idempotency-Key を別の入力に使い回した場合も、以前の結果や途中状態を返さない）。
+        # 同じ入力の同時実行は coalesce で1つにまとめられるため、同じスレッドを並行して進めることはない
+        input_hash = canonical_hash([input_data, analysis_report])[:16]
+        scope = f"key-{canonical_hash(resume_key)[:16]}" if resume_key else "input"
+        thread_id = f"{scope}:{input_hash}:{'planner' if skip_analyzer else 'full'}"
+        if context_mode != "rag":
+            thread_id += f":{context_mode}"
+        config = {"configurable": {"thread_id": thread_id}}
+        
+        snapshot = app.get_state(config)
+        if snapshot.values.get("training_plan") and not resume_key:
+            # キーなしの同じ入力は新しいプランの生成（完了済みのスレッドは破棄して最初から実行する）
+            delete_thread(checkpointer, thread_id)
+            snapshot = app.get_state(config)
+        touch_thread(checkpointer, thread_id)
+        
+        if snapshot.next:
+            logger.info("Resuming pipeline from checkpoint", extra={"next_nodes": list(snapshot.next)})
+            stream_input = None
+        elif snapshot.values.get("training_plan"):
+            logger.info("Pipeline already completed for this request")
+            stream_input = None
+        else:
+            stream_input = create_initial_state(input_data, analysis_report)
         
-        # 結果を取得
+        logger.info("Running pipeline", extra={"thread_id": thread_id})
+        timings = {}
+        max_retries = int(os.getenv("PIPELINE_MAX_RETRIES", "1"))
+        
+        for attempt in range(max_retries + 1):
+            node_started = time.perf_counter()
+            try:
+                for event in app.stream(stream_input, config=config, stream_mode="updates"):
+                    for node_name in event:
+                        now = time.perf_counter()
+                        timings[node_name] = round(now - node_started, 3)
+                        logger.info("Node completed: %s", node_name, extra={"node": node_name, "duration": timings[node_name]})
+                        node_started = now
+                break
+            except Exception as e:
+                # 締め切り超過・サーキットオープン時は再開しても失敗するため即座に返す
+                if attempt == max_retries or isinstance(e, (DeadlineExceeded, CircuitOpenError)):
+                    raise
+                next_nodes = app.get_state(config).next
+                logger.warning("Pipeline failed (%s); resuming from checkpoint", e, extra={"next_nodes": list(next_nodes)})
+                # 初回のノードより前で失敗した場合はチェックポイントが無いため初期状態から実行する
+                if next_nodes:
+                    stream_input = None
+        
+        # 結果を取得（再開時はストリームに含まれない完了済みノードの出力もチェックポイントから取得する）
+        values = app.get_state(config).values
+        analysis_report = values.get("analysis_report")
+        training_plan = values.get("training_plan")
         
         if not analysis_report:
             raise ValueError("Analysis report was not generated")
@@ -131,8 +349,172 @@ class GenerateTrainingPlanView(APIView):
         
         return {
             "analysis_report": analysis_report,
-            "training_plan": training_plan
+            "training_plan": training_plan,
+            "timings": timings
         }
+    
+    def _save_history(self, input_data: dict, result: dict, timings: dict):
+        """
+        生成結果を履歴として保存し、保存したレコードのIDを返す。
+        保存に失敗しても生成結果のレスポンスは返すため、例外はログに留める。
+        """
+        from core.common.llm import get_route
+        from core.orchestrator.graph import PROMPT_VERSION
+        
+        try:
+            plan = GeneratedPlan.objects.create(
+                member_id=input_data.get("member_id", ""),
+                input_hash=plan_input_hash(input_data),
+                input_data=input_data,
+                analysis_report=result["analysis_report"],
+                training_plan=result["training_plan"],
+                model_name=get_route("planner.final")["model"],
+                prompt_version=PROMPT_VERSION,
+                timings=timings,
+            )
+        except Exception as e:
+            logger.exception("Failed to save plan history")
+            return None
+        
+        logger.info("Saved plan history #%s", plan.pk, extra={"plan_id": plan.pk})
+        return plan.pk
+
+
+def plan_input_hash(input_data: dict) -> str:
+    """会員IDを除いた入力データの正規化ハッシュ（同一入力の履歴検索に使用）"""
+    from core.common.hashing import canonical_hash
+    
+    return canonical_hash({key: value for key, value in input_data.items() if key != "member_id"})
+
+
+def visible_plans(user):
+    """
+    ユーザーが参照できる生成履歴（健康情報を含むため、本人の会員IDの履歴のみ）。
+    会員IDはログインユーザーのユーザー名と対応させ、管理者は全会員の履歴を参照できる。
+    """
+    if user.is_staff:
+        return GeneratedPlan.objects.all()
+    return GeneratedPlan.objects.filter(member_id=user.get_username())
+
+
+class PlanHistoryPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class PlanHistoryListView(ListAPIView):
+    """
+    生成履歴の一覧API
+    
+    ログインが必要で、会員は自分の履歴のみ、管理者は全会員の履歴（?member_id= で絞り込み）を
+    新しい順にページングして返す。一覧では入力・プラン本体の大きなJSON列を読み込まない。
+    """
+    serializer_class = GeneratedPlanSummarySerializer
+    pagination_class = PlanHistoryPagination
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = visible_plans(self.request.user).defer("input_data", "analysis_report", "training_plan")
+        member_id = self.request.query_params.get("member_id")
+        if member_id is not None:
+            queryset = queryset.filter(member_id=member_id)
+        return queryset
+
+
+class PlanRegenerateView(APIView):
+    """
+    保存済みプランの部分再生成API
+    
+    POST /api/plans/<id>/regenerate/
+    指定した1日分（day_index）または1種目（day_index + exercise_index）だけを
+    変更要望に沿って再生成し、差し込んだプランを新しい履歴として保存して返す。
+    履歴の詳細と同じく、ログインした本人（または管理者）の履歴のみ対象にできる。
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, pk):
+        from core.common.llm import get_route
+        from core.orchestrator.graph import PROMPT_VERSION
+        from core.planner.edit import regenerate_plan_part, PlanTargetOutOfRange
+        
+        serializer = PlanRegenerateRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"error": "Invalid input data", "details": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        base = get_object_or_404(visible_plans(request.user), pk=pk)
+        params = serializer.validated_data
+        
+        started = time.perf_counter()
+        try:
+            with deadline(PLAN_REQUEST_DEADLINE):
+                training_plan = regenerate_plan_part(
+                    base.input_data,
+                    base.analysis_report,
+                    base.training_plan,
+                    params["day_index"],
+                    params["exercise_index"],
+                    params["change_request"],
+                )
+        except PlanTargetOutOfRange as e:
+            # クライアントの指定誤りのみ 400（構造化出力の検証エラー等のモデル側の失敗は 500）
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except (DeadlineExceeded, CircuitOpenError) as e:
+            logger.warning("Upstream unavailable: %s", e, extra={"error_class": type(e).__name__})
+            return upstream_error_response(e)
+        except Exception as e:
+            logger.warning("Plan regeneration error: %s", e)
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        elapsed = round(time.perf_counter() - started, 3)
+        
+        plan = GeneratedPlan.objects.create(
+            member_id=base.member_id,
+            input_hash=base.input_hash,
+            input_data=base.input_data,
+            analysis_report=base.analysis_report,
+            training_plan=training_plan,
+            model_name=get_route("planner.edit")["model"],
+            prompt_version=PROMPT_VERSION,
+            timings={"regenerate": elapsed},
+            parent=base,
+        )
+        logger.info("Regenerated plan #%s -> #%s", base.pk, plan.pk, extra={"plan_id": plan.pk, "duration": elapsed})
+        
+        response = Response(GeneratedPlanDetailSerializer(plan).data, status=status.HTTP_201_CREATED)
+        response["X-Plan-Id"] = str(plan.pk)
+        return response
+
+
+def _plan_etag(request, pk):
+    # 履歴は作成後に更新されないため、IDとプロンプトバージョンで一意に識別できる
+    plan = visible_plans(request.user).filter(pk=pk).only("prompt_version").first()
+    return f"plan-{plan.pk}-{plan.prompt_version}" if plan else None
+
+
+def _plan_last_modified(request, pk):
+    plan = visible_plans(request.user).filter(pk=pk).only("created_at").first()
+    return plan.created_at if plan else None
+
+
+class PlanHistoryDetailView(APIView):
+    """
+    生成履歴の詳細API
+    
+    ETag / Last-Modified による条件付きGETに対応し、
+    クライアントがキャッシュ済みの場合は304を返す。
+    ログインが必要で、他の会員の履歴は存在しない場合と同じく404を返す。
+    """
+    permission_classes = [IsAuthenticated]
+    
+    @method_decorator(condition(etag_func=_plan_etag, last_modified_func=_plan_last_modified))
+    def get(self, request, pk):
+        plan = get_object_or_404(visible_plans(request.user), pk=pk)
+        response = Response(GeneratedPlanDetailSerializer(plan).data)
+        response["Cache-Control"] = "private, no-cache"
+        return response
 
 
 @api_view(['GET'])
@@ -142,9 +524,119 @@ def health_check(request):
     
     GET /api/health/
     
-    サーバーが正常に動作しているかを確認
+    サーバーが正常に動作しているかを確認し、アドミッション制御の実行中・待機中の件数と待ち時間を返す
+    """
+    return Response({
+        "status": "healthy",
+        "message": "Project Trainer API is running",
+        "admission": get_admission_status(),
+    })
+
+
+@api_view(['GET'])
+def readiness_check(request):
+    """
+    レディネスチェックエンドポイント
+    
+    GET /api/ready/
+    
+    ウォームアップ（モジュール読み込み・索引構築・グラフのコンパイル）が完了していれば200、
+    未完了・失敗なら503を返す。未開始または失敗した場合はこの呼び出しでウォームアップを（再）開始する。
+    アドミッション制御の待ち行列が満杯のプールがある場合も503（status: saturated）を返し、
+    ロードバランサーが他のワーカーに振り分けられるようにする。
+    /api/health/ はプロセスの生存確認のみで、ウォームアップの完了を待たない。
+    """
+    from core.common.warmup import get_warmup_status, start_warmup
+    
+    warmup_status = get_warmup_status()
+    if warmup_status["state"] == "pending":
+        start_warmup()
+        warmup_status = get_warmup_status()
+    elif warmup_status["state"] == "failed":
+        # 失敗したステップの内容を返しつつ、バックグラウンドで再試行する
+        start_warmup()
+    
+    admission = get_admission_status()
+    saturated = [name for name in admission if get_admission_controller(name).saturated]
+    
+    if warmup_status["state"] == "failed":
+        state = "warmup_failed"
+    elif warmup_status["state"] != "ready":
+        state = "warming_up"
+    elif saturated:
+        state = "saturated"
+    else:
+        state = "ready"
+    return Response(
+        {"status": state, **warmup_status, "admission": admission, "saturated": saturated},
+        status=status.HTTP_200_OK if state == "ready" else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+@api_view(['GET'])
+def llm_metrics(request):
+    """
+    LLM呼び出しの集計エンドポイント
+    
+    GET /api/metrics/
+    
+    処理段階・モデルごとの呼び出し回数、エスカレーション回数、p50/p95レイテンシ、
+    トークン数、推定コスト（USD）と、現在のルーティング設定、アドミッション制御の状態、
+    ツール呼び出しループが予算の上限で打ち切られた回数を返す
+    """
+    from core.common.llm import DEFAULT_ROUTES, get_route
+    from core.common.metrics import get_llm_metrics, get_loop_budget_metrics, summarize
+    
+    rows = get_llm_metrics().snapshot()
+    return Response({
+        "routes": {stage: get_route(stage) for stage in DEFAULT_ROUTES},
+        "stages": rows,
+        "total": summarize(rows),
+        "admission": get_admission_status(),
+        "loop_budget": get_loop_budget_metrics().snapshot(),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_list(request):
     """
-    return Response({"status": "healthy", "message": "Project Trainer API is running"})
+    リクエストのプロファイル一覧エンドポイント（管理者のみ）
+    
+    GET /api/admin/profiles/?limit=50
+    
+    ProfilingMiddleware が保存した遅いリクエスト・サンプリングしたリクエストのプロファイルを
+    新しい順に返す。各プロファイルは url から折りたたみ形式（flamegraph.pl / speedscope）で取得できる
+    """
+    from core.common.profiling import get_profile_store
+    
+    try:
+        limit = max(1, min(int(request.query_params.get("limit", 50)), 500))
+    except ValueError:
+        return Response({"error": "limit は整数で指定してください"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    profiles = get_profile_store().recent(limit)
+    for entry in profiles:
+        entry["url"] = request.build_absolute_uri(f"/api/admin/profiles/{entry['id']}/")
+    return Response({"profiles": profiles})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_detail(request, profile_id):
+    """
+    プロファイルのダウンロードエンドポイント（管理者のみ）
+    
+    GET /api/admin/profiles/<id>/
+    
+    折りたたみ形式のスタック（1行1スタック、"フレーム;フレーム;... サンプル数"）を返す
+    """
+    from core.common.profiling import get_profile_store
+    
+    path = get_profile_store().folded_path(profile_id)
+    if path is None:
+        raise Http404("プロファイルが見つかりません")
+    return FileResponse(path.open("rb"), as_attachment=True, filename=path.name, content_type="text/plain; charset=utf-8")
 
 
 @api_view(['GET'])
@@ -162,7 +654,14 @@ def api_info(request):
         "endpoints": {
             "POST /api/generate/": "トレーニングプラン生成",
             "POST /api/extract-inbody/": "InBody画像からデータ抽出",
+            "POST /api/extract-inbody/bulk/": "複数画像・PDFからデータを一括抽出（NDJSONストリーミング）",
+            "GET /api/plans/": "生成履歴の一覧（要ログイン。管理者は ?member_id= で絞り込み）",
+            "GET /api/plans/<id>/": "生成履歴の詳細（要ログイン。ETagによる条件付きGETに対応）",
+            "POST /api/plans/<id>/regenerate/": "保存済みプランの1日分・1種目のみを再生成",
+            "GET /api/metrics/": "LLM呼び出しの段階・モデル別レイテンシ・トークン数・推定コスト",
             "GET /api/health/": "ヘルスチェック",
+            "GET /api/ready/": "レディネスチェック（ウォームアップ完了で200）",
+            "GET /api/admin/profiles/": "遅いリクエストのプロファイル一覧（管理者のみ）",
             "GET /api/": "API情報"
         }
     })
@@ -176,9 +675,16 @@ class ExtractInBodyDataView(APIView):
     
     InBody結果画像をアップロードすると、
     Gemini Vision APIで解析し、数値データを抽出して返す。
+    同一画像の再アップロードはキャッシュから返し、同時アップロードは1回の抽出にまとめる。
+    キャッシュ状態は X-Cache ヘッダー（HIT / SHARED / MISS）で返す。
+    Vision APIの呼び出しは inbody プールのアドミッション制御の下で行い、混雑時は 429 を返す。
     """
+    # 抽出の同時実行数を制限するアドミッション制御のプール（None の場合は制限しない）
+    admission_pool = "inbody"
     
     def post(self, request):
+        from core.extractor.preprocess import InvalidImageError
+        
         # 画像ファイルの取得
         if 'image' not in request.FILES:
             return Response(
@@ -189,22 +695,27 @@ class ExtractInBodyDataView(APIView):
         image_file = request.FILES['image']
         
         # ファイルタイプの確認
-        allowed_types = ['image/jpeg', 'image/png', 'image/webp', 'image/heic']
-        if image_file.content_type not in allowed_types:
+        if image_file.content_type not in ALLOWED_IMAGE_TYPES:
             return Response(
-                {"error": f"サポートされていないファイル形式です。対応形式: {', '.join(allowed_types)}"},
+                {"error": f"サポートされていないファイル形式です。対応形式: {', '.join(ALLOWED_IMAGE_TYPES)}"},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         try:
-            # 画像データを読み込み
-            image_data = image_file.read()
-            
-            # Gemini Vision APIで解析
-            result = self._extract_data_from_image(image_data, image_file.content_type)
+            # Gemini Vision APIで解析（キャッシュ・同時実行の集約付き）
+            with deadline(INBODY_REQUEST_DEADLINE):
+                result, cache_status = self._extract_cached(image_file, image_file.content_type)
             
-            return Response(result, status=status.HTTP_200_OK)
+            response = Response(result, status=status.HTTP_200_OK)
+            response["X-Cache"] = cache_status
+            return response
             
+        except InvalidImageError as e:
+            # 壊れた画像・画素数が多すぎる画像はファイル形式の誤りと同じく 400
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except (DeadlineExceeded, CircuitOpenError, AdmissionRejected) as e:
+            logger.warning("Upstream unavailable: %s", e, extra={"error_class": type(e).__name__})
+            return upstream_error_response(e)
         except Exception as e:
             import traceback
             return Response(
@@ -212,74 +723,233 @@ class ExtractInBodyDataView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    def _extract_cached(self, source, content_type: str) -> tuple:
+        """
+        画像内容のSHA-256をキーに、キャッシュ済みの結果または新規抽出の結果を返す
+        
+        Returns:
+            (抽出結果, キャッシュ状態 "HIT" / "SHARED" / "MISS")
+        """
+        # チャンク単位で読み、全体をメモリに載せずにハッシュを計算する
+        hasher = hashlib.sha256()
+        source.seek(0)
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            hasher.update(chunk)
+        image_hash = hasher.hexdigest()
+        
+        result, cache_status = cached_call(
+            _extraction_cache,
+            _extraction_flight,
+            image_hash,
+            lambda: self._extract_admitted(source, content_type),
+        )
+        logger.info("InBody extraction cache: %s", cache_status, extra={"cache": cache_status, "image_hash": image_hash[:12]})
+        return result, cache_status
+    
+    def _extract_admitted(self, source, content_type: str) -> dict:
+        """キャッシュに無い画像のみ、実行枠を確保してから抽出する"""
+        if self.admission_pool is None:
+            return self._preprocess_and_extract(source, content_type)
+        with get_admission_controller(self.admission_pool).slot():
+            return self._preprocess_and_extract(source, content_type)
+    
+    def _preprocess_and_extract(self, source, content_type: str) -> dict:
+        """画像を縮小・正規化してからVision APIに渡す"""
+        from api.capture import note_preprocessed_image
+        from core.extractor.preprocess import preprocess_image
+
+        start = time.perf_counter()
+        prepared = preprocess_image(source, content_type)
+        note_preprocessed_image(prepared.width, prepared.height)
+        logger.info(
+            "Preprocessed image: %d -> %d bytes", prepared.original_bytes, len(prepared.data),
+            extra={
+                "mime_type": prepared.mime_type,
+                "size": f"{prepared.width}x{prepared.height}",
+                "duration": round(time.perf_counter() - start, 3),
+            },
+        )
+        return self._extract_data_from_image(prepared.data, prepared.mime_type)
+
     def _extract_data_from_image(self, image_data: bytes, content_type: str) -> dict:
         """
         Gemini Vision APIを使ってInBody画像からデータを抽出
         """
-        from typing import Optional, Literal
-        from pydantic import BaseModel, Field
-        from google import genai
-        from google.genai import types
-        from langchain_google_genai import ChatGoogleGenerativeAI
-
-        class SegmentalLean(BaseModel):
-            right_arm: Optional[float] = Field(None, description="右腕の骨格筋量(kg)")
-            left_arm: Optional[float] = Field(None, description="左腕の骨格筋量(kg)")
-            trunk: Optional[float] = Field(None, description="体幹の骨格筋量(kg)")
-            right_leg: Optional[float] = Field(None, description="右脚の骨格筋量(kg)")
-            left_leg: Optional[float] = Field(None, description="左脚の骨格筋量(kg)")
-
-        class InBodyData(BaseModel):
-            weight_kg: Optional[float] = None
-            muscle_mass_kg: Optional[float] = None
-            skeletal_muscle_mass_kg: Optional[float] = None
-            body_fat_percent: Optional[float] = None
-            segmental_lean: Optional[SegmentalLean] = None
-            confidence: Literal["high", "medium", "low"] = "low"
-            notes: Optional[str] = None
-
-        initialize_environment()
-
-        # Step 1: Agentic Vision（Google GenAI SDK）で画像を解析
-        client = genai.Client()
-        image_part = types.Part.from_bytes(data=image_data, mime_type=content_type)
-
-        prompt = """この画像はInBody（体成分分析装置）の測定結果シートです。
-必要に応じて画像をズーム・クロップして、以下の数値データを正確に読み取ってください。
-
-- 体重 (weight_kg) - kg単位
-- 筋肉量 (muscle_mass_kg) - kg単位
-- 骨格筋量 (skeletal_muscle_mass_kg) - kg単位
-- 体脂肪率 (body_fat_percent) - %単位
-- 部位別骨格筋量: 左腕、右腕、体幹、左脚、右脚（各kg）
-
-読み取った数値をすべて報告してください。"""
-
-        print("[API] Calling Gemini Agentic Vision for InBody data extraction...")
-        vision_response = client.models.generate_content(
-            model="gemini-3-flash-preview",
-            contents=[image_part, prompt],
-            config=types.GenerateContentConfig(
-                tools=[types.Tool(code_execution=types.ToolCodeExecution)],
-            ),
-        )
+        from core.extractor.inbody import extract_inbody_data
+
+        return extract_inbody_data(image_data, content_type)
 
-        # レスポンスからテキスト部分を抽出
-        vision_text = ""
-        for part in vision_response.candidates[0].content.parts:
-            if part.text:
-                vision_text += part.text + "\n"
 
-        print(f"[API] Agentic Vision result: {vision_text[:500]}...")
 
-        # Step 2: structured outputで型付きデータに変換
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-3-flash-preview",
-            temperature=0,
+class BulkExtractInBodyDataView(ExtractInBodyDataView):
+    """
+    複数のInBody画像・複数ページPDFから一括でデータを抽出するAPIエンドポイント
+    
+    POST /api/extract-inbody/bulk/
+    
+    multipart で images（複数可）または pdf（ページごとに分割）を受け取り、
+    プロセス全体のレート制限の下で並列に抽出して、完了した順に NDJSON（1行1件）で返す。
+    画像とPDFページは合わせて INBODY_BULK_MAX_ITEMS 件まで処理する。
+    generate_plan=true と profile（user_profile / goal / preferences のJSON文字列）を指定すると、
+    各抽出結果を inbody_metrics としてトレーニングプラン生成まで続けて実行する（plan プールのアドミッション制御の下で、
+    抽出とは別のスレッドプールで実行する。プラン生成の失敗は抽出結果の status ではなく plan に返す）。
+    """
+    # 一括処理は専用のレート制限と並列数で制御するため、アドミッション制御の対象外とする
+    admission_pool = None
+    
+    def post(self, request):
+        images = request.FILES.getlist('images')
+        pdf = request.FILES.get('pdf')
+        if not images and pdf is None:
+            return Response(
+                {"error": "images または pdf ファイルが必要です"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        unsupported = [f.name for f in images if f.content_type not in ALLOWED_IMAGE_TYPES]
+        if pdf is not None and pdf.content_type != 'application/pdf':
+            unsupported.append(pdf.name)
+        if unsupported:
+            return Response(
+                {"error": f"サポートされていないファイル形式です: {', '.join(unsupported)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(images) > INBODY_BULK_MAX_ITEMS:
+            return Response(
+                {"error": f"一度に処理できる画像は{INBODY_BULK_MAX_ITEMS}件までです"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        profile = None
+        if str(request.data.get('generate_plan', '')).lower() in ('1', 'true', 'yes'):
+            try:
+                profile = json.loads(request.data.get('profile') or '{}')
+            except json.JSONDecodeError:
+                return Response(
+                    {"error": "profile はJSON形式で指定してください"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        # ストリームはビューを抜けた後に読み出されるため、リクエストIDをここで受け取っておく
+        response = StreamingHttpResponse(
+            self._stream_results(images, pdf, profile, get_request_id()),
+            content_type="application/x-ndjson",
         )
-        structured_llm = llm.with_structured_output(InBodyData)
-        result = structured_llm.invoke(
-            f"以下のInBody解析結果から数値を抽出してください:\n\n{vision_text}"
+        # Nginxのバッファリングを無効化し、1件ずつクライアントに届ける
+        response["X-Accel-Buffering"] = "no"
+        return response
+    
+    def _iter_sources(self, images, pdf):
+        """(ラベル, ファイルオブジェクト, MIMEタイプ) を1件ずつ返す。PDFはページ単位で描画する"""
+        for image_file in images:
+            yield image_file.name, image_file, image_file.content_type
+        
+        if pdf is not None:
+            from core.extractor.pdf import split_pdf_pages
+            for page_number, page_data in split_pdf_pages(pdf):
+                if len(images) + page_number > INBODY_BULK_MAX_ITEMS:
+                    raise ValueError(f"{INBODY_BULK_MAX_ITEMS}件を超えるページは処理しません")
+                yield f"{pdf.name}#page={page_number}", io.BytesIO(page_data), "image/jpeg"
+    
+    def _stream_results(self, images, pdf, profile, request_id=None):
+        """
+        入力を INBODY_BULK_WINDOW 件ずつ読み込みながら抽出し、完了した順に1行ずつ返す。
+        PDFのページは空きができた時点で描画するため、描画済みのページが同時にメモリにある数も window 件までになる。
+        """
+        sources = self._iter_sources(images, pdf)
+        exhausted = False
+        extracting, planning = set(), set()
+        total = succeeded = 0
+        
+        while True:
+            while not exhausted and len(extracting) < INBODY_BULK_WINDOW:
+                try:
+                    label, source, content_type = next(sources)
+                except StopIteration:
+                    exhausted = True
+                    break
+                except Exception as e:
+                    exhausted = True
+                    yield self._ndjson({"status": "error", "error": f"入力の読み込みに失敗しました: {e}"})
+                    break
+                extracting.add(_bulk_executor.submit(
+                    self._process_item, total, label, source, content_type, request_id
+                ))
+                total += 1
+            
+            if not extracting and not planning:
+                break
+            done, _ = wait(extracting | planning, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = future.result()
+                if future in extracting:
+                    extracting.discard(future)
+                    if profile is not None and item["status"] == "ok":
+                        planning.add(_bulk_plan_executor.submit(self._attach_plan, item, profile, request_id))
+                        continue
+                else:
+                    planning.discard(future)
+                succeeded += item["status"] == "ok"
+                yield self._ndjson(item)
+        
+        yield self._ndjson({"summary": {"total": total, "succeeded": succeeded, "failed": total - succeeded}})
+    
+    def _process_item(self, index: int, label: str, source, content_type: str, request_id=None) -> dict:
+        item = {"index": index, "source": label}
+        try:
+            # 一括処理ではリクエスト全体ではなく、1件ごとに締め切りを設定する
+            # 1件ごとのログを区別できるよう、リクエストIDに番号を付ける
+            with bind_request_id(f"{request_id}:{index}" if request_id else None):
+                with deadline(INBODY_REQUEST_DEADLINE):
+                    data, cache_status = self._extract_cached(source, content_type)
+            item.update(status="ok", cache=cache_status, data=data)
+        except Exception as e:
+            item.update(status="error", error=str(e))
+        return item
+    
+    def _attach_plan(self, item: dict, profile: dict, request_id=None) -> dict:
+        """抽出に成功した項目にプラン生成の結果を追加する（失敗は plan に記録し、抽出の status は変えない）"""
+        with bind_request_id(f"{request_id}:{item['index']}" if request_id else None):
+            try:
+                with deadline(PLAN_REQUEST_DEADLINE):
+                    item["plan"] = self._generate_plan_for(item["data"], profile)
+            except Exception as e:
+                item["plan"] = {"status": "error", "error": str(e)}
+        return item
+    
+    def _preprocess_and_extract(self, source, content_type: str) -> dict:
+        # キャッシュヒット時はレート制限の対象外とし、実際にVision APIを呼ぶ場合のみトークンを消費する
+        waited = _bulk_rate_limiter.acquire()
+        if waited:
+            logger.info("Bulk extraction rate limited: waited %.2fs", waited)
+        return super()._preprocess_and_extract(source, content_type)
+    
+    def _generate_plan_for(self, extracted: dict, profile: dict) -> dict:
+        """抽出結果を inbody_metrics としてプロフィールに合成し、トレーニングプランを生成する"""
+        metrics = {key: value for key, value in extracted.items() if key not in ("confidence", "notes")}
+        try:
+            training_request = TrainingRequest.model_validate({**profile, "inbody_metrics": metrics})
+        except ValidationError as e:
+            return {"status": "invalid", "details": error_details(e)}
+        
+        input_data = training_request.model_dump()
+        input_hash = canonical_hash(input_data)
+        # /api/generate/ のキーなしのリクエストと同じく入力ごとにまとめ、同じ実行枠・検証・履歴保存を使う
+        # （同じ入力の項目は1回の生成とチェックポイントのスレッドを共有する）
+        outcome, _ = coalesce(
+            f"input:{input_hash}",
+            input_hash,
+            lambda: GenerateTrainingPlanView()._generate_response(input_data),
+            stale_after=PLAN_REQUEST_STALE_AFTER,
+            retain=False,
         )
-
-        return result.model_dump()
+        return {
+            "status": "ok",
+            "plan_id": outcome["plan_id"],
+            "analysis_cache": outcome["analysis_cache"],
+            **json.loads(outcome["body"]),
+        }
+    
+    @staticmethod
+    def _ndjson(item: dict) -> bytes:
+        return (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -46,6 +48,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # Must be at the top
+    # リクエストIDの付与とアクセスログ（以降のログにリクエストIDが付く）
+    'api.middleware.RequestIdMiddleware',
+    # PROFILE_SAMPLE_RATE / PROFILE_SLOW_THRESHOLD_SECONDS を設定した場合のみ有効（サンプリングプロファイラー）
+    'api.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +59,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # REQUEST_CAPTURE_FILE を設定した場合のみ有効（負荷試験用のリクエスト収集）
+    'api.capture.RequestCaptureMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -78,12 +86,34 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# 既定はSQLite。WALモードにより、履歴の書き込み中も読み取りをブロックしない。
+# DATABASE_ENGINE 等の環境変数で別のデータベース（PostgreSQL等）に切り替えられる。
+DATABASE_ENGINE = os.getenv('DATABASE_ENGINE', 'django.db.backends.sqlite3')
+
+if DATABASE_ENGINE == 'django.db.backends.sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': DATABASE_ENGINE,
+            'NAME': os.getenv('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+                # 書き込みロックをトランザクション開始時に取得し、並行書き込み時のデッドロックを防ぐ
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DATABASE_ENGINE,
+            'NAME': os.getenv('DATABASE_NAME', ''),
+            'USER': os.getenv('DATABASE_USER', ''),
+            'PASSWORD': os.getenv('DATABASE_PASSWORD', ''),
+            'HOST': os.getenv('DATABASE_HOST', ''),
+            'PORT': os.getenv('DATABASE_PORT', ''),
+        }
     }
-}
 
 
 # Password validation
@@ -122,6 +152,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# File uploads
+# InBody画像（スマホ写真で数MB）はメモリに保持せず一時ファイルに退避する
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -136,9 +170,37 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:3000",
 ]
 
+# パイプラインの再開に使うリクエストID、重複リクエストをまとめる Idempotency-Key ヘッダーを許可
+CORS_ALLOW_HEADERS = (*default_headers, "x-request-id", "idempotency-key")
+
+# フロントエンドから参照するレスポンスヘッダー
+CORS_EXPOSE_HEADERS = [
+    "X-Cache",
+    "X-Plan-Id",
+    "X-Analysis-Cache",
+    "X-Coalesced",
+    "ETag",
+    "Retry-After",
+    "X-Request-Id",
+]
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
 }
+
+# Logging: api / core のログはキュー経由で専用スレッドが標準出力に書き出す（既定はJSON、1行1件）
+_log_handler = {"handlers": ["queue"], "level": os.getenv("LOG_LEVEL", "INFO"), "propagate": False}
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "queue": {"()": "core.common.log.make_queue_handler"},
+    },
+    "loggers": {
+        "api": _log_handler,
+        "core": _log_handler,
+    },
+}
@@ -1,23 +1,15 @@
-from typing import List
-from pydantic import BaseModel, Field
+import logging
 from langchain_core.messages import ToolMessage
 
 from core.common.state import AgentState
-from core.common.llm import get_llm
-from core.common.graph_builder import build_tool_agent_graph
-from core.analyzer.tools import retriever_tool, calculate_smm_ratio, evaluate_body_type
+from core.common.schemas import AnalysisResult
+from core.common.llm import invoke_structured
+from core.common.graph_builder import build_tool_agent_graph, LoopBudget
+from core.common.context_cache import full_context_prefix
+from core.common.sections import get_section_index, body_fat_section_number, risk_section_numbers, format_sections
+from core.analyzer.tools import retriever_tool, calculate_smm_ratio, evaluate_body_type, body_type_from_input
 
-
-class AnalysisResult(BaseModel):
-    """InBody分析結果の構造化出力モデル（分析専用）"""
-    body_type: str = Field(description="体型タイプ（筋肉質型/標準型/隠れ肥満型/肥満型/痩せ型）")
-    body_fat_evaluation: str = Field(description="体脂肪率の評価（低い/標準/軽度肥満/肥満）と数値根拠")
-    skeletal_muscle_evaluation: str = Field(description="骨格筋量の評価（優秀/標準/やや低い/低い）と数値根拠")
-    arm_balance: str = Field(description="腕の左右バランス（正常/軽度アンバランス/要注意）と差分%")
-    leg_balance: str = Field(description="脚の左右バランス（正常/軽度アンバランス/要注意）と差分%")
-    upper_lower_balance: str = Field(description="上下肢バランスの評価")
-    risk_factors: List[str] = Field(description="リスク要因のリスト（既往歴・数値から導出）")
-    concerns: List[str] = Field(description="注意すべき点・懸念事項")
+logger = logging.getLogger(__name__)
 
 
 SYSTEM_PROMPT = """あなたは運動生理学とスポーツ医学の専門家です。
@@ -29,11 +21,12 @@ SYSTEM_PROMPT = """あなたは運動生理学とスポーツ医学の専門家
 ## 手順
 1. calculate_smm_ratioで体重比骨格筋量を計算
 2. evaluate_body_typeで体重・身長・体脂肪率から体型タイプを判定（BMIは内部で自動計算）
-3. retriever_toolで以下の項目を検索（※必ず**一度だけ**呼び出し、全項目を一つのクエリに含めること）:
+3. 以下の専門知識は「参照知識」としてメッセージに添付済みのため、検索は不要:
    - 体型分類の詳細アドバイス
    - 体脂肪率判定（4段階: 低い/標準/軽度肥満/肥満）
-   - 既往歴に関連するリスク対策
-   - 上下肢バランスおよび左右差の評価基準
+   - 骨格筋量評価、上下肢バランスおよび左右差の評価基準
+   - 体型・既往歴に関連するリスク対策
+   参照知識で不足する情報がある場合のみ、retriever_toolを**一度だけ**呼び出すこと
 4. 左右バランスおよび上下肢バランスを評価（Knowledge Baseの基準を参照）
 5. 既往歴とデータからリスク要因を特定
 
@@ -44,6 +37,25 @@ SYSTEM_PROMPT = """あなたは運動生理学とスポーツ医学の専門家
 
 TOOLS = [retriever_tool, calculate_smm_ratio, evaluate_body_type]
 
+# 想定: 計算ツール2回 + 検索1回を1〜2ターンで呼ぶ
+LOOP_BUDGET = LoopBudget(max_iterations=3, max_tool_calls=4, max_prompt_tokens=40_000)
+
+
+def build_reference_knowledge(input_data: dict) -> str:
+    """入力データから一意に決まる専門知識セクション（体型・体脂肪率判定・バランス基準・リスク）を直接取得"""
+    user_profile = input_data.get("user_profile", {})
+    inbody_metrics = input_data.get("inbody_metrics", {})
+
+    body_type = body_type_from_input(input_data)
+    body_type_section = get_section_index().get(body_type) if body_type else None
+
+    numbers = [body_type_section.number] if body_type_section else []
+    numbers.append(body_fat_section_number(inbody_metrics.get("body_fat_percent"), user_profile.get("gender")))
+    numbers.extend(["15", "22"])
+    numbers.extend(risk_section_numbers(body_type, user_profile.get("injuries", []), include_substitutions=False))
+
+    return format_sections(number for number in numbers if number)
+
 
 def create_user_message(input_data: dict) -> str:
     """ユーザーデータからメッセージを生成"""
@@ -76,23 +88,56 @@ def create_user_message(input_data: dict) -> str:
 - 目標タイプ: {goal.get('type', '不明')}
 - 週のトレーニング日数: {goal.get('days_per_week', '不明')}日
 
-retriever_toolを使って専門知識を検索し、科学的根拠に基づいた分析を行ってください。"""
+## 参照知識（入力データから確定した専門知識）
+{build_reference_knowledge(input_data)}
 
+参照知識を踏まえ、不足する情報があればretriever_toolで検索し、科学的根拠に基づいた分析を行ってください。"""
 
-def _generate_final_response(state: AgentState) -> dict:
-    """最終応答を生成するノード（AnalysisResult構造化出力を使用）"""
+
+def build_computed_facts(input_data: dict) -> str:
+    """full_context モードでツール呼び出しの代わりに計算する値（体重比骨格筋量・体型タイプ）"""
+    user_profile = input_data.get("user_profile", {})
+    inbody_metrics = input_data.get("inbody_metrics", {})
+
+    smm_ratio = calculate_smm_ratio.invoke({
+        "skeletal_muscle_mass_kg": inbody_metrics.get("skeletal_muscle_mass_kg"),
+        "weight_kg": inbody_metrics.get("weight_kg"),
+        "gender": user_profile.get("gender"),
+    })
+    body_type = evaluate_body_type.invoke({
+        "weight_kg": inbody_metrics.get("weight_kg"),
+        "height_cm": user_profile.get("height_cm"),
+        "body_fat_percent": inbody_metrics.get("body_fat_percent"),
+        "gender": user_profile.get("gender"),
+    })
+    return f"- {smm_ratio}\n- {body_type}"
+
+
+def _generate_final_response(state: AgentState, prefix=None) -> dict:
+    """
+    最終応答を生成するノード（AnalysisResult構造化出力を使用）
+
+    prefix（full_context モード）を指定した場合は、検索結果の代わりにキャッシュ済みの知識ベース全体を参照する。
+    知識ベースを添付しない設定（FULL_CONTEXT_KNOWLEDGE=0）では入力から確定したセクションのみを渡す
+    """
     messages = state["messages"]
     input_data = state["input_data"]
 
-    tool_results = [msg.content for msg in messages if isinstance(msg, ToolMessage)]
-    context_text = "\n\n".join(tool_results) if tool_results else "専門知識なし"
+    if prefix is None:
+        tool_results = [msg.content for msg in messages if isinstance(msg, ToolMessage)]
+        context_parts = [build_reference_knowledge(input_data)] + tool_results
+        context_text = "\n\n".join(part for part in context_parts if part) or "専門知識なし"
+    elif prefix.documents:
+        context_text = f"添付の専門知識ベース全体を参照すること。\n{build_computed_facts(input_data)}"
+    else:
+        context_text = f"{build_reference_knowledge(input_data) or '専門知識なし'}\n\n{build_computed_facts(input_data)}"
 
     user_profile = input_data.get("user_profile", {})
     inbody_metrics = input_data.get("inbody_metrics", {})
 
     prompt = f"""以下のInBodyデータと専門知識を元に、現状の体組成を詳細に分析してください。
 
-## 専門知識（検索結果）
+## 専門知識（参照知識・検索結果）
 {context_text}
 
 ## ユーザーデータ
@@ -104,18 +149,25 @@ def _generate_final_response(state: AgentState) -> dict:
 
 上記データを分析し、トレーニング推奨は含めず、客観的な分析結果のみを構造化して出力してください。"""
 
-    llm = get_llm()
-    structured_llm = llm.with_structured_output(AnalysisResult)
-    result = structured_llm.invoke(prompt)
+    result = invoke_structured("analyzer.final", AnalysisResult, prompt, prefix=prefix)
 
-    print("   [Analyzer] 構造化出力を生成しました")
+    logger.info("構造化出力を生成しました")
     return {"analysis_report": result.model_dump()}
 
 
-def build_analyzer_graph():
-    """カスタムRAGワークフローを構築"""
+def build_analyzer_graph(context_mode: str = "rag"):
+    """
+    カスタムRAGワークフローを構築
+
+    context_mode="full_context" の場合はツール呼び出しループを省略し、システムプロンプトと知識ベース全体を
+    コンテキストキャッシュから参照して最終生成のみを行う
+    """
+    prefix = full_context_prefix("analyzer", SYSTEM_PROMPT) if context_mode == "full_context" else None
     return build_tool_agent_graph(
         tools=TOOLS,
         system_prompt=SYSTEM_PROMPT,
-        final_node_fn=_generate_final_response,
+        final_node_fn=lambda state: _generate_final_response(state, prefix),
+        stage="analyzer",
+        skip_tool_loop=prefix is not None,
+        budget=LOOP_BUDGET,
     )
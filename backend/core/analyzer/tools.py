@@ -1,6 +1,10 @@
+from typing import Optional
 from langchain_core.tools import tool
 from core.common.retriever import search_knowledge
 
+# 分析に使うコレクション（種目ライブラリは含めない）
+RETRIEVER_COLLECTIONS = ("body_types", "metrics", "risks", "progression")
+
 
 @tool
 def retriever_tool(query: str) -> str:
@@ -19,10 +23,8 @@ def retriever_tool(query: str) -> str:
     3. リスク・進行モデル:
        - 体型別リスク: 関節, 代謝, ホルモン(16-18)
        - 進行モデル: 線形, ダブルプログレッション, ピリオダイゼーション(19-21)
-    4. トレーニング種目ライブラリ:
-       - 部位別: 下半身, 胸, 背中, 肩, 腕・コア(25-40)
-       - 特性: 家トレ可, ダンベル種目, 初心者向け(定番)
-    5. その他: 左右差(22), リカバリー(23), サプリメント(24)
+    4. その他: 左右差(22), リカバリー(23), サプリメント(24)
+    ※トレーニング種目ライブラリは検索対象外です。
 
     Args:
         query: 検索クエリ（複数の場合はまとめて入力）
@@ -31,7 +33,7 @@ def retriever_tool(query: str) -> str:
     Returns:
         str: 検索された専門知識のテキスト
     """
-    return search_knowledge(query, k=3, fetch_k=10)
+    return search_knowledge(query, k=3, fetch_k=10, collections=RETRIEVER_COLLECTIONS)
 
 
 @tool
@@ -58,15 +60,11 @@ def calculate_smm_ratio(skeletal_muscle_mass_kg: float, weight_kg: float, gender
     return f"体重比骨格筋量: {smm_ratio:.1f}%（{gender}：{evaluation}）"
 
 
-@tool
-def evaluate_body_type(weight_kg: float, height_cm: float, body_fat_percent: float, gender: str) -> str:
+def classify_body_type(weight_kg: float, height_cm: float, body_fat_percent: float, gender: str) -> Optional[str]:
     """
-    体重・身長・体脂肪率から体型タイプを判定するツール。
-    InBodyの体型評価マトリックスに基づき判定します。
+    体重・身長・体脂肪率から体型タイプ名（10タイプ）を返す。
+    性別が「男性」「女性」以外の場合は None を返す。
     """
-    if weight_kg <= 0 or height_cm <= 0 or body_fat_percent < 0:
-        return "エラー: 体重、身長、体脂肪率は正の値を入力してください。"
-
     height_m = height_cm / 100
     bmi = weight_kg / (height_m ** 2)
 
@@ -108,6 +106,37 @@ def evaluate_body_type(weight_kg: float, height_cm: float, body_fat_percent: flo
             elif body_fat_percent < 28: body_type = "やや痩せ"
             else: body_type = "隠れ肥満"
     else:
+        return None
+
+    return body_type
+
+
+@tool
+def evaluate_body_type(weight_kg: float, height_cm: float, body_fat_percent: float, gender: str) -> str:
+    """
+    体重・身長・体脂肪率から体型タイプを判定するツール。
+    InBodyの体型評価マトリックスに基づき判定します。
+    """
+    if weight_kg <= 0 or height_cm <= 0 or body_fat_percent < 0:
+        return "エラー: 体重、身長、体脂肪率は正の値を入力してください。"
+
+    body_type = classify_body_type(weight_kg, height_cm, body_fat_percent, gender)
+    if body_type is None:
         return "エラー: 性別は「男性」または「女性」を指定してください。"
 
-    return f"体型タイプ: {body_type}（BMI: {bmi:.1f}, 体脂肪率: {body_fat_percent:.1f}%）"
\ No newline at end of file
+    bmi = weight_kg / ((height_cm / 100) ** 2)
+    return f"体型タイプ: {body_type}（BMI: {bmi:.1f}, 体脂肪率: {body_fat_percent:.1f}%）"
+
+
+def body_type_from_input(input_data: dict) -> Optional[str]:
+    """入力データ（user_profile / inbody_metrics）から体型タイプ名を判定する。判定できない場合は None"""
+    user_profile = input_data.get("user_profile", {})
+    inbody_metrics = input_data.get("inbody_metrics", {})
+
+    weight_kg = inbody_metrics.get("weight_kg")
+    height_cm = user_profile.get("height_cm")
+    body_fat_percent = inbody_metrics.get("body_fat_percent")
+    if not weight_kg or not height_cm or body_fat_percent is None:
+        return None
+
+    return classify_body_type(weight_kg, height_cm, body_fat_percent, user_profile.get("gender"))
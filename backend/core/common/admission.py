@@ -0,0 +1,155 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+from core.common.resilience import remaining
+
+logger = logging.getLogger(__name__)
+
+# プールごとの既定値（同時実行数, 待ち行列の長さ, 待ち時間の上限秒）。
+# 環境変数 <NAME>_MAX_CONCURRENT_REQUESTS / <NAME>_ADMISSION_QUEUE_SIZE / <NAME>_ADMISSION_TIMEOUT_SECONDS で上書きできる
+ADMISSION_DEFAULTS = {
+    "plan": (4, 8, 10.0),
+    "inbody": (4, 8, 5.0),
+}
+# 待ち時間・処理時間の統計に使う直近の件数
+STATS_WINDOW = 200
+
+
+class AdmissionRejected(RuntimeError):
+    """同時実行数の上限に達しており、待ち時間の上限内に実行を開始できなかった"""
+
+    def __init__(self, name: str, retry_after: float, reason: str):
+        super().__init__(f"{name} の処理が混み合っています（{reason}）。{retry_after:.0f}秒後に再試行してください")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    同時実行数を max_concurrent 件に制限し、あふれたリクエストを最大 max_queue 件まで到着順に待たせる。
+
+    待ち行列が満杯の場合はすぐに、max_wait 秒（リクエストの締め切りが先ならその時刻）までに
+    実行を開始できない場合はその時点で AdmissionRejected を送出する。スパイク時にスレッドと
+    上流のクォータを使い切って全員がタイムアウトする代わりに、早めに断って再試行を促す。
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._in_flight = 0
+        self._waiters: deque = deque()
+        self._admitted = 0
+        self._rejected = 0
+        self._waits: deque = deque(maxlen=STATS_WINDOW)
+        self._service_times: deque = deque(maxlen=STATS_WINDOW)
+        self._lock = threading.Lock()
+
+    def _retry_after(self) -> float:
+        """待ち行列が空くまでの目安（直近の平均処理時間 × 前にいる件数 / 同時実行数）"""
+        service = sum(self._service_times) / len(self._service_times) if self._service_times else self.max_wait
+        return max(1.0, math.ceil(service * (len(self._waiters) + 1) / self.max_concurrent))
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self._rejected += 1
+        return AdmissionRejected(self.name, self._retry_after(), reason)
+
+    def acquire(self) -> float:
+        """実行枠を1つ取得し、待った秒数を返す"""
+        with self._lock:
+            if self._in_flight < self.max_concurrent and not self._waiters:
+                self._in_flight += 1
+                self._admitted += 1
+                self._waits.append(0.0)
+                return 0.0
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject("待ち行列が満杯です")
+            granted = threading.Event()
+            self._waiters.append(granted)
+
+        left = remaining()
+        started = time.monotonic()
+        granted.wait(self.max_wait if left is None else min(self.max_wait, left))
+        waited = time.monotonic() - started
+
+        with self._lock:
+            # release と競合しないよう、枠の受け渡しの有無はロック内で確認する
+            if not granted.is_set():
+                self._waiters.remove(granted)
+                raise self._reject(f"{waited:.1f}秒待っても実行を開始できませんでした")
+            self._admitted += 1
+            self._waits.append(waited)
+        return waited
+
+    def release(self, service_time: float) -> None:
+        """実行枠を返し、待っているリクエストがあれば先頭に引き渡す"""
+        with self._lock:
+            self._service_times.append(service_time)
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._in_flight -= 1
+
+    @contextmanager
+    def slot(self):
+        """ブロックの間だけ実行枠を確保する"""
+        waited = self.acquire()
+        if waited:
+            logger.info("%s: 実行枠を%.2f秒待ちました", self.name, waited, extra={"pool": self.name, "admission_wait": round(waited, 3)})
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    @property
+    def saturated(self) -> bool:
+        """待ち行列が満杯で、新しいリクエストはすぐに断られる状態か"""
+        with self._lock:
+            return self._in_flight >= self.max_concurrent and len(self._waiters) >= self.max_queue
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "max_wait_seconds": self.max_wait,
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "wait_p50_seconds": round(waits[len(waits) // 2], 3) if waits else None,
+                "wait_p95_seconds": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else None,
+                "retry_after_seconds": self._retry_after(),
+            }
+
+
+_controllers: Dict[str, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_admission_controller(name: str) -> AdmissionController:
+    """プール（plan / inbody）ごとのアドミッション制御を取得"""
+    with _controllers_lock:
+        if name not in _controllers:
+            max_concurrent, max_queue, max_wait = ADMISSION_DEFAULTS[name]
+            prefix = name.upper()
+            _controllers[name] = AdmissionController(
+                name,
+                max_concurrent=int(os.getenv(f"{prefix}_MAX_CONCURRENT_REQUESTS", max_concurrent)),
+                max_queue=int(os.getenv(f"{prefix}_ADMISSION_QUEUE_SIZE", max_queue)),
+                max_wait=float(os.getenv(f"{prefix}_ADMISSION_TIMEOUT_SECONDS", max_wait)),
+            )
+        return _controllers[name]
+
+
+def get_admission_status() -> Dict[str, dict]:
+    """全プールの実行中・待機中の件数と待ち時間"""
+    return {name: get_admission_controller(name).stats() for name in ADMISSION_DEFAULTS}
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """スレッドセーフなTTL付きLRUキャッシュ（maxsizeを超えると最も古く使われたエントリから破棄）"""
+
+    def __init__(self, maxsize: int = 128, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class FlightTimeout(TimeoutError):
+    """先行する実行が待機時間内に完了しなかった"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """同一キーの同時実行を1回にまとめ、後続の呼び出し元は先行する実行の結果を共有する"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        fnを実行して結果を返す。同じキーの実行が進行中であれば、その完了を待って結果を共有する。
+
+        Args:
+            timeout: 先行する実行を待つ最大秒数（省略時は完了まで待つ）
+
+        Returns:
+            (結果, 他の呼び出しの結果を共有したか)
+
+        Raises:
+            FlightTimeout: timeout 秒待っても先行する実行が完了しなかった
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise FlightTimeout("同じキーの実行が待機時間内に完了しませんでした")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+
+def cached_call(cache: TTLCache, flight: SingleFlight, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, str]:
+    """
+    キャッシュ→進行中の実行→新規実行の順に結果を取得する。失敗した結果はキャッシュしない。
+
+    Returns:
+        (結果, キャッシュ状態 "HIT" / "SHARED" / "MISS")
+    """
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value, "HIT"
+
+    def compute():
+        result = fn()
+        cache.set(key, result)
+        return result
+
+    value, shared = flight.do(key, compute)
+    return value, "SHARED" if shared else "MISS"
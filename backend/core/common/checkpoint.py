@@ -0,0 +1,104 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from langgraph.checkpoint.sqlite import SqliteSaver
+from core.common.config import BACKEND_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_DB = BACKEND_DIR / "data" / "checkpoints.sqlite3"
+DEFAULT_CHECKPOINT_TTL_SECONDS = 86400
+# 期限切れチェックポイントの削除を試みる最短間隔（秒）
+GC_INTERVAL_SECONDS = 600
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+_last_gc = 0.0
+
+
+def create_checkpointer(path: str) -> SqliteSaver:
+    """SQLiteファイル（":memory:" も可）に保存するチェックポインタを作成する"""
+    if path != ":memory:":
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    checkpointer = SqliteSaver(conn)
+    with checkpointer.cursor() as cur:
+        # SqliteSaverのテーブルには作成時刻が無いため、スレッドごとの最終更新時刻を別に記録する
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoint_threads "
+            "(thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+        )
+    return checkpointer
+
+
+def get_checkpointer() -> SqliteSaver:
+    """スレッドセーフなシングルトンのSQLiteチェックポインタを取得（保存先は環境変数 PIPELINE_CHECKPOINT_DB）"""
+    global _checkpointer
+
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            _checkpointer = create_checkpointer(os.getenv("PIPELINE_CHECKPOINT_DB", str(DEFAULT_CHECKPOINT_DB)))
+        return _checkpointer
+
+
+def touch_thread(checkpointer: SqliteSaver, thread_id: str) -> None:
+    """スレッドの最終更新時刻を記録する（GCの判定に使用）"""
+    with checkpointer.cursor() as cur:
+        cur.execute(
+            "INSERT INTO checkpoint_threads (thread_id, updated_at) VALUES (?, ?) "
+            "ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (thread_id, time.time()),
+        )
+
+
+def delete_thread(checkpointer: SqliteSaver, thread_id: str) -> None:
+    """スレッドのチェックポイントと最終更新時刻の記録を削除する"""
+    checkpointer.delete_thread(thread_id)
+    with checkpointer.cursor() as cur:
+        cur.execute("DELETE FROM checkpoint_threads WHERE thread_id = ?", (thread_id,))
+
+
+def gc_checkpoints(checkpointer: Optional[SqliteSaver] = None, max_age_seconds: Optional[float] = None) -> int:
+    """
+    最終更新から max_age_seconds 以上経過したスレッドのチェックポイントを削除する。
+
+    Args:
+        checkpointer: 対象のチェックポインタ（省略時はシングルトン）
+        max_age_seconds: 保持期間（省略時は環境変数 PIPELINE_CHECKPOINT_TTL_SECONDS）
+
+    Returns:
+        削除したスレッド数
+    """
+    checkpointer = checkpointer or get_checkpointer()
+    if max_age_seconds is None:
+        max_age_seconds = float(os.getenv("PIPELINE_CHECKPOINT_TTL_SECONDS", DEFAULT_CHECKPOINT_TTL_SECONDS))
+
+    with checkpointer.cursor() as cur:
+        cur.execute("SELECT thread_id FROM checkpoint_threads WHERE updated_at < ?", (time.time() - max_age_seconds,))
+        expired = [row[0] for row in cur.fetchall()]
+
+    for thread_id in expired:
+        delete_thread(checkpointer, thread_id)
+
+    return len(expired)
+
+
+def maybe_gc_checkpoints(checkpointer: Optional[SqliteSaver] = None) -> int:
+    """前回のGCから GC_INTERVAL_SECONDS 以上経過していればGCを実行する（リクエスト処理から呼ぶ）"""
+    global _last_gc
+
+    with _checkpointer_lock:
+        now = time.monotonic()
+        if now - _last_gc < GC_INTERVAL_SECONDS:
+            return 0
+        _last_gc = now
+
+    deleted = gc_checkpoints(checkpointer)
+    if deleted:
+        logger.info("期限切れのパイプラインチェックポイントを削除しました: %d件", deleted)
+    return deleted
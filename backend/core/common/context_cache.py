@@ -0,0 +1,209 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from core.common.hashing import canonical_hash
+from core.common.resilience import call_timeout, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# rag: ツール呼び出しループで必要な知識を検索する / full_context: 知識ベース全体を静的プレフィックスに含め、ループを省略する
+CONTEXT_MODES = ("rag", "full_context")
+CONTEXT_CACHE_BACKENDS = ("gemini", "local")
+DEFAULT_CACHE_TTL_SECONDS = 3600
+# 登録に失敗したプレフィックスを再登録せずにメッセージとして送る秒数
+DEFAULT_CACHE_RETRY_SECONDS = 60
+# 期限切れ直前のキャッシュは参照せずに作成し直す（呼び出し中に失効しないよう余裕を持たせる）
+REFRESH_MARGIN_SECONDS = 120
+
+FULL_CONTEXT_NOTE = """## 参照できる情報
+このモードではツールは使用できません。専門知識ベース全体を以下に添付しているため、
+必要なセクションを直接参照してください。ツールで計算していた値はメッセージに記載します。"""
+
+# FULL_CONTEXT_KNOWLEDGE=0 の場合（知識ベースを添付しない）
+FULL_CONTEXT_NOTE_WITHOUT_KNOWLEDGE = """## 参照できる情報
+このモードではツールは使用できません。入力データから確定した専門知識のセクションと、
+ツールで計算していた値はメッセージに記載します。"""
+
+
+def get_context_mode() -> str:
+    """環境変数 LLM_CONTEXT_MODE（既定は rag）"""
+    mode = os.getenv("LLM_CONTEXT_MODE", "rag")
+    if mode not in CONTEXT_MODES:
+        raise ValueError(f"未対応のコンテキストモードです: {mode}（対応: {', '.join(CONTEXT_MODES)}）")
+    return mode
+
+
+@dataclass(frozen=True)
+class StaticPrefix:
+    """リクエスト間で変わらないプロンプトの先頭部分（システムプロンプトと、任意で知識ベース全体）"""
+    name: str
+    system_instruction: str
+    documents: Tuple[str, ...] = ()
+
+    @property
+    def digest(self) -> str:
+        return canonical_hash([self.system_instruction, list(self.documents)])[:16]
+
+    def as_messages(self) -> List:
+        messages = [SystemMessage(content=self.system_instruction)]
+        if self.documents:
+            messages.append(HumanMessage(content="\n\n".join(self.documents)))
+        return messages
+
+
+def full_context_prefix(name: str, system_prompt: str) -> StaticPrefix:
+    """
+    full_context モードの静的プレフィックスを作成する。
+    FULL_CONTEXT_KNOWLEDGE=0 の場合は知識ベースを含めず、システムプロンプトのみとする。
+    """
+    from core.common.db_client import KNOWLEDGE_FILE
+
+    if os.getenv("FULL_CONTEXT_KNOWLEDGE", "1") == "1":
+        documents, note = (KNOWLEDGE_FILE.read_text(encoding="utf-8"),), FULL_CONTEXT_NOTE
+    else:
+        documents, note = (), FULL_CONTEXT_NOTE_WITHOUT_KNOWLEDGE
+    return StaticPrefix(name=name, system_instruction=f"{system_prompt}\n\n{note}", documents=documents)
+
+
+class LocalContextCache:
+    """
+    コンテキストキャッシュのローカル代替（テスト用・キャッシュに対応しないモデル用）。
+    ハンドルの発行と再利用はGeminiと同様に振る舞い、呼び出し時にはプレフィックスをメッセージとして毎回送る。
+    """
+
+    def __init__(self):
+        self.created = 0
+        self._handles: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def handle(self, model: str, prefix: StaticPrefix) -> str:
+        with self._lock:
+            key = (model, prefix.digest)
+            if key not in self._handles:
+                self.created += 1
+                self._handles[key] = f"local/{prefix.name}-{prefix.digest}"
+            return self._handles[key]
+
+    def bind(self, model: str, prefix: StaticPrefix, prompt) -> Tuple[dict, List]:
+        """(LLMの追加パラメータ, 送信するメッセージ) を返す"""
+        self.handle(model, prefix)
+        return {}, prefix.as_messages() + _as_messages(prompt)
+
+
+class GeminiContextCache:
+    """
+    Geminiのコンテキストキャッシュ（cachedContents）にプレフィックスを登録し、ハンドルで参照する。
+
+    登録はモデルとプレフィックスの組ごとに1回で、他のワーカーが登録済みのキャッシュ（display_name が同じ）
+    があればそれを使う。登録に失敗した場合（最小トークン数未満・非対応モデルなど）は retry_seconds の間、
+    LocalContextCache と同じくプレフィックスをメッセージとして送る。
+
+    登録（cachedContents の一覧・作成）はロックの外で、キーごとに1スレッドだけが行う。登録中に届いた
+    他の呼び出しは完了を待たずにプレフィックスをメッセージとして送るため、登録の待ち時間で
+    他のLLM呼び出しが止まることはない。登録のタイムアウトはリクエストの残り時間に合わせる。
+    """
+
+    def __init__(self, ttl_seconds: float = DEFAULT_CACHE_TTL_SECONDS, retry_seconds: float = DEFAULT_CACHE_RETRY_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        # (モデル, プレフィックス) → (ハンドル, 再登録する時刻)
+        self._handles: Dict[Tuple[str, str], Tuple[Optional[str], float]] = {}
+        self._registering: set = set()
+        self._lock = threading.Lock()
+
+    def handle(self, model: str, prefix: StaticPrefix) -> Optional[str]:
+        key = (model, prefix.digest)
+        with self._lock:
+            name, refresh_at = self._handles.get(key, (None, 0.0))
+            if refresh_at > time.monotonic():
+                return name
+            if key in self._registering:
+                # 他のスレッドが登録中（期限切れ間近の古いハンドルはそのまま使える）
+                return name
+            self._registering.add(key)
+
+        display_name = f"project-trainer-{prefix.name}-{prefix.digest}"
+        try:
+            try:
+                name, expires_at = self._find_or_create(model, prefix, display_name, call_timeout())
+                refresh_at = expires_at - REFRESH_MARGIN_SECONDS
+            except DeadlineExceeded:
+                # リクエストの締め切りを過ぎている場合は登録せず、次の呼び出しで改めて登録する
+                return None
+            except Exception as e:
+                # 失敗したプレフィックスは retry_seconds の間は再登録を試みずにメッセージとして送る
+                logger.warning("コンテキストキャッシュの登録に失敗したため、プレフィックスを送信します: %s", e)
+                name, refresh_at = None, time.monotonic() + self.retry_seconds
+            with self._lock:
+                self._handles[key] = (name, refresh_at)
+            return name
+        finally:
+            with self._lock:
+                self._registering.discard(key)
+
+    def _find_or_create(self, model: str, prefix: StaticPrefix, display_name: str, timeout: float) -> Tuple[str, float]:
+        from google.genai import types
+        from core.common.llm import get_genai_client
+
+        client = get_genai_client(timeout=timeout)
+        now = time.time()
+        for cache in client.caches.list():
+            if cache.display_name == display_name and cache.model.endswith(model):
+                remaining = cache.expire_time.timestamp() - now
+                if remaining > REFRESH_MARGIN_SECONDS:
+                    return cache.name, time.monotonic() + remaining
+
+        contents = None
+        if prefix.documents:
+            contents = [types.Content(role="user", parts=[types.Part(text=document) for document in prefix.documents])]
+        cache = client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=display_name,
+                system_instruction=prefix.system_instruction,
+                contents=contents,
+                ttl=f"{int(self.ttl_seconds)}s",
+            ),
+        )
+        logger.info("コンテキストキャッシュを登録しました: %s（%s）", cache.name, display_name)
+        return cache.name, time.monotonic() + self.ttl_seconds
+
+    def bind(self, model: str, prefix: StaticPrefix, prompt) -> Tuple[dict, List]:
+        """(LLMの追加パラメータ, 送信するメッセージ) を返す"""
+        name = self.handle(model, prefix)
+        if name is None:
+            return {}, prefix.as_messages() + _as_messages(prompt)
+        return {"cached_content": name}, _as_messages(prompt)
+
+
+def _as_messages(prompt) -> List:
+    return [HumanMessage(content=prompt)] if isinstance(prompt, str) else list(prompt)
+
+
+_context_cache = None
+_context_cache_lock = threading.Lock()
+
+
+def get_context_cache():
+    """環境変数 CONTEXT_CACHE_BACKEND（既定は gemini）に従ってコンテキストキャッシュを取得"""
+    global _context_cache
+
+    with _context_cache_lock:
+        if _context_cache is None:
+            backend = os.getenv("CONTEXT_CACHE_BACKEND", "gemini")
+            if backend not in CONTEXT_CACHE_BACKENDS:
+                raise ValueError(f"未対応のコンテキストキャッシュです: {backend}（対応: {', '.join(CONTEXT_CACHE_BACKENDS)}）")
+            if backend == "local":
+                _context_cache = LocalContextCache()
+            else:
+                _context_cache = GeminiContextCache(
+                    ttl_seconds=float(os.getenv("CONTEXT_CACHE_TTL_SECONDS", DEFAULT_CACHE_TTL_SECONDS)),
+                    retry_seconds=float(os.getenv("CONTEXT_CACHE_RETRY_SECONDS", DEFAULT_CACHE_RETRY_SECONDS)),
+                )
+        return _context_cache
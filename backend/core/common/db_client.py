@@ -1,24 +1,65 @@
+import logging
+import os
+import re
 import threading
 from pathlib import Path
+from typing import Dict, List, Optional
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
 from core.common.config import BACKEND_DIR
-from core.common.llm import get_embeddings
+from core.common.llm import get_embeddings, EMBEDDING_MODEL
 
-_vectorstore_cache = None
-_vectorstore_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+# コレクション名 → 初期化済みの索引（コレクションごとに初回アクセス時に構築する）
+_vectorstores: Dict[str, Chroma] = {}
+_mmap_indexes: Dict[str, object] = {}
+_index_locks: Dict[tuple, threading.Lock] = {}
+_index_locks_lock = threading.Lock()
+
+# ベクトル索引の実装（chroma: 永続化したChroma / mmap: export_knowledge_index で書き出した読み取り専用索引）
+VECTOR_INDEX_BACKENDS = ("chroma", "mmap")
 
 DB_PATH = BACKEND_DIR / "data" / "chroma_db"
 KNOWLEDGE_FILE = BACKEND_DIR / "core" / "analyzer" / "knowledge" / "expert_knowledge.md"
 
+# ナレッジのコレクション → 含める大分類（expert_knowledge.md の "## I." などの番号。None はナレッジ全体）。
+# ツールは用途に合ったコレクションのみを検索し、小さい索引で少ない件数でも関連する結果を得る
+KNOWLEDGE_COLLECTIONS = {
+    "inbody_knowledge": None,
+    "body_types": ("I",),           # 体型分類（代謝特性・栄養戦略・有酸素運動）
+    "metrics": ("II",),             # 体脂肪率・骨格筋量の判定基準
+    "risks": ("III",),              # 体型別リスク
+    "progression": ("IV", "V"),     # 進行モデル・筋肉バランス・リカバリー・サプリメント
+    "exercises": ("VI",),           # トレーニング種目ライブラリ
+}
+DEFAULT_COLLECTION = "inbody_knowledge"
+
+# "I. 体型分類（コード判定準拠）" のような大分類の見出し
+_CATEGORY_HEADER = re.compile(r"^([IVX]+)\. ")
+
+
+def _check_collection(collection: str) -> None:
+    if collection not in KNOWLEDGE_COLLECTIONS:
+        raise ValueError(f"未対応のコレクションです: {collection}（対応: {', '.join(KNOWLEDGE_COLLECTIONS)}）")
 
-def _ensure_documents_loaded(vectorstore: Chroma) -> None:
-    """DBが空の場合、ナレッジベースからドキュメントを追加する"""
-    existing_docs = vectorstore.get()
-    if len(existing_docs["ids"]) > 0:
-        return
 
-    print("   - DBが空のため、ドキュメントを追加中...")
+def _index_lock(kind: str, collection: str) -> threading.Lock:
+    """索引の種類・コレクションごとのロック（あるコレクションの構築中も他のコレクションは使える）"""
+    with _index_locks_lock:
+        return _index_locks.setdefault((kind, collection), threading.Lock())
 
+
+def load_knowledge_chunks(collection: str = DEFAULT_COLLECTION) -> List[Document]:
+    """
+    ナレッジベースを見出し単位→文字数単位で分割したチャンクを返す。
+
+    各チャンクのメタデータ category には所属する大分類（"I" など）を設定する。
+
+    Args:
+        collection: KNOWLEDGE_COLLECTIONS のコレクション名（そのコレクションの大分類のチャンクのみ返す）
+    """
+    _check_collection(collection)
     if not KNOWLEDGE_FILE.exists():
         raise FileNotFoundError(f"ナレッジベースファイルが見つかりません: {KNOWLEDGE_FILE}")
 
@@ -34,35 +75,95 @@ def _ensure_documents_loaded(vectorstore: Chroma) -> None:
     )
     split_docs = markdown_splitter.split_text(docs[0].page_content)
 
+    category = None
+    for doc in split_docs:
+        match = _CATEGORY_HEADER.match(doc.metadata.get("Header 2", ""))
+        if match:
+            category = match.group(1)
+        if category is not None:
+            doc.metadata["category"] = category
+
+    categories = KNOWLEDGE_COLLECTIONS[collection]
+    if categories is not None:
+        split_docs = [doc for doc in split_docs if doc.metadata.get("category") in categories]
+
     recursive_splitter = RecursiveCharacterTextSplitter(
         chunk_size=500,
         chunk_overlap=20,
         separators=["\n\n", "\n", "、", "。", ""],
     )
-    all_splits = recursive_splitter.split_documents(split_docs)
+    return recursive_splitter.split_documents(split_docs)
+
 
-    print(f"   - {len(all_splits)}件のドキュメントをインデックス化")
+def _ensure_documents_loaded(vectorstore: Chroma, collection: str) -> None:
+    """コレクションが空の場合、ナレッジベースから該当するドキュメントを追加する"""
+    existing_docs = vectorstore.get()
+    if len(existing_docs["ids"]) > 0:
+        return
+
+    logger.info("%s が空のため、ドキュメントを追加中...", collection)
+
+    all_splits = load_knowledge_chunks(collection)
+
+    logger.info("%d件のドキュメントをインデックス化", len(all_splits))
     vectorstore.add_documents(all_splits)
-    print("   - DBにドキュメントを追加しました")
+    logger.info("%s にドキュメントを追加しました", collection)
 
 
-def get_vectorstore(collection_name: str = "inbody_knowledge") -> Chroma:
-    """スレッドセーフなシングルトンChroma VectorStoreを取得（初回はドキュメント自動登録）"""
-    global _vectorstore_cache
+def get_vectorstore(collection_name: str = DEFAULT_COLLECTION) -> Chroma:
+    """コレクションごとのスレッドセーフなシングルトンChroma VectorStoreを取得（初回はドキュメント自動登録）"""
+    _check_collection(collection_name)
 
-    with _vectorstore_lock:
-        if _vectorstore_cache is not None:
-            return _vectorstore_cache
+    with _index_lock("chroma", collection_name):
+        if collection_name in _vectorstores:
+            return _vectorstores[collection_name]
 
         embeddings = get_embeddings()
         DB_PATH.mkdir(parents=True, exist_ok=True)
 
-        _vectorstore_cache = Chroma(
+        vectorstore = Chroma(
             collection_name=collection_name,
             embedding_function=embeddings,
             persist_directory=str(DB_PATH),
         )
 
-        _ensure_documents_loaded(_vectorstore_cache)
+        _ensure_documents_loaded(vectorstore, collection_name)
+
+        _vectorstores[collection_name] = vectorstore
+        return vectorstore
+
+
+def mmap_index_dir(collection: str = DEFAULT_COLLECTION, root: Optional[Path] = None) -> Path:
+    """コレクションのメモリマップ索引の場所（ナレッジ全体は KNOWLEDGE_INDEX_DIR、その他はその下のコレクション名）"""
+    from core.common.mmap_index import DEFAULT_INDEX_DIR
+
+    root = Path(root or os.getenv("KNOWLEDGE_INDEX_DIR", DEFAULT_INDEX_DIR))
+    return root if collection == DEFAULT_COLLECTION else root / collection
+
+
+def get_mmap_index(collection: str = DEFAULT_COLLECTION):
+    """読み取り専用のメモリマップ索引を取得（ナレッジファイルが索引の書き出し後に変更されていれば警告する）"""
+    from core.common.mmap_index import MmapVectorIndex, file_sha256
+
+    _check_collection(collection)
+
+    with _index_lock("mmap", collection):
+        if collection in _mmap_indexes:
+            return _mmap_indexes[collection]
+
+        index_dir = mmap_index_dir(collection)
+        index = MmapVectorIndex(index_dir, embedding_function=get_embeddings())
+        if KNOWLEDGE_FILE.exists() and index.manifest.get("source_sha256") != file_sha256(KNOWLEDGE_FILE):
+            logger.warning("%s はナレッジベースの変更前に書き出された索引です（export_knowledge_index で再生成してください）", index_dir)
+        logger.info("メモリマップ索引を開きました: %s（%d件）", index_dir, len(index))
+
+        _mmap_indexes[collection] = index
+        return index
+
 
-        return _vectorstore_cache
\ No newline at end of file
+def get_vector_index(collection: str = DEFAULT_COLLECTION):
+    """環境変数 KNOWLEDGE_VECTOR_INDEX（既定は chroma）に従ってコレクションのベクトル索引を取得"""
+    backend = os.getenv("KNOWLEDGE_VECTOR_INDEX", "chroma")
+    if backend not in VECTOR_INDEX_BACKENDS:
+        raise ValueError(f"未対応のベクトル索引です: {backend}（対応: {', '.join(VECTOR_INDEX_BACKENDS)}）")
+    return get_mmap_index(collection) if backend == "mmap" else get_vectorstore(collection)
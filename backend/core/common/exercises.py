@@ -0,0 +1,214 @@
+import re
+import threading
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional
+
+from core.common.sections import Section, get_section_index
+
+_exercise_library_cache = None
+_exercise_library_lock = threading.Lock()
+
+# 種目ライブラリの大分類見出し（"## VI. トレーニング種目ライブラリ (Exercise Library)"）
+EXERCISE_CATEGORY = "トレーニング種目ライブラリ"
+
+# "**Tags:** \Target_Legs\, \Equip_None\, ..." のタグ
+_TAG_PATTERN = re.compile(r"\\([A-Za-z_]+)\\")
+
+# Target_ タグ → 部位。Target_Back_Legs のように複数部位を表すタグもある
+BODY_PARTS = {
+    "Legs": "下半身",
+    "Chest": "胸",
+    "Back": "背中",
+    "Shoulders": "肩",
+    "Arms": "腕",
+    "Core": "体幹",
+}
+
+EQUIPMENT_LABELS = {
+    "none": "器具なし",
+    "dumbbell": "ダンベル",
+    "machine": "マシン",
+}
+
+# preferences.equipment（自由記述）のキーワード → 器具
+EQUIPMENT_KEYWORDS = {
+    "dumbbell": ("ダンベル", "dumbbell", "ペットボトル"),
+    "machine": ("マシン", "machine"),
+}
+
+# 既往歴キーワード → 負担が大きいため避ける種目（代替種目は sections.INJURY_SECTIONS）
+# 知識ベースの本文でその部位に安全・推奨とされている種目（例: スーパーマンの「腰痛予防に良い」）は含めない
+CONTRAINDICATIONS = {
+    "膝": ["25", "26", "27", "49"],
+    "腰": ["28", "50"],
+    "肩": ["30", "36", "37"],
+    "足首": ["27", "42", "49"],
+}
+
+
+class LibraryExercise(NamedTuple):
+    number: str
+    name: str
+    english: str
+    body_parts: FrozenSet[str]
+    equipment: str
+    gym_only: bool
+    difficulty: str
+    unilateral: bool
+    contraindications: FrozenSet[str]
+
+    def label(self) -> str:
+        """プランナーに渡す1行の説明（例: "ダンベルランジ [27] ダンベル・片側"）"""
+        notes = [EQUIPMENT_LABELS[self.equipment]]
+        if self.difficulty == "beginner":
+            notes.append("初級")
+        if self.unilateral:
+            notes.append("片側")
+        return f"{self.name} [{self.number}] {'・'.join(notes)}"
+
+
+def parse_exercise(section: Section) -> LibraryExercise:
+    """種目セクションの Tags 行から属性を取り出す"""
+    tags = set(_TAG_PATTERN.findall(section.content))
+
+    body_parts = set()
+    for tag in tags:
+        if tag.startswith("Target_"):
+            body_parts.update(part for part in tag.split("_")[1:] if part in BODY_PARTS)
+
+    equipment = "none"
+    for tag in tags:
+        if tag.startswith("Equip_") and tag[len("Equip_"):].lower() in EQUIPMENT_LABELS:
+            equipment = tag[len("Equip_"):].lower()
+
+    return LibraryExercise(
+        number=section.number,
+        name=section.title,
+        english=section.english,
+        body_parts=frozenset(body_parts),
+        equipment=equipment,
+        gym_only="Gym_Only" in tags,
+        difficulty="beginner" if "Difficulty_Beginner" in tags else "standard",
+        unilateral="Unilateral" in tags,
+        contraindications=frozenset(
+            keyword for keyword, numbers in CONTRAINDICATIONS.items() if section.number in numbers
+        ),
+    )
+
+
+def available_equipment(preferences: dict) -> FrozenSet[str]:
+    """環境と器具の記述から使える器具を返す（ジムは全器具、自宅は自重と記述された器具）"""
+    if preferences.get("environment") == "gym":
+        return frozenset(EQUIPMENT_LABELS)
+    text = (preferences.get("equipment") or "").lower()
+    equipment = {"none"}
+    equipment.update(name for name, keywords in EQUIPMENT_KEYWORDS.items() if any(k in text for k in keywords))
+    # マシンはジム専用種目のため、自宅では対象外
+    equipment.discard("machine")
+    return frozenset(equipment)
+
+
+def injury_keywords(texts: Iterable[str]) -> FrozenSet[str]:
+    """既往歴の記述に含まれる部位キーワード（"膝痛" → "膝"）"""
+    return frozenset(keyword for text in texts for keyword in CONTRAINDICATIONS if keyword in text)
+
+
+class ExerciseLibrary:
+    """
+    種目ライブラリの属性（部位・器具・環境・難易度・片側・禁忌）ごとの転置索引。
+
+    各属性の値 → 種目番号の集合を事前に作っておき、条件は集合の積・差で絞り込む。
+    同じ条件には常に同じ結果（セクション番号順）を返す。
+    """
+
+    def __init__(self, exercises: List[LibraryExercise]):
+        self.exercises = exercises
+        self.by_number: Dict[str, LibraryExercise] = {exercise.number: exercise for exercise in exercises}
+        self.all: FrozenSet[str] = frozenset(self.by_number)
+        self._order = {exercise.number: i for i, exercise in enumerate(exercises)}
+
+        def index(key) -> Dict[object, FrozenSet[str]]:
+            table: Dict[object, set] = {}
+            for exercise in exercises:
+                for value in key(exercise):
+                    table.setdefault(value, set()).add(exercise.number)
+            return {value: frozenset(numbers) for value, numbers in table.items()}
+
+        self.by_body_part = index(lambda e: e.body_parts)
+        self.by_equipment = index(lambda e: [e.equipment])
+        self.by_difficulty = index(lambda e: [e.difficulty])
+        self.gym_only = index(lambda e: [True] if e.gym_only else []).get(True, frozenset())
+        self.unilateral = index(lambda e: [True] if e.unilateral else []).get(True, frozenset())
+        self.by_contraindication = index(lambda e: e.contraindications)
+
+    def filter(
+        self,
+        body_part: Optional[str] = None,
+        equipment: Optional[Iterable[str]] = None,
+        home: bool = False,
+        difficulty: Optional[str] = None,
+        unilateral: Optional[bool] = None,
+        avoid: Iterable[str] = (),
+    ) -> List[LibraryExercise]:
+        """
+        条件に合う種目をセクション番号順に返す。
+
+        Args:
+            body_part: 部位（"Legs" など BODY_PARTS のキー）
+            equipment: 使える器具（"none" / "dumbbell" / "machine"）
+            home: 自宅で実施できる種目のみにするか
+            difficulty: "beginner" / "standard"
+            unilateral: True で片側種目のみ、False で両側種目のみ
+            avoid: 避ける既往歴キーワード（"膝" など CONTRAINDICATIONS のキー）
+        """
+        numbers = self.all
+        if body_part is not None:
+            numbers &= self.by_body_part.get(body_part, frozenset())
+        if equipment is not None:
+            numbers &= frozenset().union(*(self.by_equipment.get(name, frozenset()) for name in equipment))
+        if home:
+            numbers -= self.gym_only
+        if difficulty is not None:
+            numbers &= self.by_difficulty.get(difficulty, frozenset())
+        if unilateral is not None:
+            numbers = numbers & self.unilateral if unilateral else numbers - self.unilateral
+        for keyword in avoid:
+            numbers -= self.by_contraindication.get(keyword, frozenset())
+        return [self.by_number[number] for number in sorted(numbers, key=self._order.__getitem__)]
+
+    def candidates_for(self, preferences: dict, injuries: Iterable[str] = ()) -> Dict[str, List[LibraryExercise]]:
+        """
+        要望（環境・器具）と既往歴から、部位ごとの種目候補を返す。
+
+        Args:
+            preferences: TrainingRequest の preferences
+            injuries: 申告された既往歴の記述（例: ["膝痛"]）
+        """
+        equipment = available_equipment(preferences)
+        home = preferences.get("environment", "home") != "gym"
+        avoid = injury_keywords(injuries)
+        return {
+            part: self.filter(body_part=part, equipment=equipment, home=home, avoid=avoid)
+            for part in BODY_PARTS
+        }
+
+
+def format_candidates(candidates: Dict[str, List[LibraryExercise]]) -> str:
+    """部位ごとの種目候補をプランナー用のテキストに整形する"""
+    lines = []
+    for part, exercises in candidates.items():
+        names = "、".join(exercise.label() for exercise in exercises) or "該当なし（自重の類似種目で代替）"
+        lines.append(f"- {BODY_PARTS[part]}: {names}")
+    return "\n".join(lines)
+
+
+def get_exercise_library() -> ExerciseLibrary:
+    """スレッドセーフなシングルトンの種目ライブラリ索引を取得"""
+    global _exercise_library_cache
+
+    with _exercise_library_lock:
+        if _exercise_library_cache is None:
+            sections = get_section_index().sections
+            _exercise_library_cache = ExerciseLibrary(
+                [parse_exercise(section) for section in sections if section.category.startswith(EXERCISE_CATEGORY)]
+            )
+        return _exercise_library_cache
@@ -1,19 +1,75 @@
-from typing import List, Literal, Callable
+import json
+import logging
+import os
+from dataclasses import dataclass, replace
+from typing import List, Literal, Callable, Optional
 from pydantic import BaseModel
-from langchain_core.messages import ToolMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, SystemMessage
 from langchain_core.tools import BaseTool
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import ToolNode
 
 from core.common.state import AgentState
-from core.common.llm import get_llm
+from core.common.llm import invoke_llm
+from core.common.metrics import get_loop_budget_metrics, token_usage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LoopBudget:
+    """
+    ツール呼び出しループの予算。いずれかの上限に達したら、それまでに集めた情報で最終生成に進む。
+
+    Args:
+        max_iterations: ループ内のモデル呼び出し回数
+        max_tool_calls: ツール呼び出しの合計数（1回の応答で上限を超える呼び出しを要求された場合は実行しない）
+        max_prompt_tokens: ループ内のモデル呼び出しの入力トークン数の合計
+    """
+    max_iterations: int = 4
+    max_tool_calls: int = 6
+    max_prompt_tokens: int = 50_000
+
+    def exhausted(self, usage: dict) -> Optional[str]:
+        """上限に達した項目名を返す（未達なら None）"""
+        if usage["iterations"] >= self.max_iterations:
+            return "iterations"
+        if usage["tool_calls"] >= self.max_tool_calls:
+            return "tool_calls"
+        if usage["prompt_tokens"] >= self.max_prompt_tokens:
+            return "prompt_tokens"
+        return None
+
+
+def get_loop_budget(stage: str, default: Optional[LoopBudget] = None) -> LoopBudget:
+    """
+    処理段階のループ予算を取得（default に環境変数 AGENT_LOOP_BUDGETS のJSONの上書きを適用）
+    例: AGENT_LOOP_BUDGETS='{"planner": {"max_tool_calls": 2}}'
+    """
+    overrides = json.loads(os.getenv("AGENT_LOOP_BUDGETS", "{}"))
+    return replace(default or LoopBudget(), **overrides.get(stage, {}))
+
+
+def loop_usage(messages: List) -> dict:
+    """直近のHumanMessage以降（現在の段階のループ）のモデル呼び出し回数・ツール呼び出し数・入力トークン数"""
+    usage = {"iterations": 0, "tool_calls": 0, "prompt_tokens": 0}
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, AIMessage):
+            usage["iterations"] += 1
+            usage["tool_calls"] += len(message.tool_calls)
+            usage["prompt_tokens"] += token_usage(message)[0]
+    return usage
 
 
 def build_tool_agent_graph(
     tools: List[BaseTool],
     system_prompt: str,
     final_node_fn: Callable[[AgentState], dict],
-    temperature: float = 0.5,
+    stage: str,
+    skip_tool_loop: bool = False,
+    budget: Optional[LoopBudget] = None,
 ):
     """
     ツール呼び出し→最終生成の共通グラフを構築する。
@@ -22,22 +78,48 @@ def build_tool_agent_graph(
         tools: バインドするツールのリスト
         system_prompt: システムプロンプト
         final_node_fn: 最終ノードの処理関数（structured output等）
-        temperature: LLMのtemperature
+        stage: 処理段階の接頭辞（ツール呼び出しループは "<stage>.loop" のルートを使用）
+        skip_tool_loop: True の場合はツール呼び出しループを省略し、最終生成のみを行う（full_context モード）
+        budget: ツール呼び出しループの予算（AGENT_LOOP_BUDGETS で段階ごとに上書きできる）
     """
+    if skip_tool_loop:
+        workflow = StateGraph(AgentState)
+        workflow.add_node("generate_final", final_node_fn)
+        workflow.add_edge(START, "generate_final")
+        workflow.add_edge("generate_final", END)
+        return workflow.compile()
 
     def call_model(state: AgentState) -> dict:
         messages = state["messages"]
-        llm = get_llm(temperature=temperature)
-        llm_with_tools = llm.bind_tools(tools)
         full_messages = [SystemMessage(content=system_prompt)] + messages
-        response = llm_with_tools.invoke(full_messages)
+        response = invoke_llm(f"{stage}.loop", full_messages, tools=tools)
         return {"messages": [response]}
 
+    budget = get_loop_budget(stage, budget)
+
+    def finish(usage: dict, reason: Optional[str] = None) -> Literal["end"]:
+        if reason is not None:
+            logger.warning("%s: ループ予算の上限（%s）に達したため最終生成に進みます", stage, reason, extra={"stage": stage, **usage})
+        get_loop_budget_metrics().record(stage, reason, **usage)
+        return "end"
+
     def should_continue(state: AgentState) -> Literal["tools", "end"]:
         last_message = state["messages"][-1]
-        if hasattr(last_message, "tool_calls") and last_message.tool_calls:
-            return "tools"
-        return "end"
+        usage = loop_usage(state["messages"])
+        if not (hasattr(last_message, "tool_calls") and last_message.tool_calls):
+            return finish(usage)
+        if usage["tool_calls"] > budget.max_tool_calls:
+            return finish(usage, "tool_calls")
+        logger.info(
+            "%s: ツールを呼び出します", stage,
+            extra={"stage": stage, "tools": [call["name"] for call in last_message.tool_calls]},
+        )
+        return "tools"
+
+    def after_tools(state: AgentState) -> Literal["call_model", "end"]:
+        usage = loop_usage(state["messages"])
+        reason = budget.exhausted(usage)
+        return finish(usage, reason) if reason else "call_model"
 
     tool_node = ToolNode(tools)
 
@@ -52,7 +134,11 @@ def build_tool_agent_graph(
         should_continue,
         {"tools": "tools", "end": "generate_final"},
     )
-    workflow.add_edge("tools", "call_model")
+    workflow.add_conditional_edges(
+        "tools",
+        after_tools,
+        {"call_model": "call_model", "end": "generate_final"},
+    )
     workflow.add_edge("generate_final", END)
 
     return workflow.compile()
\ No newline at end of file
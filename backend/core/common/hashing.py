@@ -0,0 +1,13 @@
+import hashlib
+import json
+from typing import Any
+
+
+def canonical_json(data: Any) -> str:
+    """キー順・空白・数値表現を正規化したJSON文字列を返す（同じ内容なら同じ文字列になる）"""
+    return json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def canonical_hash(data: Any) -> str:
+    """正規化したJSONのSHA-256ハッシュ（16進数64文字）を返す"""
+    return hashlib.sha256(canonical_json(data).encode("utf-8")).hexdigest()
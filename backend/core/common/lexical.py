@@ -0,0 +1,103 @@
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+from langchain_core.documents import Document
+from core.common.db_client import DEFAULT_COLLECTION, load_knowledge_chunks
+
+# 検索対象のコレクションの組 → BM25インデックス
+_bm25_indexes: Dict[Tuple[str, ...], "BM25Index"] = {}
+_bm25_lock = threading.Lock()
+
+# 英数字は単語単位、日本語（かな・カナ・漢字）は文字n-gramで分割する
+_WORD_PATTERN = re.compile(r"[a-z0-9_]+")
+_CJK_PATTERN = re.compile(r"[ぁ-ヿ㐀-鿿々〆ー]+")
+
+
+def analyze(text: str, n: int = 2) -> List[str]:
+    """
+    日本語向けの文字n-gramアナライザ。
+
+    形態素解析器を使わずに「膝痛」「隠れ肥満」のような複合語の部分一致を拾うため、
+    日本語の連続部分は文字n-gramに、英数字は小文字化した単語に分割する。
+
+    Args:
+        text: 解析対象のテキスト
+        n: n-gramの長さ（n文字未満の連続部分はそのまま1トークンとする）
+    """
+    normalized = unicodedata.normalize("NFKC", text).lower()
+
+    tokens = _WORD_PATTERN.findall(normalized)
+    for run in _CJK_PATTERN.findall(normalized):
+        if len(run) < n:
+            tokens.append(run)
+            continue
+        tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+class BM25Index:
+    """チャンク集合に対するインメモリBM25転置インデックス"""
+
+    def __init__(self, documents: List[Document], k1: float = 1.5, b: float = 0.75, ngram: int = 2):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.ngram = ngram
+
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._doc_lengths: List[int] = []
+
+        for doc_id, doc in enumerate(documents):
+            term_freqs = Counter(analyze(doc.page_content, ngram))
+            self._doc_lengths.append(sum(term_freqs.values()))
+            for term, freq in term_freqs.items():
+                self._postings.setdefault(term, []).append((doc_id, freq))
+
+        n_docs = len(documents)
+        self._avgdl = (sum(self._doc_lengths) / n_docs) if n_docs else 0.0
+        self._idf = {
+            term: math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[Document, float]]:
+        """
+        BM25スコア上位k件を返す。
+
+        Args:
+            query: 検索クエリ
+            k: 返す結果数
+
+        Returns:
+            (Document, スコア) のリスト（スコア降順、スコア0の文書は含まない）
+        """
+        scores: Dict[int, float] = {}
+        for term, query_freq in Counter(analyze(query, self.ngram)).items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            for doc_id, freq in postings:
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / self._avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + query_freq * idf * freq * (self.k1 + 1) / (freq + norm)
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.documents[doc_id], score) for doc_id, score in top]
+
+
+def get_bm25_index(collections: Sequence[str] = (DEFAULT_COLLECTION,)) -> BM25Index:
+    """
+    コレクションの組ごとのスレッドセーフなシングルトンBM25インデックスを取得（埋め込みAPIは使用しない）。
+
+    複数のコレクションを指定した場合は、それらのチャンクをまとめた1つのインデックスを作る
+    （IDFを検索対象のチャンクだけで計算するため、スコアをそのまま比較できる）。
+    """
+    key = tuple(collections)
+    with _bm25_lock:
+        if key not in _bm25_indexes:
+            _bm25_indexes[key] = BM25Index([chunk for collection in key for chunk in load_knowledge_chunks(collection)])
+        return _bm25_indexes[key]
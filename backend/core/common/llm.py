@@ -1,21 +1,155 @@
+import json
+import logging
 import os
+import time
+from typing import Any, Callable, List, Optional, Type
+from pydantic import BaseModel
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from core.common.config import load_config
+from core.common.metrics import record_call, get_llm_metrics
+from core.common.resilience import guarded_call, MIN_HEDGE_SAMPLES
+
+logger = logging.getLogger(__name__)
 
 # Ensure config is loaded
 load_config()
 
-def get_llm(model: str = "gemini-3-flash-preview", temperature: float = 0.5) -> ChatGoogleGenerativeAI:
+DEFAULT_MODEL = "gemini-3-flash-preview"
+EMBEDDING_MODEL = "gemini-embedding-001"
+# 構造化出力の検証に失敗した場合にのみ使う上位モデル
+ESCALATION_MODEL = "gemini-3-pro-preview"
+
+# 処理段階ごとのモデルとパラメータ。環境変数 LLM_ROUTES のJSONで段階ごとに上書きできる
+# 例: LLM_ROUTES='{"analyzer.loop": {"model": "gemini-2.5-flash-lite"}}'
+# timeout: 1回の呼び出しのタイムアウト（秒、既定は LLM_CALL_TIMEOUT）
+# hedge: true の場合、p95レイテンシを過ぎても応答が無ければ同じ呼び出しをもう1件送る
+DEFAULT_ROUTES = {
+    "analyzer.loop": {"model": DEFAULT_MODEL, "temperature": 0.5},
+    "analyzer.final": {"model": DEFAULT_MODEL, "temperature": 0.5, "escalate_to": ESCALATION_MODEL},
+    "planner.loop": {"model": DEFAULT_MODEL, "temperature": 0.3},
+    "planner.final": {"model": DEFAULT_MODEL, "temperature": 0.3, "escalate_to": ESCALATION_MODEL},
+    "planner.edit": {"model": DEFAULT_MODEL, "temperature": 0.3, "escalate_to": ESCALATION_MODEL},
+    "vision.direct": {"model": DEFAULT_MODEL, "temperature": 0},
+    "vision.agentic": {"model": DEFAULT_MODEL},
+    "vision.structure": {"model": DEFAULT_MODEL, "temperature": 0, "escalate_to": ESCALATION_MODEL},
+}
+
+
+def get_route(stage: str) -> dict:
+    """処理段階のモデル・パラメータを取得（DEFAULT_ROUTES に LLM_ROUTES の上書きを適用）"""
+    if stage not in DEFAULT_ROUTES:
+        raise ValueError(f"未定義の処理段階です: {stage}（定義済み: {', '.join(DEFAULT_ROUTES)}）")
+    overrides = json.loads(os.getenv("LLM_ROUTES", "{}"))
+    return {**DEFAULT_ROUTES[stage], **overrides.get(stage, {})}
+
+
+def get_llm(model: str = DEFAULT_MODEL, temperature: float = 0.5, **kwargs) -> ChatGoogleGenerativeAI:
     """Factory function to get an LLM instance"""
     return ChatGoogleGenerativeAI(
         model=model,
         temperature=temperature,
-        api_key=os.getenv("GOOGLE_API_KEY")
+        api_key=os.getenv("GOOGLE_API_KEY"),
+        **kwargs
     )
 
+
+ROUTE_CONTROL_KEYS = ("model", "escalate_to", "timeout", "hedge")
+
+
+def get_llm_for(stage: str, model: Optional[str] = None, **kwargs) -> ChatGoogleGenerativeAI:
+    """処理段階のルートに従ってLLMを取得（model を指定するとルートのモデルだけを差し替える）"""
+    route = get_route(stage)
+    params = {key: value for key, value in route.items() if key not in ROUTE_CONTROL_KEYS}
+    return get_llm(model=model or route["model"], **{**params, **kwargs})
+
+
+def hedge_delay(stage: str, model: str) -> Optional[float]:
+    """ルートでヘッジが有効な場合、直近のp95レイテンシをヘッジ呼び出しまでの待ち時間として返す"""
+    if not get_route(stage).get("hedge"):
+        return None
+    return get_llm_metrics().latency_percentile(stage, model, 0.95, min_samples=MIN_HEDGE_SAMPLES)
+
+
+def _guarded_invoke(stage: str, model: str, build: Callable[[float], Any], prompt):
+    """締め切り・ヘッジ・サーキットブレーカー付きで1回呼び出し、失敗も含めて記録する"""
+    route = get_route(stage)
+    try:
+        return guarded_call(
+            model,
+            lambda timeout: build(timeout).invoke(prompt),
+            timeout=route.get("timeout"),
+            hedge_after=hedge_delay(stage, model),
+        )
+    except Exception:
+        get_llm_metrics().record(stage, model, None, ok=False)
+        raise
+
+
+def invoke_llm(stage: str, messages, tools: Optional[List] = None):
+    """処理段階のルートに従ってLLMを呼び出し、レイテンシとトークン数を記録する（ツール呼び出しループ用）"""
+    model = get_route(stage)["model"]
+
+    def build(timeout):
+        llm = get_llm_for(stage, timeout=timeout)
+        return llm.bind_tools(tools) if tools else llm
+
+    started = time.perf_counter()
+    response = _guarded_invoke(stage, model, build, messages)
+    record_call(stage, model, time.perf_counter() - started, response)
+    return response
+
+
+def invoke_structured(stage: str, schema: Type[BaseModel], prompt, prefix=None) -> BaseModel:
+    """
+    処理段階のルートに従って構造化出力を生成する。
+
+    出力がスキーマの検証に失敗した場合のみ、ルートの escalate_to に指定した上位モデルで
+    1回だけ再試行する。通常は軽量なモデルで処理し、難しい入力のときだけ上位モデルのコストを払う。
+
+    Args:
+        stage: 処理段階（DEFAULT_ROUTES のキー）
+        schema: 出力のPydanticモデル
+        prompt: プロンプト（文字列またはメッセージのリスト）
+        prefix: コンテキストキャッシュに登録して参照する静的プレフィックス（StaticPrefix）
+    """
+    from core.common.context_cache import get_context_cache
+
+    route = get_route(stage)
+    models = [route["model"]] + ([route["escalate_to"]] if route.get("escalate_to") else [])
+
+    error = None
+    for attempt, model in enumerate(models):
+        # キャッシュはモデルごとに登録されるため、エスカレーション先のモデルでは別のハンドルを使う
+        llm_kwargs, messages = get_context_cache().bind(model, prefix, prompt) if prefix else ({}, prompt)
+
+        def build(timeout, model=model, llm_kwargs=llm_kwargs):
+            llm = get_llm_for(stage, model=model, timeout=timeout, **llm_kwargs)
+            return llm.with_structured_output(schema, include_raw=True)
+
+        started = time.perf_counter()
+        output = _guarded_invoke(stage, model, build, messages)
+        parsed = output["parsed"]
+        error = output["parsing_error"]
+        ok = error is None and parsed is not None
+        record_call(stage, model, time.perf_counter() - started, output["raw"], ok=ok, escalated=attempt > 0)
+
+        if ok:
+            return parsed
+        logger.warning("%s: %s の構造化出力が検証に失敗しました: %s", stage, model, error)
+
+    raise error or ValueError(f"{stage}: 構造化出力が生成されませんでした")
+
+
 def get_embeddings() -> GoogleGenerativeAIEmbeddings:
     """Factory function to get Embeddings instance"""
     return GoogleGenerativeAIEmbeddings(
-        model="gemini-embedding-001",
+        model=EMBEDDING_MODEL,
         google_api_key=os.getenv("GOOGLE_API_KEY")
     )
+
+def get_genai_client(timeout: Optional[float] = None):
+    """Factory function to get a Google GenAI SDK client (used for vision calls)"""
+    from google import genai
+    from google.genai import types
+    http_options = types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None
+    return genai.Client(api_key=os.getenv("GOOGLE_API_KEY"), http_options=http_options)
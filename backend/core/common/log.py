@@ -0,0 +1,136 @@
+import atexit
+import contextvars
+import copy
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# 現在のリクエストID。LangGraphのノード・ツール・LLM呼び出しのスレッドにも引き継がれる
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord の標準属性（これ以外の属性は extra で渡された構造化フィールドとして出力する）
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id", "verbose"}
+
+
+@contextmanager
+def bind_request_id(request_id: Optional[str]):
+    """このブロック内のログにリクエストIDを付ける"""
+    token = _request_id.set(request_id)
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def _verbose_sampled(request_id: Optional[str], rate: float) -> bool:
+    """詳細イベントを出力するか（同じリクエストの詳細イベントはまとめて出力・省略する）"""
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    if request_id is None:
+        return random.random() < rate
+    return int(hashlib.sha256(request_id.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF < rate
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    ログを出力したスレッドでリクエストIDを付け、詳細イベント（extra={"verbose": True}）を間引く。
+    LOG_VERBOSE_SAMPLE_RATE（既定は 0.1）の割合のリクエストのみ詳細イベントを出力する。
+    """
+
+    def __init__(self, verbose_sample_rate: Optional[float] = None):
+        super().__init__()
+        if verbose_sample_rate is None:
+            verbose_sample_rate = float(os.getenv("LOG_VERBOSE_SAMPLE_RATE", "0.1"))
+        self.verbose_sample_rate = verbose_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        if getattr(record, "verbose", False):
+            return _verbose_sampled(record.request_id, self.verbose_sample_rate)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1件のJSON（時刻・レベル・ロガー・メッセージ・リクエストID・extra のフィールド）"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """ローカル開発用の1行テキスト（extra のフィールドは key=value で末尾に付ける）"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(
+            f"{key}={value}" for key, value in vars(record).items() if key not in _STANDARD_ATTRIBUTES
+        )
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} [{getattr(record, 'request_id', None) or '-'}] {record.name}: {record.getMessage()}"
+        if fields:
+            line += f" {fields}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    exc_info を残したままレコードをキューに入れる QueueHandler。
+
+    標準の prepare はトレースバックを msg に連結して exc_info を消すため、フォーマッターが
+    例外を "exc" フィールドに分けて出力できない。メッセージの引数の展開のみ呼び出し元のスレッドで行う。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def make_queue_handler() -> logging.Handler:
+    """
+    非同期のログハンドラーを作成する（Django の LOGGING から "()" で指定する）。
+
+    呼び出し元のスレッドはレコードをキューに入れるだけで、標準出力への書き込みは
+    専用のリスナースレッド1つが行う。高負荷時にも書き込みで待たされず、リクエスト間で行が混ざらない。
+    LOG_FORMAT=text でローカル開発用のテキスト形式になる。
+    """
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(TextFormatter() if os.getenv("LOG_FORMAT", "json") == "text" else JsonFormatter())
+
+    handler = StructuredQueueHandler(records)
+    handler.addFilter(RequestContextFilter())
+    listener = logging.handlers.QueueListener(records, stream, respect_handler_level=False)
+    listener.start()
+    # 終了時にキューに残ったレコードを書き出す
+    atexit.register(listener.stop)
+    handler.listener = listener
+    return handler
@@ -0,0 +1,222 @@
+import json
+import os
+import statistics
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# モデルごとの料金の目安（USD / 100万トークン: 入力, 出力）。環境変数 LLM_PRICES のJSONで上書きできる
+MODEL_PRICES = {
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-3-flash-preview": (0.50, 3.00),
+    "gemini-3-pro-preview": (2.00, 12.00),
+}
+# コンテキストキャッシュから読み込んだ入力トークンの料金（通常の入力料金に対する比率）
+CACHED_INPUT_PRICE_RATIO = 0.1
+# パーセンタイル計算に保持する直近のレイテンシ数
+LATENCY_WINDOW = 1000
+
+
+def _model_prices() -> Dict[str, Tuple[float, float]]:
+    overrides = json.loads(os.getenv("LLM_PRICES", "{}"))
+    return {**MODEL_PRICES, **{model: tuple(prices) for model, prices in overrides.items()}}
+
+
+class _StageStats:
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.escalations = 0
+        self.input_tokens = 0
+        self.cached_input_tokens = 0
+        self.output_tokens = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+
+class LLMMetrics:
+    """処理段階・モデルごとのLLM呼び出し回数・レイテンシ・トークン数を集計する（スレッドセーフ）"""
+
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], _StageStats] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        stage: str,
+        model: str,
+        latency: Optional[float],
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        ok: bool = True,
+        escalated: bool = False,
+        cached_input_tokens: int = 0,
+    ) -> None:
+        """
+        LLM呼び出し1回分を記録する
+
+        Args:
+            stage: 呼び出し元の処理段階（例: "planner.final"）
+            model: 使用したモデル
+            latency: 呼び出しにかかった秒数（上流エラーで応答が無かった場合は None）
+            input_tokens: 入力トークン数（キャッシュから読み込んだ分を含む）
+            output_tokens: 出力トークン数
+            ok: 構造化出力の検証に成功したか
+            escalated: 上位モデルへのエスカレーションによる呼び出しか
+            cached_input_tokens: 入力トークンのうちコンテキストキャッシュから読み込んだ数
+        """
+        with self._lock:
+            stats = self._stats.setdefault((stage, model), _StageStats())
+            stats.calls += 1
+            stats.failures += 0 if ok else 1
+            stats.escalations += 1 if escalated else 0
+            stats.input_tokens += input_tokens or 0
+            stats.cached_input_tokens += cached_input_tokens or 0
+            stats.output_tokens += output_tokens or 0
+            if latency is not None:
+                stats.latencies.append(latency)
+
+    def latency_percentile(self, stage: str, model: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """直近のレイテンシのqパーセンタイル（サンプル数が min_samples 未満なら None）"""
+        with self._lock:
+            stats = self._stats.get((stage, model))
+            latencies = sorted(stats.latencies) if stats else []
+        if len(latencies) < min_samples:
+            return None
+        return latencies[int(q * (len(latencies) - 1))]
+
+    def snapshot(self) -> List[dict]:
+        """段階・モデルごとの集計結果（p50/p95レイテンシと推定コストを含む。キャッシュの保存料金は含まない）を返す"""
+        prices = _model_prices()
+        with self._lock:
+            items = [(key, stats, sorted(stats.latencies)) for key, stats in self._stats.items()]
+
+        rows = []
+        for (stage, model), stats, latencies in sorted(items, key=lambda item: item[0]):
+            price = prices.get(model)
+            cost = None
+            if price is not None:
+                uncached = stats.input_tokens - stats.cached_input_tokens
+                cached = stats.cached_input_tokens * CACHED_INPUT_PRICE_RATIO
+                cost = round(((uncached + cached) * price[0] + stats.output_tokens * price[1]) / 1_000_000, 6)
+            rows.append({
+                "stage": stage,
+                "model": model,
+                "calls": stats.calls,
+                "failures": stats.failures,
+                "escalations": stats.escalations,
+                "latency_p50": round(statistics.median(latencies), 3) if latencies else None,
+                "latency_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+                "input_tokens": stats.input_tokens,
+                "cached_input_tokens": stats.cached_input_tokens,
+                "output_tokens": stats.output_tokens,
+                "estimated_cost_usd": cost,
+            })
+        return rows
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+_llm_metrics = LLMMetrics()
+
+
+def get_llm_metrics() -> LLMMetrics:
+    """プロセス全体で共有するLLM呼び出しの集計を取得"""
+    return _llm_metrics
+
+
+def token_usage(message) -> Tuple[int, int, int]:
+    """
+    LangChainのAIMessage（usage_metadata）またはGenAI SDKのレスポンス（usage_metadata）から
+    入力・出力・キャッシュから読み込んだ入力のトークン数を取り出す
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if usage is None:
+        return 0, 0, 0
+    if isinstance(usage, dict):
+        cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0), cached or 0
+    return usage.prompt_token_count or 0, usage.candidates_token_count or 0, usage.cached_content_token_count or 0
+
+
+def record_call(stage: str, model: str, latency: float, message, ok: bool = True, escalated: bool = False) -> None:
+    """レスポンスからトークン数を取り出して呼び出しを記録する"""
+    input_tokens, output_tokens, cached_input_tokens = token_usage(message)
+    _llm_metrics.record(
+        stage, model, latency, input_tokens, output_tokens,
+        ok=ok, escalated=escalated, cached_input_tokens=cached_input_tokens,
+    )
+
+
+class LoopBudgetMetrics:
+    """ツール呼び出しループの実行回数と、予算の上限で打ち切った回数を段階ごとに集計する（スレッドセーフ）"""
+
+    def __init__(self):
+        self._stats: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, reason: Optional[str], iterations: int, tool_calls: int, prompt_tokens: int) -> None:
+        """
+        ループ1回分（最終生成に進んだ時点）を記録する
+
+        Args:
+            stage: 処理段階の接頭辞（例: "planner"）
+            reason: 打ち切った上限（"iterations" / "tool_calls" / "prompt_tokens"）。モデルが自ら終えた場合は None
+            iterations: ループ内のモデル呼び出し回数
+            tool_calls: 実行を要求されたツール呼び出しの数
+            prompt_tokens: ループ内のモデル呼び出しの入力トークン数の合計
+        """
+        with self._lock:
+            stats = self._stats.setdefault(stage, {"runs": 0, "exhausted": {}, "iterations": 0, "tool_calls": 0, "prompt_tokens": 0})
+            stats["runs"] += 1
+            if reason is not None:
+                stats["exhausted"][reason] = stats["exhausted"].get(reason, 0) + 1
+            stats["iterations"] += iterations
+            stats["tool_calls"] += tool_calls
+            stats["prompt_tokens"] += prompt_tokens
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            items = sorted((stage, dict(stats, exhausted=dict(stats["exhausted"]))) for stage, stats in self._stats.items())
+
+        rows = []
+        for stage, stats in items:
+            exhausted = sum(stats["exhausted"].values())
+            rows.append({
+                "stage": stage,
+                "runs": stats["runs"],
+                "exhausted": exhausted,
+                "exhausted_ratio": round(exhausted / stats["runs"], 3),
+                "exhausted_by": stats["exhausted"],
+                "avg_iterations": round(stats["iterations"] / stats["runs"], 2),
+                "avg_tool_calls": round(stats["tool_calls"] / stats["runs"], 2),
+                "avg_prompt_tokens": round(stats["prompt_tokens"] / stats["runs"]),
+            })
+        return rows
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+_loop_budget_metrics = LoopBudgetMetrics()
+
+
+def get_loop_budget_metrics() -> LoopBudgetMetrics:
+    """プロセス全体で共有するツール呼び出しループの集計を取得"""
+    return _loop_budget_metrics
+
+
+def summarize(rows: Optional[List[dict]] = None) -> dict:
+    """全段階の合計（呼び出し数・トークン数・推定コスト）"""
+    rows = _llm_metrics.snapshot() if rows is None else rows
+    return {
+        "calls": sum(row["calls"] for row in rows),
+        "escalations": sum(row["escalations"] for row in rows),
+        "input_tokens": sum(row["input_tokens"] for row in rows),
+        "cached_input_tokens": sum(row["cached_input_tokens"] for row in rows),
+        "output_tokens": sum(row["output_tokens"] for row in rows),
+        "estimated_cost_usd": round(sum(row["estimated_cost_usd"] or 0 for row in rows), 6),
+    }
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from core.common.config import get_data_dir
+
+# 書き出し先の既定ディレクトリ（環境変数 KNOWLEDGE_INDEX_DIR で変更できる）
+DEFAULT_INDEX_DIR = get_data_dir() / "knowledge_index"
+INDEX_FORMAT_VERSION = 1
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.json"
+MANIFEST_FILE = "manifest.json"
+
+
+def file_sha256(path: Path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def _replace_atomically(path: Path, write: Callable[[Path], None]) -> None:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_index(
+    index_dir: Path,
+    ids: Sequence[str],
+    texts: Sequence[str],
+    metadatas: Sequence[dict],
+    embeddings,
+    source_sha256: Optional[str] = None,
+    embedding_model: Optional[str] = None,
+) -> Path:
+    """
+    チャンクと埋め込み行列を読み取り専用の索引として書き出す。
+
+    埋め込みはL2正規化したfloat32の .npy（内積=コサイン類似度）、チャンクはJSONで保存し、
+    最後に manifest.json を置き換える（読み込み側は manifest の件数で整合性を確認する）。
+
+    Args:
+        index_dir: 書き出し先ディレクトリ
+        ids: チャンクID
+        texts: チャンク本文
+        metadatas: チャンクのメタデータ（見出しなど）
+        embeddings: 埋め込み行列（件数 × 次元）
+        source_sha256: 元のナレッジファイルのハッシュ（古い索引の検出用）
+        embedding_model: 埋め込みモデル名
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim != 2 or not len(ids) == len(texts) == len(metadatas) == matrix.shape[0]:
+        raise ValueError(f"チャンク数と埋め込み行列の形状が一致しません: {len(ids)}件, {matrix.shape}")
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = np.ascontiguousarray(matrix / np.where(norms == 0, 1, norms))
+
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+
+    def write_embeddings(path):
+        with open(path, "wb") as f:
+            np.save(f, matrix)
+
+    def write_json(data):
+        return lambda path: path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+    _replace_atomically(index_dir / EMBEDDINGS_FILE, write_embeddings)
+    _replace_atomically(index_dir / CHUNKS_FILE, write_json({
+        "ids": list(ids),
+        "texts": list(texts),
+        "metadatas": [metadata or {} for metadata in metadatas],
+    }))
+    _replace_atomically(index_dir / MANIFEST_FILE, write_json({
+        "format_version": INDEX_FORMAT_VERSION,
+        "count": matrix.shape[0],
+        "dimension": matrix.shape[1],
+        "embedding_model": embedding_model,
+        "source_sha256": source_sha256,
+    }))
+    return index_dir
+
+
+class MmapVectorIndex:
+    """
+    write_index で書き出した索引をメモリマップで開く読み取り専用のベクトル索引。
+
+    埋め込み行列はページキャッシュ上の同じ物理ページを全ワーカープロセスで共有するため、
+    ワーカー数を増やしてもプロセスごとのメモリは増えず、起動時の読み込みも行わない。
+    Chroma と同じ similarity_search / max_marginal_relevance_search を持つ。
+    """
+
+    def __init__(self, index_dir: Path, embedding_function=None):
+        index_dir = Path(index_dir)
+        self.manifest = json.loads((index_dir / MANIFEST_FILE).read_text(encoding="utf-8"))
+        if self.manifest.get("format_version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"未対応の索引フォーマットです: {self.manifest.get('format_version')}")
+
+        self.embeddings = np.load(index_dir / EMBEDDINGS_FILE, mmap_mode="r")
+        chunks = json.loads((index_dir / CHUNKS_FILE).read_text(encoding="utf-8"))
+        self.ids = chunks["ids"]
+        self.texts = chunks["texts"]
+        self.metadatas = chunks["metadatas"]
+        if not self.manifest["count"] == len(self.ids) == self.embeddings.shape[0]:
+            raise ValueError(f"索引ファイルの件数が一致しません（書き出し中の可能性があります）: {index_dir}")
+
+        self.embedding_function = embedding_function
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _document(self, i: int) -> Document:
+        return Document(id=self.ids[i], page_content=self.texts[i], metadata=self.metadatas[i])
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self._embed_query(query)
+
+    def candidates_by_vector(self, embedding, k: int) -> Tuple[List[Document], np.ndarray]:
+        """類似度上位 k 件の文書とその埋め込み行列（複数の索引の候補をまとめて選び直す場合に使う）"""
+        if not len(self):
+            return [], np.empty((0, self.embeddings.shape[1]), dtype=np.float32)
+        vector = np.asarray(embedding, dtype=np.float32)
+        top = self._top_k(vector / (np.linalg.norm(vector) or 1), k)
+        return [self._document(i) for i in top], np.asarray(self.embeddings[top])
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        if self.embedding_function is None:
+            raise ValueError("クエリの埋め込みには embedding_function が必要です")
+        vector = np.asarray(self.embedding_function.embed_query(query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1)
+
+    def _top_k(self, vector: np.ndarray, k: int) -> np.ndarray:
+        scores = self.embeddings @ vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4) -> List[Document]:
+        if not len(self):
+            return []
+        vector = np.asarray(embedding, dtype=np.float32)
+        return [self._document(i) for i in self._top_k(vector / (np.linalg.norm(vector) or 1), k)]
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return self.similarity_search_by_vector(self._embed_query(query), k=k)
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+    ) -> List[Document]:
+        """類似度上位 fetch_k 件からMMRで k 件を選ぶ（Chroma の同名メソッドと同じ選び方）"""
+        from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+        if not len(self):
+            return []
+        vector = self._embed_query(query)
+        candidates = self._top_k(vector, fetch_k)
+        selected = maximal_marginal_relevance(
+            vector, np.asarray(self.embeddings[candidates]), lambda_mult=lambda_mult, k=k
+        )
+        return [self._document(candidates[i]) for i in selected]
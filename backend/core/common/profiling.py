@@ -0,0 +1,197 @@
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from core.common.config import BACKEND_DIR
+
+DEFAULT_PROFILE_DIR = BACKEND_DIR / "data" / "profiles"
+DEFAULT_MAX_PROFILES = 100
+DEFAULT_INTERVAL_SECONDS = 0.01
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]+-[A-Za-z0-9._-]+$")
+
+# 現在のリクエストのプロファイル。LLM呼び出しのスレッドもこのプロファイルにサンプルを追加する
+_active_profile: contextvars.ContextVar[Optional["Profile"]] = contextvars.ContextVar("active_profile", default=None)
+
+
+class Profile:
+    """1件のリクエストのスタックサンプル（折りたたみ形式のスタック → サンプル数）"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+    def folded(self) -> str:
+        """flamegraph.pl / speedscope で読み込める折りたたみ形式（"a;b;c 件数" を1行1スタック）"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    for prefix in (str(BACKEND_DIR) + os.sep, "site-packages" + os.sep):
+        if prefix in filename:
+            filename = filename.split(prefix, 1)[1]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _fold(thread_name: str, frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    # スレッドプールの番号（llm-call_3 など）は除き、同じ種類のスレッドを1本にまとめる
+    labels.append(re.sub(r"[_-]\d+$", "", thread_name))
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """
+    登録されたスレッドのスタックを interval 秒ごとに記録するサンプリングプロファイラー。
+
+    専用スレッドが sys._current_frames() を読むだけで、対象のスレッドには計測コードが入らない。
+    待機中のスレッドも記録するため、CPU時間ではなく経過時間（LLMの応答待ちを含む）の内訳になる。
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL_SECONDS):
+        self.interval = interval
+        self._targets: Dict[int, Profile] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._targets:
+                    continue
+                frames = sys._current_frames()
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, profile in self._targets.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        profile.stacks[_fold(names.get(ident, "thread"), frame)] += 1
+                        profile.samples += 1
+
+    @contextmanager
+    def attach(self, profile: Profile):
+        """このブロックの間、現在のスレッドのスタックを profile に記録する"""
+        ident = threading.get_ident()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+            previous = self._targets.get(ident)
+            self._targets[ident] = profile
+        try:
+            yield
+        finally:
+            with self._lock:
+                if previous is None:
+                    self._targets.pop(ident, None)
+                else:
+                    self._targets[ident] = previous
+
+
+_profiler: Optional[SamplingProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> SamplingProfiler:
+    """プロセス全体で共有するプロファイラーを取得（間隔は PROFILE_INTERVAL_MS）"""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            interval_ms = os.getenv("PROFILE_INTERVAL_MS")
+            _profiler = SamplingProfiler(float(interval_ms) / 1000 if interval_ms else DEFAULT_INTERVAL_SECONDS)
+        return _profiler
+
+
+@contextmanager
+def profile_block():
+    """ブロックの間、現在のスレッドと、ここから呼び出すLLM呼び出しのスレッドをプロファイルする"""
+    profiler = get_profiler()
+    profile = Profile(profiler.interval)
+    token = _active_profile.set(profile)
+    try:
+        with profiler.attach(profile):
+            yield profile
+    finally:
+        _active_profile.reset(token)
+
+
+def attach_current_thread():
+    """呼び出し元がプロファイル中であれば、現在のスレッドも同じプロファイルに記録する"""
+    profile = _active_profile.get()
+    return get_profiler().attach(profile) if profile is not None else nullcontext()
+
+
+class ProfileStore:
+    """プロファイル（.folded）とメタデータ（.json）を保存するディレクトリ。新しい max_profiles 件のみ残す"""
+
+    def __init__(self, directory: Path, max_profiles: int = DEFAULT_MAX_PROFILES):
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def save(self, profile: Profile, metadata: dict) -> str:
+        """保存してIDを返す（IDは時刻順に並ぶ）"""
+        request_id = re.sub(r"[^A-Za-z0-9._-]", "_", metadata.get("request_id") or "request")
+        profile_id = f"{time.time_ns() // 1000}-{request_id[:40]}"
+        metadata = {
+            "id": profile_id,
+            "created_at": round(time.time(), 3),
+            "samples": profile.samples,
+            "interval_ms": round(profile.interval * 1000, 3),
+            **metadata,
+        }
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            (self.directory / f"{profile_id}.folded").write_text(profile.folded(), encoding="utf-8")
+            (self.directory / f"{profile_id}.json").write_text(json.dumps(metadata, ensure_ascii=False), encoding="utf-8")
+            for old in sorted(self.directory.glob("*.json"))[:-self.max_profiles]:
+                old.unlink(missing_ok=True)
+                old.with_suffix(".folded").unlink(missing_ok=True)
+        return profile_id
+
+    def recent(self, limit: int = 50) -> List[dict]:
+        """新しい順のメタデータ"""
+        if not self.directory.is_dir():
+            return []
+        entries = []
+        for path in sorted(self.directory.glob("*.json"), reverse=True)[:limit]:
+            try:
+                entries.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def folded_path(self, profile_id: str) -> Optional[Path]:
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = self.directory / f"{profile_id}.folded"
+        return path if path.is_file() else None
+
+
+_store: Optional[ProfileStore] = None
+_store_lock = threading.Lock()
+
+
+def get_profile_store() -> ProfileStore:
+    """プロファイルの保存先を取得（PROFILE_DIR / PROFILE_MAX_FILES）"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProfileStore(
+                Path(os.getenv("PROFILE_DIR", DEFAULT_PROFILE_DIR)),
+                int(os.getenv("PROFILE_MAX_FILES", DEFAULT_MAX_PROFILES)),
+            )
+        return _store
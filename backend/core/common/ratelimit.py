@@ -0,0 +1,35 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    スレッドセーフなトークンバケット方式のレートリミッター。
+
+    rate件/秒でトークンが補充され、最大burst件まで連続して取得できる。
+    プロセス内の全リクエストで1つのインスタンスを共有することで、上流APIへの呼び出し頻度を全体で制限する。
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """トークンを1つ取得するまで待機し、待機した秒数を返す"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
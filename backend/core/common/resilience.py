@@ -0,0 +1,240 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from core.common.profiling import attach_current_thread
+
+logger = logging.getLogger(__name__)
+
+# 現在のリクエストの締め切り（time.monotonic() の絶対時刻）。LangGraphのノードにも引き継がれる
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+# 1回のLLM呼び出しのタイムアウト（秒）の既定値
+DEFAULT_CALL_TIMEOUT = 60.0
+# p95の推定に必要な最小サンプル数（これ未満ではヘッジしない）
+MIN_HEDGE_SAMPLES = 20
+
+_call_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+    thread_name_prefix="llm-call",
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """リクエストまたは呼び出しの締め切りを過ぎた"""
+
+
+class CircuitOpenError(RuntimeError):
+    """上流のエラー率が高いため、呼び出しを行わずに失敗させた"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} への呼び出しを一時停止しています（{retry_after:.0f}秒後に再試行可能）")
+        self.retry_after = retry_after
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    このブロック内（LangGraphのノードを含む）のLLM呼び出しに締め切りを設定する。
+    外側に締め切りがある場合は早い方を使う。
+    """
+    expires_at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(expires_at if outer is None else min(outer, expires_at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """現在の締め切りまでの残り秒数（締め切りが無い場合は None）"""
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return max(0.0, expires_at - time.monotonic())
+
+
+def call_timeout(timeout: Optional[float] = None) -> float:
+    """1回の呼び出しに使えるタイムアウト（呼び出し単位の上限とリクエストの残り時間の小さい方）"""
+    timeout = timeout or float(os.getenv("LLM_CALL_TIMEOUT", DEFAULT_CALL_TIMEOUT))
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("リクエストの締め切りを過ぎています")
+    return timeout if left is None else min(timeout, left)
+
+
+class CircuitBreaker:
+    """
+    直近 window 秒のエラー率が failure_ratio を超えたら open になり、cooldown 秒の間は
+    上流を呼ばずに CircuitOpenError で失敗させる。cooldown 後は1件だけ試行（half-open）し、
+    成功すれば closed に戻る。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_ratio: float = 0.5,
+        min_calls: int = 10,
+        window: float = 60.0,
+        cooldown: float = 30.0,
+    ):
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self._results: deque = deque()
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "open" if now - self._opened_at < self.cooldown else "half-open"
+
+    def before_call(self) -> None:
+        """呼び出し前に確認し、open（またはhalf-openで試行中）なら CircuitOpenError を送出する"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == "open":
+                raise CircuitOpenError(self.name, self.cooldown - (now - self._opened_at))
+            if state == "half-open":
+                if self._probing:
+                    raise CircuitOpenError(self.name, self.cooldown)
+                self._probing = True
+
+    def release(self) -> None:
+        """結果を記録せずに試行を終える（リクエスト側の締め切りなど、上流の成否が分からない場合）"""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok: bool) -> None:
+        """呼び出し結果を記録し、必要に応じて状態を遷移させる"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state(now) == "half-open":
+                self._probing = False
+                self._opened_at = None if ok else now
+                self._results.clear()
+                return
+
+            self._results.append((now, ok))
+            while self._results and now - self._results[0][0] > self.window:
+                self._results.popleft()
+
+            failures = sum(1 for _, result in self._results if not result)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_ratio:
+                logger.warning("%s: エラー率 %d/%d のため呼び出しを一時停止します", self.name, failures, len(self._results))
+                self._opened_at = now
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """上流（モデル）ごとのサーキットブレーカーを取得"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_ratio=float(os.getenv("LLM_CIRCUIT_FAILURE_RATIO", "0.5")),
+                min_calls=int(os.getenv("LLM_CIRCUIT_MIN_CALLS", "10")),
+                cooldown=float(os.getenv("LLM_CIRCUIT_COOLDOWN_SECONDS", "30")),
+            )
+        return _breakers[name]
+
+
+def guarded_call(
+    name: str,
+    fn: Callable[[float], Any],
+    timeout: Optional[float] = None,
+    hedge_after: Optional[float] = None,
+) -> Any:
+    """
+    締め切り・ヘッジ・サーキットブレーカー付きで上流を呼び出す。
+
+    fn はタイムアウト秒を受け取り、クライアント側のタイムアウトにも同じ値を設定する
+    （締め切り後に呼び出しを放棄したスレッドがいつまでも残らないようにするため）。
+
+    Args:
+        name: サーキットブレーカーの単位（モデル名）
+        fn: 呼び出し本体（引数はタイムアウト秒）
+        timeout: 呼び出し単位のタイムアウト（省略時は LLM_CALL_TIMEOUT）
+        hedge_after: この秒数で応答が無ければ同じ呼び出しをもう1件送り、先に完了した方を使う
+    """
+    limit = timeout or float(os.getenv("LLM_CALL_TIMEOUT", DEFAULT_CALL_TIMEOUT))
+    # 締め切りを過ぎている場合はブレーカーの試行枠を使う前に失敗させる
+    budget = call_timeout(limit)
+    # リクエストの残り時間で打ち切る場合、応答が無くても上流の失敗としては数えない
+    request_bound = budget < limit
+    expires_at = time.monotonic() + budget
+
+    breaker = get_circuit_breaker(name)
+    breaker.before_call()
+
+    def run():
+        # 実行枠の待ち行列にいた時間を差し引く（締め切り後に取り出された呼び出しは実行しない）
+        left = expires_at - time.monotonic()
+        if left <= 0:
+            raise DeadlineExceeded(f"{name} の呼び出しが実行前に締め切りを過ぎました")
+        # 呼び出し元のリクエストをプロファイル中であれば、呼び出しのスレッドも記録する
+        with attach_current_thread():
+            return fn(left)
+
+    def submit():
+        context = contextvars.copy_context()
+        return _call_executor.submit(context.run, run)
+
+    futures = []
+    ok = None
+    try:
+        futures.append(submit())
+        if hedge_after is not None and hedge_after < budget:
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done:
+                logger.info("%s: %.1f秒以内に応答が無いためヘッジ呼び出しを送ります", name, hedge_after)
+                futures.append(submit())
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, expires_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    ok = True
+                    return future.result()
+                error = future.exception()
+
+        if error is not None:
+            # 実行前に締め切りを過ぎた呼び出しは上流に届いていないため数えない
+            if not isinstance(error, DeadlineExceeded):
+                ok = False
+            raise error
+        if not request_bound:
+            ok = False
+        raise DeadlineExceeded(f"{name} が{budget:.1f}秒以内に応答しませんでした")
+    finally:
+        # 待ち行列に残っている呼び出しは実行しない（実行中のものはクライアント側のタイムアウトで終わる）
+        for future in futures:
+            future.cancel()
+        if ok is None:
+            breaker.release()
+        else:
+            breaker.record(ok)
@@ -1,31 +1,228 @@
+import contextvars
+import logging
+import os
 import threading
-from typing import List
-from core.common.db_client import get_vectorstore
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from core.common.db_client import DEFAULT_COLLECTION, KNOWLEDGE_COLLECTIONS, get_vector_index
+from core.common.lexical import get_bm25_index
+
+logger = logging.getLogger(__name__)
 
 _retriever_lock = threading.Lock()
+_vector_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="knowledge-search")
+
+SEARCH_BACKENDS = ("vector", "bm25", "hybrid")
+
+# Reciprocal Rank Fusion の平滑化定数（Cormack et al. の推奨値）
+RRF_K = 60
+
 
+def _embed_query(index, query: str):
+    # メモリマップ索引は embed_query、Chroma は embeddings（埋め込み関数）でクエリを埋め込む
+    embed = getattr(index, "embed_query", None) or index.embeddings.embed_query
+    return embed(query)
 
-def search_knowledge(query: str, k: int = 3, fetch_k: int = 10, lambda_mult: float = 0.5) -> str:
+
+def _candidates(index, vector, fetch_k: int) -> Tuple[List[Document], np.ndarray]:
     """
-    ナレッジベースからMMR検索を実行し、フォーマット済みテキストを返す。
+    索引から類似度上位 fetch_k 件の文書とその埋め込み行列を取得する。
 
-    Args:
-        query: 検索クエリ
-        k: 返す結果数
-        fetch_k: MMRの候補数
-        lambda_mult: MMRの多様性パラメータ（0=多様性重視, 1=類似度重視）
+    Chroma は公開APIのみを使い、類似度検索で候補を選んでから get(ids) で候補の埋め込みを取得する
+    （get は ids の順に返すとは限らないため、IDで対応付ける）。
+    """
+    if hasattr(index, "candidates_by_vector"):
+        return index.candidates_by_vector(vector, fetch_k)
+    docs = [doc for doc, _ in index.similarity_search_by_vector_with_relevance_scores(vector, k=fetch_k)]
+    if not docs:
+        return [], np.empty((0, len(vector)), dtype=np.float32)
+    records = index.get(ids=[doc.id for doc in docs], include=["embeddings"])
+    embeddings = dict(zip(records["ids"], records["embeddings"]))
+    return docs, np.asarray([embeddings[doc.id] for doc in docs], dtype=np.float32)
+
+
+def _vector_candidates(query: str, fetch_k: int, collections: Sequence[str]) -> Tuple[np.ndarray, List[Document], np.ndarray]:
+    """
+    検索対象のコレクションをまとめて1つの索引として扱い、類似度上位 fetch_k 件の候補を返す。
+
+    クエリの埋め込みは1回だけ計算し、各コレクションの候補をコサイン類似度で選び直す
+    （同じ埋め込みモデルのため、コレクションが異なっても類似度をそのまま比較できる）。
+
+    Returns:
+        (正規化したクエリベクトル, 類似度の高い順の文書, 各文書の正規化済み埋め込み行列)
     """
     with _retriever_lock:
-        vectorstore = get_vectorstore()
-        retriever = vectorstore.as_retriever(
-            search_type="mmr",
-            search_kwargs={"k": k, "fetch_k": fetch_k, "lambda_mult": lambda_mult},
-        )
-        results = retriever.invoke(query)
+        indexes = [get_vector_index(collection) for collection in collections]
+    vector = np.asarray(_embed_query(indexes[0], query), dtype=np.float32)
+    vector = vector / (np.linalg.norm(vector) or 1)
+
+    with _retriever_lock:
+        docs, matrices = [], []
+        for index in indexes:
+            index_docs, embeddings = _candidates(index, vector.tolist(), fetch_k)
+            docs.extend(index_docs)
+            matrices.append(embeddings)
+
+    if not docs:
+        return vector, [], np.empty((0, len(vector)), dtype=np.float32)
+    matrix = np.vstack(matrices)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1, norms)
+    top = np.argsort(-(matrix @ vector), kind="stable")[:fetch_k]
+    return vector, [docs[i] for i in top], matrix[top]
+
+
+def _vector_search(
+    query: str,
+    k: int,
+    fetch_k: int,
+    lambda_mult: float,
+    collections: Sequence[str] = (DEFAULT_COLLECTION,),
+) -> List[Document]:
+    """類似度上位 fetch_k 件の候補からMMRで k 件を選ぶ"""
+    from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+    vector, docs, embeddings = _vector_candidates(query, fetch_k, collections)
+    if not docs:
+        return []
+    return [docs[i] for i in maximal_marginal_relevance(vector, embeddings, lambda_mult=lambda_mult, k=k)]
+
+
+def _similarity_search(query: str, k: int, collections: Sequence[str] = (DEFAULT_COLLECTION,)) -> List[Document]:
+    return _vector_candidates(query, k, collections)[1]
+
+
+def _lexical_search(query: str, k: int, collections: Sequence[str] = (DEFAULT_COLLECTION,)) -> List[Document]:
+    return [doc for doc, _ in get_bm25_index(collections).search(query, k=k)]
+
+
+def _section_key(doc: Document) -> str:
+    return doc.metadata.get("Header 2") or doc.metadata.get("Header 1") or doc.page_content
+
 
+def reciprocal_rank_fusion(rankings: List[List[Document]], rrf_k: int = RRF_K) -> List[Document]:
+    """
+    複数のランキングをReciprocal Rank Fusionで統合する。
+
+    各文書のスコアは Σ 1 / (rrf_k + 順位) で、スコアの尺度が異なる検索結果
+    （BM25スコアとコサイン類似度）をそのまま比較せずに統合できる。
+    同一チャンクの判定には本文を用いる。
+    """
+    scores = {}
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            scores[doc.page_content] = scores.get(doc.page_content, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(doc.page_content, doc)
+
+    return [docs[content] for content in sorted(scores, key=scores.get, reverse=True)]
+
+
+def _diversify(ranked: List[Document], k: int) -> List[Document]:
+    """同じ見出しセクションのチャンクが上位を占めないよう、まず各セクション1件ずつ選ぶ"""
+    selected = []
+    seen_sections = set()
+    for doc in ranked:
+        if _section_key(doc) not in seen_sections:
+            selected.append(doc)
+            seen_sections.add(_section_key(doc))
+        if len(selected) == k:
+            return selected
+
+    for doc in ranked:
+        if doc not in selected:
+            selected.append(doc)
+        if len(selected) == k:
+            break
+    return selected
+
+
+def _hybrid_search(
+    query: str,
+    k: int,
+    fetch_k: int,
+    timeout: float,
+    collections: Sequence[str] = (DEFAULT_COLLECTION,),
+) -> List[Document]:
+    """ベクトル検索をバックグラウンドで実行しつつBM25検索を行い、RRFで統合する"""
+    # ログのリクエストIDを引き継ぐため、呼び出し元のコンテキストで実行する
+    future = _vector_executor.submit(contextvars.copy_context().run, _similarity_search, query, fetch_k, collections)
+    lexical_results = _lexical_search(query, fetch_k, collections)
+
+    try:
+        vector_results = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        logger.warning("ベクトル検索が%s秒以内に完了しなかったため、BM25の結果のみを使用します", timeout)
+        vector_results = []
+    except Exception as e:
+        logger.warning("ベクトル検索に失敗したため、BM25の結果のみを使用します: %s", e)
+        vector_results = []
+
+    return _diversify(reciprocal_rank_fusion([lexical_results, vector_results]), k)
+
+
+def _format_results(query: str, results: List[Document]) -> str:
     if not results:
         return f"「{query}」に関する専門知識は見つかりませんでした。"
 
     return "\n\n".join(
         f"【結果{i}】\n{doc.page_content}" for i, doc in enumerate(results, 1)
-    )
\ No newline at end of file
+    )
+
+
+def search_knowledge(
+    query: str,
+    k: int = 3,
+    fetch_k: int = 10,
+    lambda_mult: float = 0.5,
+    backend: Optional[str] = None,
+    collections: Sequence[str] = (DEFAULT_COLLECTION,),
+) -> str:
+    """
+    ナレッジベースを検索し、フォーマット済みテキストを返す。
+
+    backend="vector" では埋め込みによるMMR検索を行い、埋め込みAPIがエラーになるか
+    KNOWLEDGE_SEARCH_TIMEOUT秒以内に応答しない場合はBM25検索にフォールバックする。
+    backend="bm25" では外部APIを呼ばずにインメモリBM25インデックスのみで検索する。
+    backend="hybrid" ではBM25検索とベクトル検索を並行実行し、RRFで統合した上で
+    見出しセクションが重複しないよう多様化する。
+    複数のコレクションを指定した場合は、それらをまとめた1つの索引として検索する。
+
+    Args:
+        query: 検索クエリ
+        k: 返す結果数
+        fetch_k: MMR/hybridの候補数
+        lambda_mult: MMRの多様性パラメータ（0=多様性重視, 1=類似度重視）
+        backend: 検索バックエンド（省略時は環境変数 KNOWLEDGE_SEARCH_BACKEND、既定は "vector"）
+        collections: 検索するコレクション（KNOWLEDGE_COLLECTIONS のキー。既定はナレッジ全体）
+    """
+    backend = backend or os.getenv("KNOWLEDGE_SEARCH_BACKEND", "vector")
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError(f"未対応の検索バックエンドです: {backend}（対応: {', '.join(SEARCH_BACKENDS)}）")
+    unknown = [collection for collection in collections if collection not in KNOWLEDGE_COLLECTIONS]
+    if not collections or unknown:
+        raise ValueError(f"未対応のコレクションです: {unknown}（対応: {', '.join(KNOWLEDGE_COLLECTIONS)}）")
+    collections = tuple(collections)
+
+    if backend == "bm25":
+        return _format_results(query, _lexical_search(query, k, collections))
+
+    timeout = float(os.getenv("KNOWLEDGE_SEARCH_TIMEOUT", "5"))
+    if backend == "hybrid":
+        return _format_results(query, _hybrid_search(query, k, fetch_k, timeout, collections))
+
+    future = _vector_executor.submit(
+        contextvars.copy_context().run, _vector_search, query, k, fetch_k, lambda_mult, collections
+    )
+    try:
+        results = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        logger.warning("ベクトル検索が%s秒以内に完了しなかったため、BM25検索にフォールバックします", timeout)
+        results = _lexical_search(query, k, collections)
+    except Exception as e:
+        logger.warning("ベクトル検索に失敗したため、BM25検索にフォールバックします: %s", e)
+        results = _lexical_search(query, k, collections)
+
+    return _format_results(query, results)
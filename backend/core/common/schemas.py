@@ -0,0 +1,37 @@
+from typing import List
+from pydantic import BaseModel, Field
+
+# --- Pydantic Models for Structured Output ---
+
+class Exercise(BaseModel):
+    target_area: str = Field(description="対象部位（胸、背中、脚など）")
+    exercise_name: str = Field(description="種目名")
+    sets: int = Field(description="セット数")
+    reps: str = Field(description="レップ数（例: '8-12'）")
+    interval_seconds: int = Field(default=60, description="セット間休憩時間（秒）（例: 30, 60, 90）")
+    notes: str = Field(default="", description="実施時の注意点")
+    instructions: List[str] = Field(default=[], description="動作手順のステップリスト")
+
+class DayPlan(BaseModel):
+    day_label: str = Field(description="曜日ラベル（例: 'Day 1', '月曜日'）")
+    focus: str = Field(description="その日のトレーニングの焦点")
+    exercises: List[Exercise] = Field(description="種目リスト")
+
+class TrainingPlan(BaseModel):
+    split_method: str = Field(description="分割法（全身法、上下分割など）")
+    split_rationale: str = Field(description="この分割法を選んだ理由")
+    weekly_schedule: List[DayPlan] = Field(description="週間スケジュール")
+    modifications: List[str] = Field(description="リスクに基づく種目変更・代替案")
+    priority_points: List[str] = Field(description="優先的に取り組むべきポイント")
+    nutrition_tips: List[str] = Field(description="栄養に関するアドバイス")
+
+class AnalysisResult(BaseModel):
+    """InBody分析結果の構造化出力モデル（分析専用）"""
+    body_type: str = Field(description="体型タイプ（筋肉質型/標準型/隠れ肥満型/肥満型/痩せ型）")
+    body_fat_evaluation: str = Field(description="体脂肪率の評価（低い/標準/軽度肥満/肥満）と数値根拠")
+    skeletal_muscle_evaluation: str = Field(description="骨格筋量の評価（優秀/標準/やや低い/低い）と数値根拠")
+    arm_balance: str = Field(description="腕の左右バランス（正常/軽度アンバランス/要注意）と差分%")
+    leg_balance: str = Field(description="脚の左右バランス（正常/軽度アンバランス/要注意）と差分%")
+    upper_lower_balance: str = Field(description="上下肢バランスの評価")
+    risk_factors: List[str] = Field(description="リスク要因のリスト（既往歴・数値から導出）")
+    concerns: List[str] = Field(description="注意すべき点・懸念事項")
@@ -0,0 +1,176 @@
+import re
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from core.common.db_client import KNOWLEDGE_FILE
+
+_section_index_cache = None
+_section_index_lock = threading.Lock()
+
+# "## I. 体型分類（コード判定準拠）" のような大分類見出し
+_CATEGORY_PATTERN = re.compile(r"^## ([IVX]+)\. (.+)$")
+# "### A. 下半身 (Legs)" のような種目グループ見出し
+_GROUP_PATTERN = re.compile(r"^### ([A-Z])\. (.+)$")
+# "## 8. 隠れ肥満 (Skinny Fat)" のような番号付きセクション見出し
+_SECTION_PATTERN = re.compile(r"^## (\d+)\. (.+?)(?: \((.+)\))?$")
+
+# 以下のセクション番号は expert_knowledge.md の見出し番号（振り直した場合は SectionIndexTests が検出する）
+
+# 体脂肪率判定（セクション11-14）の境界値: (標準の下限, 軽度肥満の下限, 肥満の下限)
+BODY_FAT_THRESHOLDS = {
+    "男性": (10, 20, 25),
+    "女性": (20, 30, 35),
+}
+
+PROGRESSION_SECTIONS = {
+    "初級者": "19",
+    "中級者": "20",
+    "上級者": "21",
+}
+
+# 既往歴キーワード → 関節リスク(16)と、負担の少ない代替種目のセクション
+# （ジム専用の代替種目は自宅トレーニングでは除く: risk_section_numbers の home）
+INJURY_SECTIONS = {
+    "膝": ["16", "29", "43", "41"],
+    "腰": ["16", "40", "48", "26"],
+    "肩": ["16", "46", "44"],
+    "足首": ["16", "29", "41"],
+}
+
+
+class Section(NamedTuple):
+    number: str
+    title: str
+    english: str
+    category: str
+    group: str
+    content: str
+
+
+class SectionIndex:
+    """expert_knowledge.md の見出しから構築した、番号・タイトルで引けるセクション索引"""
+
+    def __init__(self, sections: List[Section]):
+        self.sections = sections
+        self.by_number: Dict[str, Section] = {section.number: section for section in sections}
+        self.by_title: Dict[str, Section] = {section.title: section for section in sections}
+
+    def get(self, key: str) -> Optional[Section]:
+        """セクション番号（"8"）またはタイトル（"隠れ肥満"）でセクションを取得する"""
+        return self.by_number.get(key) or self.by_title.get(key)
+
+    def targets(self, number: str) -> List[str]:
+        """リスクセクションの「対象」行に列挙された体型名を返す"""
+        section = self.by_number.get(number)
+        if section is None:
+            return []
+        for line in section.content.splitlines():
+            if "**対象:**" in line:
+                names = line.split("**対象:**", 1)[1]
+                return [re.sub(r"（.*?）", "", name).strip() for name in names.split("、")]
+        return []
+
+
+def parse_sections(text: str) -> List[Section]:
+    """マークダウン本文を番号付きセクション単位に分割する"""
+    sections = []
+    category = ""
+    group = ""
+    current = None
+    lines: List[str] = []
+
+    def flush():
+        if current is not None:
+            content = "\n".join(lines).strip().rstrip("-").strip()
+            sections.append(current._replace(content=content))
+
+    for line in text.splitlines():
+        category_match = _CATEGORY_PATTERN.match(line)
+        group_match = _GROUP_PATTERN.match(line)
+        section_match = _SECTION_PATTERN.match(line)
+
+        if category_match or group_match or section_match:
+            flush()
+            current = None
+            lines = []
+
+        if category_match:
+            category = category_match.group(2)
+            group = ""
+        elif group_match:
+            group = group_match.group(2)
+        elif section_match:
+            number, title, english = section_match.groups()
+            current = Section(number, title, english or "", category, group, "")
+            lines = [line]
+        elif current is not None:
+            lines.append(line)
+
+    flush()
+    return sections
+
+
+def get_section_index() -> SectionIndex:
+    """スレッドセーフなシングルトンのセクション索引を取得"""
+    global _section_index_cache
+
+    with _section_index_lock:
+        if _section_index_cache is None:
+            _section_index_cache = SectionIndex(parse_sections(KNOWLEDGE_FILE.read_text(encoding="utf-8")))
+        return _section_index_cache
+
+
+def body_fat_section_number(body_fat_percent: float, gender: str) -> Optional[str]:
+    """体脂肪率と性別から体脂肪率判定セクション（11-14）の番号を返す"""
+    thresholds = BODY_FAT_THRESHOLDS.get(gender)
+    if thresholds is None or body_fat_percent is None:
+        return None
+
+    normal, overweight, obese = thresholds
+    if body_fat_percent < normal:
+        return "11"
+    if body_fat_percent < overweight:
+        return "12"
+    if body_fat_percent < obese:
+        return "13"
+    return "14"
+
+
+def risk_section_numbers(
+    body_type: Optional[str],
+    injuries: Iterable[str],
+    include_substitutions: bool = True,
+    home: bool = False,
+) -> List[str]:
+    """
+    体型タイプと既往歴から、該当するリスクセクション（16-18）と代替種目セクションの番号を返す。
+
+    Args:
+        body_type: evaluate_body_type の判定結果（例: "隠れ肥満"）
+        injuries: 既往歴・怪我のリスト（例: ["膝痛"]）
+        include_substitutions: 既往歴に対する代替種目セクションも含めるか
+        home: 自宅トレーニングの場合、ジム専用の代替種目（レッグプレス等）を除く
+    """
+    # exercises は本モジュールを読み込むため、関数内で読み込む
+    from core.common.exercises import get_exercise_library
+
+    index = get_section_index()
+    gym_only = get_exercise_library().gym_only if home else frozenset()
+    numbers = []
+
+    if body_type:
+        numbers.extend(number for number in ("16", "17", "18") if body_type in index.targets(number))
+
+    for injury in injuries:
+        for keyword, injury_numbers in INJURY_SECTIONS.items():
+            if keyword in injury:
+                substitutions = [number for number in injury_numbers[1:] if number not in gym_only]
+                numbers.extend(injury_numbers[:1] + substitutions if include_substitutions else injury_numbers[:1])
+
+    return list(dict.fromkeys(numbers))
+
+
+def format_sections(numbers: Iterable[str]) -> str:
+    """セクション番号のリストを、重複を除いて本文テキストに整形する"""
+    index = get_section_index()
+    contents = [index.by_number[number].content for number in dict.fromkeys(numbers) if number in index.by_number]
+    return "\n\n".join(contents)
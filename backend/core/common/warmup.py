@@ -0,0 +1,150 @@
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# 初回リクエストで遅延インポートされる重いモジュール（ワーカー起動時にまとめて読み込む）
+PRELOAD_MODULES = (
+    "langchain_google_genai",
+    "langgraph.graph",
+    "langchain_chroma",
+    "google.genai",
+    "core.orchestrator.graph",
+    "core.planner.edit",
+    "core.extractor.inbody",
+    "core.extractor.preprocess",
+)
+
+_status = {"state": "pending", "steps": {}, "imports": {}, "errors": {}}
+_status_lock = threading.Lock()
+
+
+def get_warmup_status() -> dict:
+    """ウォームアップの進捗（state: pending / running / ready / failed）と各ステップの所要時間を返す"""
+    with _status_lock:
+        return {
+            "state": _status["state"],
+            "steps": dict(_status["steps"]),
+            "imports": dict(_status["imports"]),
+            "errors": dict(_status["errors"]),
+        }
+
+
+def _run_step(name: str, fn: Callable[[], object]) -> bool:
+    """1ステップを実行して所要時間を記録し、成功したかを返す。失敗しても残りのステップは続行する"""
+    started = time.perf_counter()
+    try:
+        result = fn()
+    except Exception as e:
+        logger.warning("ウォームアップ %s に失敗しました: %s", name, e)
+        with _status_lock:
+            _status["errors"][name] = str(e)
+        return False
+
+    elapsed = "skipped" if result == "skipped" else round(time.perf_counter() - started, 3)
+    with _status_lock:
+        _status["steps"][name] = elapsed
+    return True
+
+
+def _preload_modules() -> None:
+    for module in PRELOAD_MODULES:
+        started = time.perf_counter()
+        importlib.import_module(module)
+        with _status_lock:
+            _status["imports"][module] = round(time.perf_counter() - started, 3)
+
+
+def _load_knowledge_indexes() -> None:
+    from core.analyzer.tools import RETRIEVER_COLLECTIONS
+    from core.common.lexical import get_bm25_index
+    from core.common.sections import get_section_index
+    from core.planner.tools import RISK_COLLECTIONS, TRAINING_COLLECTIONS
+
+    get_section_index()
+    # 各ツールが検索するコレクションの組ごとにインデックスを作る
+    for collections in (RETRIEVER_COLLECTIONS, TRAINING_COLLECTIONS, RISK_COLLECTIONS):
+        get_bm25_index(collections)
+
+
+def _open_vectorstore():
+    # 埋め込みAPIキーが無い環境ではベクトル検索を使わない（BM25にフォールバックする）
+    if not os.getenv("GOOGLE_API_KEY"):
+        return "skipped"
+    from core.common.db_client import get_vector_index, KNOWLEDGE_COLLECTIONS
+    for collection in KNOWLEDGE_COLLECTIONS:
+        get_vector_index(collection)
+
+
+def _compile_orchestrators() -> None:
+    from core.common.checkpoint import get_checkpointer
+    from core.common.context_cache import get_context_mode
+    from core.orchestrator.graph import get_orchestrator
+
+    checkpointer = get_checkpointer()
+    context_mode = get_context_mode()
+    get_orchestrator(skip_analyzer=False, checkpointer=checkpointer, context_mode=context_mode)
+    get_orchestrator(skip_analyzer=True, checkpointer=checkpointer, context_mode=context_mode)
+
+
+def _prime_upstream():
+    """埋め込みとLLMに小さなリクエストを送り、接続を確立しておく"""
+    if not os.getenv("GOOGLE_API_KEY"):
+        return "skipped"
+    from core.common.llm import get_llm_for
+    from core.common.retriever import search_knowledge
+
+    search_knowledge("体脂肪率", k=1, backend="vector")
+    get_llm_for("analyzer.loop").invoke("OK とだけ返してください")
+
+
+def warmup(prime: bool = None) -> Dict[str, object]:
+    """
+    ワーカー起動時の初期化。重いモジュールの読み込み、ナレッジ索引の構築、Chromaのオープン、
+    オーケストレーターのコンパイルを行い、初回リクエストの待ち時間からこれらを取り除く。
+    いずれかのステップが失敗した場合は state を failed とし、レディネスチェックで再試行する
+    （上流への接続確認の prime は失敗しても ready にする。上流の障害で全ワーカーが外れないようにするため）。
+
+    Args:
+        prime: 埋め込み・LLMに小さなリクエストを送るか（省略時は環境変数 WARMUP_PRIME）
+    """
+    if prime is None:
+        prime = os.getenv("WARMUP_PRIME", "0") == "1"
+
+    with _status_lock:
+        _status.update(state="running", steps={}, imports={}, errors={})
+
+    started = time.perf_counter()
+    succeeded = all([
+        _run_step("imports", _preload_modules),
+        _run_step("knowledge_index", _load_knowledge_indexes),
+        _run_step("vectorstore", _open_vectorstore),
+        _run_step("orchestrator", _compile_orchestrators),
+    ])
+    if prime:
+        _run_step("prime", _prime_upstream)
+
+    with _status_lock:
+        _status["state"] = "ready" if succeeded else "failed"
+        _status["steps"]["total"] = round(time.perf_counter() - started, 3)
+
+    if succeeded:
+        logger.info("ウォームアップ完了", extra={"steps": get_warmup_status()["steps"]})
+    else:
+        logger.error("ウォームアップに失敗しました", extra={"errors": get_warmup_status()["errors"]})
+    return get_warmup_status()
+
+
+def start_warmup() -> bool:
+    """バックグラウンドスレッドでウォームアップを開始する（実行中・完了済みの場合は何もしない。失敗した場合は再実行する）"""
+    with _status_lock:
+        if _status["state"] not in ("pending", "failed"):
+            return False
+        _status["state"] = "running"
+
+    threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    return True
@@ -0,0 +1,164 @@
+import logging
+import os
+import time
+from typing import Optional, Literal
+from pydantic import BaseModel, Field
+
+from core.common.llm import get_route, get_genai_client, invoke_structured, hedge_delay
+from core.common.metrics import record_call, get_llm_metrics
+from core.common.resilience import guarded_call
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_MODES = ("auto", "agentic")
+
+REQUIRED_FIELDS = ("weight_kg", "muscle_mass_kg", "skeletal_muscle_mass_kg", "body_fat_percent")
+
+
+class SegmentalLean(BaseModel):
+    right_arm: Optional[float] = Field(None, description="右腕の骨格筋量(kg)")
+    left_arm: Optional[float] = Field(None, description="左腕の骨格筋量(kg)")
+    trunk: Optional[float] = Field(None, description="体幹の骨格筋量(kg)")
+    right_leg: Optional[float] = Field(None, description="右脚の骨格筋量(kg)")
+    left_leg: Optional[float] = Field(None, description="左脚の骨格筋量(kg)")
+
+
+class InBodyData(BaseModel):
+    weight_kg: Optional[float] = None
+    muscle_mass_kg: Optional[float] = None
+    skeletal_muscle_mass_kg: Optional[float] = None
+    body_fat_percent: Optional[float] = None
+    segmental_lean: Optional[SegmentalLean] = None
+    confidence: Literal["high", "medium", "low"] = "low"
+    notes: Optional[str] = None
+
+
+AGENTIC_PROMPT = """この画像はInBody（体成分分析装置）の測定結果シートです。
+必要に応じて画像をズーム・クロップして、以下の数値データを正確に読み取ってください。
+
+- 体重 (weight_kg) - kg単位
+- 筋肉量 (muscle_mass_kg) - kg単位
+- 骨格筋量 (skeletal_muscle_mass_kg) - kg単位
+- 体脂肪率 (body_fat_percent) - %単位
+- 部位別骨格筋量: 左腕、右腕、体幹、左脚、右脚（各kg）
+
+読み取った数値をすべて報告してください。"""
+
+DIRECT_PROMPT = """この画像はInBody（体成分分析装置）の測定結果シートです。
+以下の数値データを読み取り、指定のスキーマで出力してください。
+
+- 体重 (weight_kg) - kg単位
+- 筋肉量 (muscle_mass_kg) - kg単位
+- 骨格筋量 (skeletal_muscle_mass_kg) - kg単位
+- 体脂肪率 (body_fat_percent) - %単位
+- 部位別骨格筋量 (segmental_lean): 左腕、右腕、体幹、左脚、右脚（各kg）
+
+判読できない数値は推測せず null にしてください。
+confidence には、すべての数値をはっきり判読できた場合のみ "high" を設定してください。"""
+
+
+def needs_fallback(data: InBodyData) -> bool:
+    """1回呼び出しの結果が不十分（低信頼・必須項目の欠落）かどうか"""
+    if data.confidence == "low":
+        return True
+    if any(getattr(data, field) is None for field in REQUIRED_FIELDS):
+        return True
+    segmental = data.segmental_lean
+    return segmental is None or any(value is None for value in segmental.model_dump().values())
+
+
+def _generate_content(stage: str, contents: list, config):
+    """GenAI SDKの呼び出しを締め切り・ヘッジ・サーキットブレーカー付きで行い、レイテンシとトークン数を記録する"""
+    route = get_route(stage)
+    model = route["model"]
+
+    def call(timeout):
+        # クライアントは破棄時に接続を閉じるため、呼び出しが終わるまで参照を保持する
+        client = get_genai_client(timeout=timeout)
+        return client.models.generate_content(model=model, contents=contents, config=config)
+
+    started = time.perf_counter()
+    try:
+        response = guarded_call(model, call, timeout=route.get("timeout"), hedge_after=hedge_delay(stage, model))
+    except Exception:
+        get_llm_metrics().record(stage, model, None, ok=False)
+        raise
+    record_call(stage, model, time.perf_counter() - started, response)
+    return response
+
+
+def extract_direct(image_data: bytes, content_type: str) -> InBodyData:
+    """Visionモデルに InBodyData スキーマを直接指定し、1回の呼び出しで構造化データを得る"""
+    from google.genai import types
+
+    route = get_route("vision.direct")
+    image_part = types.Part.from_bytes(data=image_data, mime_type=content_type)
+
+    logger.info("Calling Gemini Vision with structured output (single call)")
+    response = _generate_content("vision.direct", [image_part, DIRECT_PROMPT], types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=InBodyData,
+        temperature=route.get("temperature", 0),
+    ))
+
+    if isinstance(response.parsed, InBodyData):
+        return response.parsed
+    return InBodyData.model_validate_json(response.text)
+
+
+def extract_agentic(image_data: bytes, content_type: str) -> InBodyData:
+    """コード実行（ズーム・クロップ）付きのVision呼び出し → 構造化出力の2段階で抽出する"""
+    from google.genai import types
+
+    # Step 1: Agentic Vision（Google GenAI SDK）で画像を解析
+    route = get_route("vision.agentic")
+    image_part = types.Part.from_bytes(data=image_data, mime_type=content_type)
+
+    logger.info("Calling Gemini Agentic Vision for InBody data extraction")
+    vision_response = _generate_content("vision.agentic", [image_part, AGENTIC_PROMPT], types.GenerateContentConfig(
+        tools=[types.Tool(code_execution=types.ToolCodeExecution)],
+        temperature=route.get("temperature"),
+    ))
+
+    # レスポンスからテキスト部分を抽出
+    vision_text = ""
+    for part in vision_response.candidates[0].content.parts:
+        if part.text:
+            vision_text += part.text + "\n"
+
+    # 画像の読み取り結果は長いため、LOG_VERBOSE_SAMPLE_RATE の割合のリクエストのみ出力する
+    logger.info("Agentic Vision result", extra={"verbose": True, "vision_text": vision_text[:500]})
+
+    # Step 2: structured outputで型付きデータに変換
+    return invoke_structured(
+        "vision.structure",
+        InBodyData,
+        f"以下のInBody解析結果から数値を抽出してください:\n\n{vision_text}",
+    )
+
+
+def extract_inbody_data(image_data: bytes, content_type: str, mode: Optional[str] = None) -> dict:
+    """
+    InBody画像から数値データを抽出する。
+
+    mode="auto" では構造化出力の1回呼び出しを試し、信頼度が低いか項目が欠けている場合のみ
+    ズーム・クロップ付きの2段階抽出（agentic）にフォールバックする。
+    mode="agentic" では常に2段階抽出を行う。
+
+    Args:
+        image_data: 画像のバイト列
+        content_type: 画像のMIMEタイプ
+        mode: 抽出モード（省略時は環境変数 INBODY_EXTRACTION_MODE、既定は "auto"）
+    """
+    mode = mode or os.getenv("INBODY_EXTRACTION_MODE", "auto")
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"未対応の抽出モードです: {mode}（対応: {', '.join(EXTRACTION_MODES)}）")
+
+    if mode == "auto":
+        result = extract_direct(image_data, content_type)
+        if not needs_fallback(result):
+            logger.info("Single-call extraction succeeded")
+            return result.model_dump()
+        logger.info("Single-call result insufficient, falling back to agentic path", extra={"confidence": result.confidence})
+
+    return extract_agentic(image_data, content_type).model_dump()
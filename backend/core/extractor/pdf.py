@@ -0,0 +1,38 @@
+import io
+from typing import BinaryIO, Iterator, Tuple
+
+# InBodyシート（A4）の小さな数値が判読できる描画倍率（72dpi × 2 = 144dpi）
+DEFAULT_RENDER_SCALE = 2.0
+
+
+def split_pdf_pages(source: BinaryIO, scale: float = DEFAULT_RENDER_SCALE) -> Iterator[Tuple[int, bytes]]:
+    """
+    複数ページのPDFを1ページずつJPEG画像に描画して返す。
+
+    ページは読み出されるたびに1枚ずつ描画するため、メモリに載るのは呼び出し側が保持しているページのみになる。
+
+    Args:
+        source: PDFのファイルオブジェクト
+        scale: 描画倍率（1.0 = 72dpi）
+
+    Yields:
+        (ページ番号（1始まり）, JPEGのバイト列)
+    """
+    try:
+        import pypdfium2 as pdfium
+    except ImportError as e:
+        raise RuntimeError("PDFの分割には pypdfium2 が必要です（pip install pypdfium2）") from e
+
+    source.seek(0)
+    document = pdfium.PdfDocument(source)
+    try:
+        for page_number in range(len(document)):
+            page = document[page_number]
+            image = page.render(scale=scale).to_pil().convert("RGB")
+            page.close()
+
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=85, optimize=True)
+            yield page_number + 1, output.getvalue()
+    finally:
+        document.close()
@@ -0,0 +1,109 @@
+import io
+import os
+from typing import BinaryIO, NamedTuple
+
+# InBody結果シートの小さな数値が判読できる長辺の上限（px）
+DEFAULT_MAX_EDGE = 2048
+DEFAULT_JPEG_QUALITY = 85
+# 検出した用紙領域がこの割合より小さい場合は誤検出とみなしてクロップしない
+MIN_DOCUMENT_AREA_RATIO = 0.3
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+class InvalidImageError(ValueError):
+    """アップロードされたデータを画像としてデコードできない（壊れている・画素数が多すぎる）"""
+
+
+class PreprocessedImage(NamedTuple):
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    width: int
+    height: int
+
+
+def _register_heif_opener() -> bool:
+    try:
+        from pillow_heif import register_heif_opener
+    except ImportError:
+        return False
+    register_heif_opener()
+    return True
+
+
+def crop_to_document(image):
+    """背景より明るい用紙領域を検出してクロップする。検出できない場合は元画像を返す"""
+    from PIL import ImageOps
+
+    grayscale = ImageOps.autocontrast(image.convert("L").reduce(4))
+    bbox = grayscale.point(lambda value: 255 if value > 160 else 0).getbbox()
+    if bbox is None:
+        return image
+
+    left, top, right, bottom = (coord * 4 for coord in bbox)
+    if (right - left) * (bottom - top) < MIN_DOCUMENT_AREA_RATIO * image.width * image.height:
+        return image
+    return image.crop((left, top, min(right, image.width), min(bottom, image.height)))
+
+
+def preprocess_image(source: BinaryIO, content_type: str, max_edge: int = None, crop: bool = None) -> PreprocessedImage:
+    """
+    Visionモデルに送る前にアップロード画像を正規化する。
+
+    HEICをデコードし、EXIFの向きを補正し、長辺max_edgeまで縮小して、
+    （任意で用紙領域にクロップしてから）JPEGに再エンコードする。
+    sourceはファイルオブジェクトのまま読み込むため、一時ファイルに退避された大きな
+    アップロードを丸ごとメモリに展開しない。Pillowが無い環境と、pillow-heifが無い環境のHEICでは
+    元のバイト列をそのまま返す。
+
+    Raises:
+        InvalidImageError: 壊れた画像・画像でないデータ・画素数が上限を超える画像
+
+    Args:
+        source: 画像のファイルオブジェクト
+        content_type: アップロード時のMIMEタイプ
+        max_edge: 縮小後の長辺（省略時は環境変数 INBODY_IMAGE_MAX_EDGE）
+        crop: 用紙領域にクロップするか（省略時は環境変数 INBODY_IMAGE_CROP）
+    """
+    max_edge = max_edge or int(os.getenv("INBODY_IMAGE_MAX_EDGE", DEFAULT_MAX_EDGE))
+    if crop is None:
+        crop = os.getenv("INBODY_IMAGE_CROP", "0") == "1"
+
+    source.seek(0, os.SEEK_END)
+    original_bytes = source.tell()
+    source.seek(0)
+
+    try:
+        from PIL import Image, ImageOps, UnidentifiedImageError
+    except ImportError:
+        return PreprocessedImage(source.read(), content_type, original_bytes, 0, 0)
+
+    if not _register_heif_opener() and content_type == "image/heic":
+        # pillow-heif未導入の環境ではHEICをデコードできないため、Visionモデル側の解釈に任せる
+        return PreprocessedImage(source.read(), content_type, original_bytes, 0, 0)
+
+    try:
+        image = Image.open(source)
+        original_size = image.size
+        rotated = image.getexif().get(EXIF_ORIENTATION_TAG, 1) != 1
+        # JPEGはデコード時点で縮小し、フル解像度のピクセルバッファを確保しない
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise InvalidImageError(f"画像をデコードできません: {e}") from e
+
+    if crop:
+        image = crop_to_document(image)
+    image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=DEFAULT_JPEG_QUALITY, optimize=True)
+    data = output.getvalue()
+
+    # 縮小・回転・クロップが不要な小さいJPEG/PNG/WebPは、再エンコードで大きくなるなら元データを送る
+    unchanged = not rotated and image.size == original_size
+    if content_type != "image/heic" and unchanged and original_bytes <= len(data):
+        source.seek(0)
+        return PreprocessedImage(source.read(), content_type, original_bytes, image.width, image.height)
+
+    return PreprocessedImage(data, "image/jpeg", original_bytes, image.width, image.height)
@@ -1,27 +1,53 @@
+import logging
+import threading
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import HumanMessage
 from core.common.state import AgentState
-from core.analyzer.graph import build_analyzer_graph, create_user_message
-from core.planner.graph import build_planner_graph, create_planner_message
+from core.common.hashing import canonical_hash
+from core.analyzer.graph import build_analyzer_graph, create_user_message, SYSTEM_PROMPT as ANALYZER_SYSTEM_PROMPT
+from core.planner.graph import build_planner_graph, create_planner_message, SYSTEM_PROMPT as PLANNER_SYSTEM_PROMPT
 
-def build_orchestrator():
+logger = logging.getLogger(__name__)
+
+# プロンプトを変更すると自動的に変わるバージョン識別子（生成履歴に記録する）
+PROMPT_VERSION = canonical_hash([ANALYZER_SYSTEM_PROMPT, PLANNER_SYSTEM_PROMPT])[:12]
+
+# 分析レポートが依存する入力フィールド（preferencesは分析に使われない）
+ANALYSIS_INPUT_FIELDS = ("user_profile", "inbody_metrics", "goal")
+
+
+def analysis_input_hash(input_data: dict) -> str:
+    """分析レポートのキャッシュキー（分析に使う入力フィールドとAnalyzerのプロンプトのみから計算）"""
+    return canonical_hash({
+        "input": {field: input_data.get(field) for field in ANALYSIS_INPUT_FIELDS},
+        "prompt": ANALYZER_SYSTEM_PROMPT,
+    })
+
+
+def build_orchestrator(skip_analyzer: bool = False, checkpointer=None, context_mode: str = "rag"):
     """
     analyzer_node と planner_node を統合したオーケストレーターグラフを構築
     
     フロー:
     START -> analyzer -> adapter -> planner -> END
+    skip_analyzer=True の場合は、初期状態の analysis_report を使って
+    START -> adapter -> planner -> END のみを実行する
+    checkpointer を指定すると各ノード完了時に状態を保存し、失敗したノードから再開できる
+    context_mode="full_context" の場合、analyzer/planner はツール呼び出しループを省略し、
+    コンテキストキャッシュに登録した知識ベース全体を参照する
     """
     workflow = StateGraph(AgentState)
     
     # サブグラフをノードとして追加
-    workflow.add_node("analyzer", build_analyzer_graph())
-    workflow.add_node("planner", build_planner_graph())
+    if not skip_analyzer:
+        workflow.add_node("analyzer", build_analyzer_graph(context_mode))
+    workflow.add_node("planner", build_planner_graph(context_mode))
     
     # Adapter Node: メッセージの橋渡し
     # analyzerの出力messagesとplannerの入力messagesは文脈が違うため
     # ここでplanner向けの新しいHumanMessageを注入する
     def adapter_node(state: AgentState) -> dict:
-        print("\n[Orchestrator] Connecting Analyzer to Planner...")
+        logger.info("Connecting Analyzer to Planner")
         input_data = state["input_data"]
         analysis_report = state.get("analysis_report", {})
         
@@ -39,15 +65,51 @@ def build_orchestrator():
     workflow.add_node("adapter", adapter_node)
     
     # エッジを定義: START -> analyzer -> adapter -> planner -> END
-    workflow.add_edge(START, "analyzer")
-    workflow.add_edge("analyzer", "adapter")
+    if skip_analyzer:
+        workflow.add_edge(START, "adapter")
+    else:
+        workflow.add_edge(START, "analyzer")
+        workflow.add_edge("analyzer", "adapter")
     workflow.add_edge("adapter", "planner")
     workflow.add_edge("planner", END)
     
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
+
+_orchestrator_cache = {}
+_orchestrator_lock = threading.Lock()
+
+
+def get_orchestrator(skip_analyzer: bool = False, checkpointer=None, context_mode: str = "rag"):
+    """
+    コンパイル済みのオーケストレーターを再利用する（コンパイル済みグラフはリクエスト間で共有できる）
+    
+    構成（skip_analyzer, context_mode）とチェックポインタの組ごとに1回だけ build_orchestrator を呼ぶ
+    """
+    key = (skip_analyzer, id(checkpointer), context_mode)
+    with _orchestrator_lock:
+        if key not in _orchestrator_cache:
+            _orchestrator_cache[key] = build_orchestrator(
+                skip_analyzer=skip_analyzer, checkpointer=checkpointer, context_mode=context_mode
+            )
+        return _orchestrator_cache[key]
 
-def create_initial_state(input_data: dict) -> dict:
-    """入力データからオーケストレーター用の初期状態を作成"""
+def create_initial_state(input_data: dict, analysis_report: dict = None) -> dict:
+    """
+    入力データからオーケストレーター用の初期状態を作成
+    
+    Args:
+        input_data: バリデーション済みの入力データ
+        analysis_report: 既存の分析レポート（build_orchestrator(skip_analyzer=True) で使用）
+    """
+    if analysis_report:
+        # Analyzerを実行しないため、Planner向けのメッセージはadapterが作成する
+        return {
+            "messages": [],
+            "input_data": input_data,
+            "analysis_report": analysis_report,
+            "training_plan": {}
+        }
+    
     user_message = create_user_message(input_data)
     
     return {
@@ -0,0 +1,145 @@
+import copy
+import json
+import logging
+from typing import Optional
+
+from core.common.state import DayPlan, Exercise
+from core.common.llm import invoke_structured
+from core.common.sections import risk_section_numbers, format_sections
+from core.analyzer.tools import body_type_from_input
+
+logger = logging.getLogger(__name__)
+
+
+class PlanTargetOutOfRange(LookupError):
+    """再生成の対象（day_index / exercise_index）が元のプランの範囲外"""
+
+
+EDIT_PROMPT = """あなたは運動生理学とスポーツ医学の専門家パーソナルトレーナーです。
+既存のトレーニングプランのうち、指定された{target_label}だけを変更要望に沿って作り直してください。
+
+## ユーザー情報
+- 年齢: {age}歳、性別: {gender}
+- トレーニング経験: {experience}
+- 既往歴・怪我: {injuries}
+- 目標: {goal_type}
+- 要望: {preferences}
+
+## 分析結果
+- 体型タイプ: {body_type}
+- リスク要因: {risk_factors}
+
+## 関連する専門知識
+{knowledge}
+
+## プラン内の前後関係
+{surroundings}
+
+## 現在の{target_label}
+{current}
+
+## 変更要望
+{change_request}
+
+## 注意
+- 変更要望に関係しない部分は現在の内容をできるだけ維持すること
+- preferences（環境・器具・トレーニング時間）とリスク要因を遵守すること
+- 各種目には3ステップ程度の具体的な動作手順（instructions）を含めること"""
+
+
+def _risk_knowledge(input_data: dict) -> str:
+    """既往歴・体型に関連するリスクと代替種目のセクションのみを取得する（プラン全体の参照知識は使わない）"""
+    injuries = input_data.get("user_profile", {}).get("injuries", [])
+    home = input_data.get("preferences", {}).get("environment", "home") != "gym"
+    numbers = risk_section_numbers(body_type_from_input(input_data), injuries, home=home)
+    return format_sections(numbers) or "なし"
+
+
+def build_edit_prompt(
+    input_data: dict,
+    analysis_report: dict,
+    training_plan: dict,
+    day_index: int,
+    exercise_index: Optional[int],
+    change_request: str,
+) -> str:
+    """変更対象の日または種目と、その前後関係だけを含む編集用プロンプトを作成する"""
+    user_profile = input_data.get("user_profile", {})
+    schedule = training_plan["weekly_schedule"]
+    day = schedule[day_index]
+
+    if exercise_index is None:
+        target_label = f"{day['day_label']}の1日分のメニュー"
+        current = day
+        surroundings = "\n".join(
+            f"- {other['day_label']}: {other['focus']}"
+            for i, other in enumerate(schedule) if i != day_index
+        ) or "なし"
+    else:
+        target_label = f"{day['day_label']}の種目"
+        current = day["exercises"][exercise_index]
+        surroundings = f"{day['day_label']}（{day['focus']}）の他の種目: " + ("、".join(
+            exercise["exercise_name"]
+            for i, exercise in enumerate(day["exercises"]) if i != exercise_index
+        ) or "なし")
+
+    return EDIT_PROMPT.format(
+        target_label=target_label,
+        age=user_profile.get("age"),
+        gender=user_profile.get("gender"),
+        experience=user_profile.get("training_experience"),
+        injuries=", ".join(user_profile.get("injuries", [])) or "なし",
+        goal_type=input_data.get("goal", {}).get("type"),
+        preferences=input_data.get("preferences", {}),
+        body_type=analysis_report.get("body_type"),
+        risk_factors=", ".join(analysis_report.get("risk_factors", [])) or "なし",
+        knowledge=_risk_knowledge(input_data),
+        surroundings=surroundings,
+        current=json.dumps(current, ensure_ascii=False, indent=2),
+        change_request=change_request,
+    )
+
+
+def regenerate_plan_part(
+    input_data: dict,
+    analysis_report: dict,
+    training_plan: dict,
+    day_index: int,
+    exercise_index: Optional[int] = None,
+    change_request: str = "",
+) -> dict:
+    """
+    トレーニングプランのうち1日分（DayPlan）または1種目（Exercise）だけを再生成し、
+    元のプランに差し込んだ新しいプランを返す。
+
+    出力はDayPlan/Exerciseの構造化出力のみのため、プラン全体を再生成するより
+    出力トークン数と待ち時間が変更範囲に比例して小さくなる。
+
+    Args:
+        input_data: プラン生成時の入力データ
+        analysis_report: プラン生成時の分析レポート
+        training_plan: 変更元のトレーニングプラン（変更されない）
+        day_index: 変更する日のインデックス（0始まり）
+        exercise_index: 変更する種目のインデックス（省略時は1日分を再生成）
+        change_request: 変更要望（例: "スクワットを膝に優しい種目に変えて"）
+    """
+    schedule = training_plan.get("weekly_schedule", [])
+    if not 0 <= day_index < len(schedule):
+        raise PlanTargetOutOfRange(f"day_index が範囲外です: {day_index}（0〜{len(schedule) - 1}）")
+
+    exercises = schedule[day_index].get("exercises", [])
+    if exercise_index is not None and not 0 <= exercise_index < len(exercises):
+        raise PlanTargetOutOfRange(f"exercise_index が範囲外です: {exercise_index}（0〜{len(exercises) - 1}）")
+
+    prompt = build_edit_prompt(input_data, analysis_report, training_plan, day_index, exercise_index, change_request)
+    schema = DayPlan if exercise_index is None else Exercise
+    result = invoke_structured("planner.edit", schema, prompt)
+
+    new_plan = copy.deepcopy(training_plan)
+    if exercise_index is None:
+        new_plan["weekly_schedule"][day_index] = result.model_dump()
+    else:
+        new_plan["weekly_schedule"][day_index]["exercises"][exercise_index] = result.model_dump()
+
+    logger.info("%s を再生成しました", schema.__name__, extra={"day": day_index, "exercise": exercise_index})
+    return new_plan
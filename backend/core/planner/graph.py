@@ -1,10 +1,17 @@
+import logging
 from langchain_core.messages import ToolMessage
 
 from core.common.state import AgentState, TrainingPlan
-from core.common.llm import get_llm
-from core.common.graph_builder import build_tool_agent_graph
+from core.common.llm import invoke_structured
+from core.common.graph_builder import build_tool_agent_graph, LoopBudget
+from core.common.context_cache import full_context_prefix
+from core.common.sections import get_section_index, risk_section_numbers, format_sections, PROGRESSION_SECTIONS
+from core.common.exercises import get_exercise_library, format_candidates
+from core.analyzer.tools import body_type_from_input
 from core.planner.tools import training_retriever_tool, risk_modification_tool
 
+logger = logging.getLogger(__name__)
+
 
 SYSTEM_PROMPT = """あなたは運動生理学とスポーツ医学の専門家パーソナルトレーナーです。
 
@@ -18,12 +25,16 @@ SYSTEM_PROMPT = """あなたは運動生理学とスポーツ医学の専門家
 4. 分析レポート（体型タイプ、バランス評価、リスク要因）
 
 ## 手順
-1. training_retriever_toolで以下を検索（1回のクエリにまとめること）:
-   - 体型タイプに適したトレーニング方針
+1. 以下の専門知識は「参照知識」としてメッセージに添付済みのため、検索は不要:
+   - 体型タイプ別の方針（代謝特性・栄養戦略・有酸素運動）
+   - トレーニング経験レベルに応じた進行モデル
+   - 体型・既往歴に関連するリスクと代替種目
+   - 環境・器具・既往歴で絞り込んだ部位別の種目候補（種目は原則この中から選ぶ）
+2. training_retriever_toolで以下を検索（1回のクエリにまとめること）:
    - 目標に合った戦略
    - トレーニング経験レベルに適した分割法
-2. risk_modification_toolでリスク要因に対する対策を検索
-3. 検索結果を元に週間トレーニングプランを設計
+3. 参照知識でカバーされないリスク要因がある場合のみ、risk_modification_toolで対策を検索
+4. 参照知識と検索結果を元に週間トレーニングプランを設計
 
 ## 設計原則
 - 【最優先】ユーザーの「preferences」（環境・器具・要望・トレーニング時間）を絶対に遵守すること
@@ -55,6 +66,35 @@ SYSTEM_PROMPT = """あなたは運動生理学とスポーツ医学の専門家
 
 TOOLS = [training_retriever_tool, risk_modification_tool]
 
+# 想定: 検索1回 + リスク検索を必要な場合のみ1〜2ターンで呼ぶ
+LOOP_BUDGET = LoopBudget(max_iterations=3, max_tool_calls=4, max_prompt_tokens=60_000)
+
+
+def build_reference_knowledge(input_data: dict) -> str:
+    """入力データから一意に決まる専門知識セクション（体型別方針・進行モデル・リスクと代替種目）を直接取得"""
+    user_profile = input_data.get("user_profile", {})
+
+    body_type = body_type_from_input(input_data)
+    body_type_section = get_section_index().get(body_type) if body_type else None
+
+    numbers = [body_type_section.number] if body_type_section else []
+    numbers.append(PROGRESSION_SECTIONS.get(user_profile.get("training_experience")))
+    home = input_data.get("preferences", {}).get("environment", "home") != "gym"
+    numbers.extend(risk_section_numbers(body_type, user_profile.get("injuries", []), home=home))
+
+    return format_sections(number for number in numbers if number)
+
+
+def build_exercise_candidates(input_data: dict) -> str:
+    """
+    要望（環境・器具）と申告された既往歴に合う種目を、種目ライブラリの索引から部位別に取得。
+
+    同じ入力から常に同じ候補になるよう、分析レポートのリスク要因（LLMの自由記述）では絞り込まない。
+    """
+    injuries = input_data.get("user_profile", {}).get("injuries", [])
+    candidates = get_exercise_library().candidates_for(input_data.get("preferences", {}), injuries)
+    return format_candidates(candidates)
+
 
 def create_planner_message(input_data: dict, analysis_report: dict) -> str:
     """分析結果からプランナー用のメッセージを生成"""
@@ -96,24 +136,46 @@ def create_planner_message(input_data: dict, analysis_report: dict) -> str:
 - リスク要因: {', '.join(analysis_report.get('risk_factors', ['なし']))}
 - 懸念事項: {', '.join(analysis_report.get('concerns', ['なし']))}
 
+## 参照知識（入力データから確定した専門知識）
+{build_reference_knowledge(input_data)}
+
+## 種目候補（環境・器具・既往歴で絞り込み済み。[]内はセクション番号）
+{build_exercise_candidates(input_data)}
+
 トレーニング分割法と具体的なメニューを提案してください。"""
 
 
-def _generate_training_plan(state: AgentState) -> dict:
-    """最終応答を生成するノード（TrainingPlan構造化出力を使用）"""
+def _generate_training_plan(state: AgentState, prefix=None) -> dict:
+    """
+    最終応答を生成するノード（TrainingPlan構造化出力を使用）
+
+    prefix（full_context モード）を指定した場合は、検索結果の代わりにキャッシュ済みの知識ベース全体を参照する。
+    知識ベースを添付しない設定（FULL_CONTEXT_KNOWLEDGE=0）では入力から確定したセクションのみを渡す
+    """
     input_data = state["input_data"]
     analysis_report = state["analysis_report"]
     messages = state["messages"]
 
-    tool_results = [msg.content for msg in messages if isinstance(msg, ToolMessage)]
-    context_text = "\n\n".join(tool_results) if tool_results else "専門知識なし"
+    if prefix is None:
+        tool_results = [msg.content for msg in messages if isinstance(msg, ToolMessage)]
+        context_parts = [build_reference_knowledge(input_data)] + tool_results
+        context_text = "\n\n".join(part for part in context_parts if part) or "専門知識なし"
+    elif prefix.documents:
+        context_text = "添付の専門知識ベース全体（目標別戦略・分割法・種目ライブラリ・リスクと代替種目）を参照すること。"
+    else:
+        context_text = build_reference_knowledge(input_data) or "専門知識なし"
+    # 種目を選ぶのはこの構造化出力のため、どちらのモードでも絞り込み済みの候補を渡す
+    context_text += f"""
+
+### 種目候補（環境・器具・既往歴で絞り込み済み。種目は原則この中から選ぶ）
+{build_exercise_candidates(input_data)}"""
 
     user_profile = input_data.get("user_profile", {})
     goal = input_data.get("goal", {})
 
     prompt = f"""以下の情報を元に、トレーニングプランを作成してください。
 
-## 専門知識（検索結果）
+## 専門知識（参照知識・検索結果）
 {context_text}
 
 ## ユーザー情報サマリー
@@ -129,19 +191,24 @@ def _generate_training_plan(state: AgentState) -> dict:
 
 上記を踏まえ、具体的な週間トレーニングプランを構造化して出力してください。"""
 
-    llm = get_llm(temperature=0.3)
-    structured_llm = llm.with_structured_output(TrainingPlan)
-    result = structured_llm.invoke(prompt)
+    result = invoke_structured("planner.final", TrainingPlan, prompt, prefix=prefix)
 
-    print("   [Planner] トレーニングプラン（構造化出力）を生成しました")
+    logger.info("トレーニングプラン（構造化出力）を生成しました")
     return {"training_plan": result.model_dump()}
 
 
-def build_planner_graph():
-    """トレーニングプラン生成ワークフローを構築"""
+def build_planner_graph(context_mode: str = "rag"):
+    """
+    トレーニングプラン生成ワークフローを構築
+
+    context_mode="full_context" の場合はツール呼び出しループを省略し、知識ベース全体を参照して最終生成のみを行う
+    """
+    prefix = full_context_prefix("planner", SYSTEM_PROMPT) if context_mode == "full_context" else None
     return build_tool_agent_graph(
         tools=TOOLS,
         system_prompt=SYSTEM_PROMPT,
-        final_node_fn=_generate_training_plan,
-        temperature=0.3,
+        final_node_fn=lambda state: _generate_training_plan(state, prefix),
+        stage="planner",
+        skip_tool_loop=prefix is not None,
+        budget=LOOP_BUDGET,
     )
@@ -1,6 +1,11 @@
 from langchain_core.tools import tool
 from core.common.retriever import search_knowledge
 
+# プラン設計に使うコレクション（リスクは risk_modification_tool で検索する）
+TRAINING_COLLECTIONS = ("body_types", "progression", "exercises")
+# リスク対策に使うコレクション（体型別リスクと代替種目）
+RISK_COLLECTIONS = ("risks", "exercises")
+
 
 @tool
 def training_retriever_tool(query: str) -> str:
@@ -10,7 +15,6 @@ def training_retriever_tool(query: str) -> str:
     【検索可能なカテゴリ (v3.1)】
     - 体型別戦略: 代謝特性、栄養戦略、有酸素運動ガイド
     - 種目検索: 「家でできる脚トレ」「ダンベルの背中種目」「初心者向け定番」
-    - リスク管理: 関節リスク、代謝リスク、ホルモンリスク
     - 進行モデル: 初級(線形)〜上級(ピリオダイゼーション)
     - その他: リカバリー、サプリメント、左右差
 
@@ -21,7 +25,7 @@ def training_retriever_tool(query: str) -> str:
     Returns:
         str: 検索結果のテキスト
     """
-    return search_knowledge(query, k=4, fetch_k=12)
+    return search_knowledge(query, k=4, fetch_k=12, collections=TRAINING_COLLECTIONS)
 
 
 @tool
@@ -41,4 +45,6 @@ def risk_modification_tool(risk_factors: str) -> str:
     Returns:
         str: リスク対策の検索結果
     """
-    return search_knowledge(f"リスク 対策 代替種目 {risk_factors}", k=3, fetch_k=8, lambda_mult=0.6)
\ No newline at end of file
+    return search_knowledge(
+        f"リスク 対策 代替種目 {risk_factors}", k=3, fetch_k=8, lambda_mult=0.6, collections=RISK_COLLECTIONS
+    )
\ No newline at end of file